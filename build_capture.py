@@ -29,83 +29,91 @@ import sys
 import argparse
 import re
 import copy
-import configparser
 import hashlib
 import json
-import queue
+import time
+import threading
+import contextlib
 
 import capture.source_detective as source_detective
 import capture.building_process as building_process
-import capture.build_filter as build_filter
+import capture.compile_db as compile_db
 
-import capture.pool.pool as pool
+import capture.pool.executor as executor
+import capture.pool.progress as progress
+import capture.pool.scheduler as scheduler
+import capture.pool.watchdog as watchdog
 import capture.utils.capture_util as capture_util
+import capture.utils.spawn as spawn
+import capture.utils.json_stream as json_stream
+import capture.utils.object_cache as object_cache
+import capture.utils.preprocess as preprocess
+import capture.utils.flag_table as flag_table
+import capture.utils.instrument as instrument
+import capture.utils.profiling as profiling
+import capture.conf.settings as settings
 
 import logging
 import capture.conf.parse_logger as parse_logger
 logger = logging.getLogger("capture")
 
+# Backends only needed by some modes are imported on first use.
+build_filter = capture_util.lazy_module("capture.build_filter")
+watch = capture_util.lazy_module("capture.watch")
+server = capture_util.lazy_module("capture.server")
+remote = capture_util.lazy_module("capture.remote")
 try:
-    import redis
+    redis = capture_util.lazy_module("redis")
 except ImportError:
     sys.path.append(os.path.join(os.path.curdir, "utils"))
-    import redis
+    redis = capture_util.lazy_module("redis")
 
 
 # Basic config
-DEFAULT_CONFIG_FOLDER = os.path.join("capture", "conf")
-DEFAULT_CONFIG_FILE = os.path.join(DEFAULT_CONFIG_FOLDER, "capture.cfg")
 DEFAULT_COMPILER_ID = "GNU"
 DEFAULT_BUILDING_TYPE = "other"
+# Field used for compiler invocation in compile_commands.json, "command" or "arguments".
+OUTPUT_FORMATS = ("command", "arguments")
+DEFAULT_OUTPUT_FORMAT = "command"
 
-
-def load_compiler(config, compiler_map):
-    compiler_ids = config.get("Compiler", "compiler_id").split(",")
-    c_compilers = config.get("Compiler", "c_compiler").split(",")
-    cxx_compilers = config.get("Compiler", "cxx_compiler").split(",")
-    if len(compiler_ids) != len(c_compilers) or len(cxx_compilers) != len(compiler_ids):
-        logger.critical("Compiler configure error!")
-
-    for compiler_id, c_compiler, cxx_compiler in zip(compiler_ids, c_compilers, cxx_compilers):
-        compiler_map[compiler_id] = {
-            "CXX": cxx_compiler,
-            "C": c_compiler
-        }
-    return compiler_map, compiler_map[compiler_ids[0]]["CXX"]
-
-
-COMPILER_COMMAND_MAP = {}
-config = configparser.ConfigParser()
-config.read(DEFAULT_CONFIG_FILE)
-DEFAULT_LOG_CONFIG_FILE = config.get("Default", "logging_config")
-DEFAULT_LOG_CONFIG_FILE = os.path.join(DEFAULT_CONFIG_FOLDER, DEFAULT_LOG_CONFIG_FILE)
-DEFAULT_FLAGS = config.get("Default", "default_flags").split(" ")
-DEFAULT_MACROS = config.get("Default", "default_macros").split(",")
-DEFAULT_CXX_FLAGS = config.get("Default", "default_cxx_flags").split()
-COMPILER_COMMAND_MAP, DEFAULT_COMPILE_COMMAND = load_compiler(config, COMPILER_COMMAND_MAP)
+_settings = settings.get_settings()
+DEFAULT_CONFIG_FILE = _settings.config_file
+DEFAULT_LOG_CONFIG_FILE = _settings.log_config_file
+DEFAULT_FLAGS = _settings.default_flags
+DEFAULT_MACROS = _settings.default_macros
+DEFAULT_CXX_FLAGS = _settings.default_cxx_flags
+COMPILER_COMMAND_MAP = _settings.compiler_map
+DEFAULT_COMPILE_COMMAND = _settings.default_compile_command
 
 
 class CommandBuilder(building_process.ProcessBuilder):
     """Multiprocess for building compile commands."""
+    def __getstate__(self):
+        # Connection pool can't be pickled, and workers don't use it.
+        state = super(CommandBuilder, self).__getstate__()
+        state.pop("redis_pool", None)
+        return state
+
     def redis_setting(self, host="localhost", port=6379, db=0):
         self.redis_pool = redis.ConnectionPool(host=host, port=port, db=db)
 
-    def basic_setting(self, compile_command, output_path, generate_bitcode):
+    def basic_setting(self, compile_command, output_path, generate_bitcode, output_format=DEFAULT_OUTPUT_FORMAT):
+        """
+        :param compile_command:
+        :param output_path:
+        :param generate_bitcode:
+        :param output_format:           "command" for shell command string, "arguments" for argv list.
+        """
         self.compile_command = compile_command
         self.output_path = output_path
         self.generate_bitcode = generate_bitcode
+        self.output_format = output_format
 
-    def mission(self, q, result):
+    def mission(self, jobs):
         pid = os.getpid()
         logger.info("Process pid:%d start." % pid)
-        is_empty = False
-        while not is_empty:
-            try:
-                job_dict = q.get(block=True, timeout=self.timeout)
-            except queue.Empty:
-                is_empty = True
-                continue
-
+        result = []
+        for job_dict in jobs:
             # build args
             try:
                 directory = job_dict.get("exec_directory", os.path.curdir)
@@ -117,89 +125,129 @@ class CommandBuilder(building_process.ProcessBuilder):
                 includes = job_dict.get("includes", [])
                 compiler_type = job_dict.get("compiler_type", "CXX")
 
-                flag_string = ""
-                for flag in global_flags:
-                    flag_string += flag + " "
-                definition_string = ""
-                for definition in definitions:
-                    definition_string += "-D" + definition + " "
-                include_string = ""
-                for include in includes:
-                    include_string += "-I" + include + " "
-                args_string = flag_string + definition_string + include_string
+                # Shared by all sources of this target, build them only once.
+                prefix_args = list(global_flags)
+                prefix_args.extend(["-D" + definition for definition in definitions])
+                prefix_args.extend(["-I" + include for include in includes])
+                args_string = " ".join(prefix_args)
+                if self.output_format == "arguments":
+                    prefix_argv = []
+                    for arg in prefix_args:
+                        prefix_argv.extend(capture_util.shell_token_to_args(arg))
+                args_md5 = args_MD5Base(global_flags, definitions, includes)
+                compiler = self.compile_command.get(compiler_type, "g++")
+                bitcode_compiler = "clang++" if compiler_type == "CXX" else "clang"
 
                 # custom flags
                 for i, src in enumerate(sources):
-                    custom_args_string = ""
+                    custom_args = []
                     if i in custom_flags:
-                        for flag in custom_flags[i]:
-                            custom_args_string += flag + " "
+                        custom_args.extend(custom_flags[i])
                     if i in custom_definitions:
-                        for definition in custom_definitions[i]:
-                            custom_args_string += "-D" + definition + " "
+                        custom_args.extend(["-D" + definition for definition in custom_definitions[i]])
+                    custom_args_string = " ".join(custom_args)
 
-                    transfer_name = file_args_MD5Calc(src, global_flags, definitions, includes, custom_args_string)
-                    output_command = " " + args_string
-                    output_command += custom_args_string
-                    output_command += "-c " + src + " "
+                    transfer_name = file_args_MD5Finish(args_md5, src, custom_args_string)
+                    object_file = os.path.join(self.output_path, transfer_name + ".o")
+                    bitcode_file = os.path.join(self.output_path, transfer_name + ".bc")
 
                     json_dict = {
                         "directory": directory,
                         "file": src,
                     }
 
+                    if self.output_format == "arguments":
+                        # Tokens are kept as list, the shell quoting of them are resolved here.
+                        file_args = list(prefix_argv)
+                        for custom_arg in custom_args:
+                            file_args.extend(capture_util.shell_token_to_args(custom_arg))
+                        file_args.extend(("-c", src))
+
+                        if self.generate_bitcode:
+                            json_dict["bitcode_arguments"] = [bitcode_compiler] + file_args + \
+                                                             ["-flto", "-o", bitcode_file]
+                        json_dict["arguments"] = [compiler] + file_args + ["-o", object_file]
+                        result.append(json_dict)
+                        continue
+
+                    output_command = " ".join(filter(None, (args_string, custom_args_string, "-c", src)))
                     if self.generate_bitcode:
-                        output_bitcode_command = "clang" + output_command + "-flto "
-                        if job_dict["compiler_type"] == "CXX":
-                            output_bitcode_command = "clang++" + output_command + "-flto "
-
-                        output_bitcode_command += "-o " + os.path.join(self.output_path, transfer_name + ".bc ")
-                        json_dict["bitcode_command"] = output_bitcode_command
-                    output_command += "-o " + os.path.join(self.output_path, transfer_name + ".o ")
+                        json_dict["bitcode_command"] = " ".join((
+                            bitcode_compiler, output_command, "-flto", "-o", bitcode_file))
 
-                    output_command = self.compile_command.get(compiler_type, "g++")\
-                                     + output_command
                     # replaced_command = capture_util.replace_escape(output_command)
                     # json_dict["command"] = replaced_command
-                    json_dict["command"] = output_command
+                    json_dict["command"] = " ".join((compiler, output_command, "-o", object_file))
                     result.append(json_dict)
             except ValueError:
                 logger.warning("Building command of [{}] fail.".format(json.dumps(job_dict)))
 
         logger.info("Process pid:%d Complete." % pid)
-        return
+        return result
 
 
-def command_exec_worker(get_item_func):
-    logger.info("Thread: %s start." % pool.threading.currentThread().getName())
-    is_empty = False
-    while not is_empty:
-        try:
-            job_dict = get_item_func(block=True, timeout=1.0)
-        except queue.Empty:
-            is_empty = True
-            continue
+def command_exec_one(job_dict, watcher=None):
+    directory = job_dict.get("directory", None)
+    file = job_dict.get("file", None)
+    command = job_dict.get("command", None) or job_dict.get("arguments", None)
 
-        directory = job_dict.get("directory", None)
-        file = job_dict.get("file", None)
-        command = job_dict.get("command", None)
+    if file and command:
+        # Compiler output is only logged in debug level, otherwise it is not read at all.
+        debug = logger.isEnabledFor(logging.DEBUG)
+        (returncode, out, truncated) = spawn.run(command, cwd=directory, capture=debug,
+                                                 max_output=spawn.DEFAULT_MAX_OUTPUT, watcher=watcher)
+    else:
+        logger.warning("Illegal compile_command object: %s" % json.dumps(job_dict))
+        return None
 
-        if file and command:
-            (returncode, out, err) = capture_util.subproces_calling(command, cwd=directory)
-        else:
-            logger.warning("Illegal compile_command object: %s" % json.dumps(job_dict))
-            continue
+    logger.info(" CC Building {}".format(file))
+    if out:
+        logger.debug(out.decode("utf-8", "replace"))
+        if truncated:
+            logger.debug("Output of %s is truncated to %d bytes." % (file, spawn.DEFAULT_MAX_OUTPUT))
 
-        logger.info(" CC Building {}".format(file))
-        if out:
-            logger.debug(out.decode("utf-8"))
+    if returncode != 0:
+        logger.info("compile: %s fail" % file)
+    else:
+        logger.info("compile: %s success" % file)
+    return returncode
+
+
+def command_exec_preprocessed(job_dict, unit, data, watcher=None):
+    """Compile preprocessed source data of the command, instead of preprocessing it again, see command_exec_one."""
+    debug = logger.isEnabledFor(logging.DEBUG)
+    returncode, out, truncated = preprocess.compile_preprocessed(unit, data, watcher=watcher, capture=debug)
+    file = job_dict.get("file", None)
+    logger.info(" CC Building {} (preprocessed)".format(file))
+    if out:
+        logger.debug(out.decode("utf-8", "replace"))
+        if truncated:
+            logger.debug("Output of %s is truncated to %d bytes." % (file, spawn.DEFAULT_MAX_OUTPUT))
+    if returncode != 0:
+        logger.info("compile: %s fail" % file)
+    else:
+        logger.info("compile: %s success" % file)
+    return returncode
 
-        if returncode != 0:
-            logger.info("compile: %s fail" % file)
-        else:
-            logger.info("compile: %s success" % file)
-    logger.info("Thread: %s stop." % pool.threading.currentThread().getName())
-    return
+
+def command_exec_remote(job_dict, remote_pool, unit, data):
+    """
+    Compile preprocessed source on a capture worker.
+    :return:                        returncode, None if no worker is free or the worker fails
+    """
+    result = remote_pool.compile(unit, data)
+    if result is None:
+        return None
+    returncode, out = result
+    file = job_dict.get("file", None)
+    logger.info(" CC Building {} (remote)".format(file))
+    if out:
+        logger.debug(out)
+    if returncode != 0:
+        logger.info("compile: %s fail" % file)
+    else:
+        logger.info("compile: %s success" % file)
+    return returncode
 
 
 def bigFileMD5Calc(file):
@@ -245,33 +293,50 @@ def file_transfer(filename, path):
     return fileMD5Calc(file)
 
 
-def file_args_MD5Calc(file, flags, definitions, includes, custom_arg):
+def args_MD5Base(flags, definitions, includes):
     """
-    File may be compiled multi times, so we need custom flags to identify them.
-    :param file:
+    Hash the shared arguments of a target once, the result is used as pre-seeded state for each source file.
+    Arguments are hashed in sorted order without changing the given lists.
     :param flags:
     :param definitions:
     :param includes:
+    :return:                        hashlib md5 object
+    """
+    m = hashlib.md5()
+    for configs in (flags, definitions, includes):
+        for line in sorted(configs):
+            m.update(line.encode("utf8"))
+    return m
+
+
+def file_args_MD5Finish(args_md5, file, custom_arg):
+    """
+    Finish hashing of one source file, based on a copy of target arguments hash state.
+    :param args_md5:                result of args_MD5Base
+    :param file:
     :param custom_arg:              flags for compiling this source file.
     :return:
     """
-    m = hashlib.md5()
+    m = args_md5.copy()
     m.update(file.encode("utf8"))
-
-    args = (flags, definitions, includes)
-    for configs in args:
-        try:
-            configs.sort()
-        except AttributeError:
-            copy_configs = [item for item in configs]
-            configs = copy_configs
-        for line in configs:
-            m.update(line.encode("utf8"))
     if custom_arg:
         m.update(custom_arg.encode("utf8"))
     return m.hexdigest()
 
 
+def file_args_MD5Calc(file, flags, definitions, includes, custom_arg):
+    """
+    File may be compiled multi times, so we need custom flags to identify them.
+    :param file:
+    :param flags:
+    :param definitions:
+    :param includes:
+    :param custom_arg:              flags for compiling this source file.
+    :return:
+    """
+    return file_args_MD5Finish(args_MD5Base(flags, definitions, includes), file, custom_arg)
+
+
 def file_info_save(redis_instance, filename, source_path, transfer_name, definition, flags):
     seria_data = (source_path, filename, definition, flags)
     redis_instance.set(transfer_name, json.dumps(seria_data))
@@ -292,29 +357,31 @@ def get_file_info(redis_instance, transfer_name):
     return seria_data
 
 
-def commands_dump(output_path, compile_commands):
+def commands_dump(output_path, compile_commands, indent=json_stream.DEFAULT_INDENT, compression=None):
     """
     Dumping compile_commands
     Args:
         output_path:
-        compile_commands:       data needed for building compile_commands.json
+        compile_commands:       data needed for building compile_commands.json, can be any iterable
+        indent:                 None for compact output
+        compression:            none, gzip or zstd
     """
-    try:
-        with open(output_path, 'w') as fout:
-            json.dump(compile_commands, fout, indent=4)
-    except json.JSONDecodeError:
-        logger.critical("Dumping")
-
+    with json_stream.JsonArrayWriter(json_stream.output_file_path(output_path, compression),
+                                     indent=indent, compression=compression) as writer:
+        writer.write_many(compile_commands)
     return
 
 
-def scan_data_dump(output_path, scan_data, compile_commands=None, saving_to_db=False):
+def scan_data_dump(output_path, scan_data, compile_commands=None, saving_to_db=False,
+                   indent=json_stream.DEFAULT_INDENT, compression=None):
     """
     Dump data after scanning
     :param output_path:
     :param scan_data:
     :param compile_commands:
     :param saving_to_db:            whether need to save to redis
+    :param indent:                  None for compact output
+    :param compression:             none, gzip or zstd
     :return:
     """
     if saving_to_db:
@@ -322,12 +389,12 @@ def scan_data_dump(output_path, scan_data, compile_commands=None, saving_to_db=F
         redis_instance = redis.Redis(connection_pool=pool)
         for parse in scan_data:
             compiler_confs = {
-                "includes": parse["includes"],
-                "definitions": parse["definitions"],
+                "includes": list(parse["includes"]),
+                "definitions": list(parse["definitions"]),
                 "compiler_type": parse["compiler_type"],
                 "config_from": parse["config_from"],
                 "exec_directory": parse["exec_directory"],
-                "flags": parse["flags"]
+                "flags": list(parse["flags"])
             }
             for i, file in enumerate(parse["source_files"]):
                 custom_flags = parse[i]
@@ -340,8 +407,12 @@ def scan_data_dump(output_path, scan_data, compile_commands=None, saving_to_db=F
                 # TODO： Here is false keyword, we should use hash-name instead.
                 redis_instance.set(file, saving_json_line)
 
-    with open(output_path, 'w') as fout:
-        json.dump(scan_data, fout, indent=4)
+    # Shared flag sets are serialized once, and referenced by id in source_infos.
+    flag_sets, compact_infos = flag_table.compact_source_infos(scan_data)
+    with json_stream.JsonArrayWriter(json_stream.output_file_path(output_path, compression),
+                                     indent=indent, compression=compression,
+                                     array_key="source_infos", fields={"flag_sets": flag_sets}) as writer:
+        writer.write_many(compact_infos)
     return
 
 
@@ -352,7 +423,14 @@ class CaptureBuilder(object):
                  build_path=None,
                  prefers=None,
                  compiler_id=None,
-                 extra_build_args=None):
+                 extra_build_args=None,
+                 output_format=DEFAULT_OUTPUT_FORMAT,
+                 compact_json=False,
+                 compression=None,
+                 shard_by="none",
+                 shard_size=compile_db.DEFAULT_SHARD_SIZE,
+                 monolithic=False,
+                 process_pool=None):
         if prefers:
             self.__prefers = prefers
         else:
@@ -376,6 +454,20 @@ class CaptureBuilder(object):
             self.__compiler_id = DEFAULT_COMPILER_ID
 
         self._extra_build_args = extra_build_args
+        self.__output_format = output_format
+        self.__json_indent = None if compact_json else json_stream.DEFAULT_INDENT
+        self.__compression = json_stream.check_compression(compression)
+        self.__shard_by = shard_by
+        self.__shard_size = shard_size
+        self.__monolithic = monolithic
+        if shard_by != "none" and not monolithic and self.__compression != "none":
+            raise ValueError("Shards are not compressed, compression of sharded compile database needs monolithic.")
+        # Project walks shared by all analyzers, the project is walked once.
+        self.__walks = {}
+        # Flag sets of this capture, every builder has its own table, so concurrent captures of server don't mix.
+        self.__flag_table = flag_table.FlagTable()
+        # Shared process pool of capture server, None for creating pool in every mission.
+        self.__process_pool = process_pool
 
     def add_prefer_folder(self, folder):
         self.__prefers.append(folder)
@@ -439,8 +531,10 @@ class CaptureBuilder(object):
     def _tranfer_compile_db(self, sub_paths, files_s, files_h, compile_db):
         include_files = files_h
         files_count = len(files_s)
-        source_infos = []
-        sources_refers = set()
+        compile_entries = []
+        # Project walk result indexed with insertion order, and the sources claimed by compile_db.
+        walk_sources = dict.fromkeys(files_s)
+        claimed_sources = set()
         # get make prebuild command
         for command_info in compile_db:
             source_file = command_info.get("file", None)
@@ -455,12 +549,10 @@ class CaptureBuilder(object):
                 source_file = os.path.abspath(os.path.join(directory, source_file))
 
             # exclude prebuilded source files from project total sources
-            try:
-                files_s.remove(source_file)
-                sources_refers.add(source_file)
-            except ValueError:
-                if source_file not in sources_refers:
-                    logger.warning("file: %s not found, project scan error!" % (source_file))
+            if source_file in walk_sources:
+                claimed_sources.add(source_file)
+            else:
+                logger.warning("file: %s not found, project scan error!" % (source_file))
 
             includes = filter(lambda flag: True if flag[:2] == "-I" else False, flags)
             final_includes = map(lambda flag: flag[2:] if flag[2] != ' ' else flag[3:], includes)
@@ -470,24 +562,22 @@ class CaptureBuilder(object):
 
             final_flags = filter(lambda flag: True if flag[:2] != "-I" and flag[:2] != "-D" else False, flags)
 
-            file_infos = {
-                "source_files": [source_file,],
-                "definitions": list(final_definitions),
-                "includes": list(final_includes),
-                "flags": list(final_flags),
-                "exec_directory": directory,
-                "compiler_type": command_info["compiler"],
-                "custom_flags": [],
-                "custom_definitions": [],
-                "config_from": []
-            }
-            source_infos.append(file_infos)
+            compile_entries.append(flag_table.CompileEntry(
+                source_file, directory, command_info["compiler"],
+                self.__flag_table.intern(final_flags),
+                self.__flag_table.intern(final_definitions),
+                self.__flag_table.intern(final_includes)))
+
+        # Entries with the same flags are built as one target.
+        source_infos = flag_table.group_compile_entries(compile_entries, self.__flag_table)
 
         # Use sub_paths to build up globle includes, and get system includes
         # Build up command for left source files
-        self._build_default_commands(sub_paths, files_s, source_infos)
+        left_files_s = [source_file for source_file in walk_sources if source_file not in claimed_sources]
+        self._build_default_commands(sub_paths, left_files_s, source_infos)
         return source_infos, include_files, files_count
 
+    @instrument.timed()
     def scan_project(self):
         """
         Scan project files and get project statistic result. If present built_type analyze fail, capture will trying
@@ -501,7 +591,8 @@ class CaptureBuilder(object):
                 self.__build_path = os.path.join(self.__root_path, "build")
 
             cmake_analyzer = source_detective.CMakeAnalyzer(self.__root_path,
-                                                            self.__output_path, self.__prefers, self.__build_path)
+                                                            self.__output_path, self.__prefers, self.__build_path,
+                                                            walks=self.__walks)
             source_infos, include_files, files_count = cmake_analyzer.get_project_infos()
 
         if self.__build_type == "cmakelist":
@@ -509,7 +600,8 @@ class CaptureBuilder(object):
                 self.__build_path = os.path.join(self.__output_path, "build")
 
             cmakelists_analyzer = source_detective.CMakeListAnalyzer(self.__root_path,
-                                                                self.__output_path, self.__prefers, self.__build_path)
+                                                                self.__output_path, self.__prefers, self.__build_path,
+                                                                walks=self.__walks)
             source_infos, include_files, files_count = cmakelists_analyzer.get_project_infos_cmakelist()
 
         elif self.__build_type == "autotools":
@@ -518,14 +610,15 @@ class CaptureBuilder(object):
 
             autotools_analyzer = source_detective.AutoToolsAnalyzer(self.__root_path,
                                                                     self.__output_path, self.__prefers,
-                                                                    self.__build_path)
+                                                                    self.__build_path, walks=self.__walks)
 
             source_infos, include_files, files_count = autotools_analyzer.get_project_infos_autotools()
 
         elif self.__build_type == "make":
             # scan project files
             make_analyzer = source_detective.MakeAnalyzer(self.__root_path,
-                                                          self.__output_path, self.__prefers, self.__build_path)
+                                                          self.__output_path, self.__prefers, self.__build_path,
+                                                          walks=self.__walks)
             try:
                 sub_paths, files_s, files_h, compile_db = \
                     make_analyzer.get_project_infos_make(build_args=self._extra_build_args)
@@ -545,7 +638,8 @@ class CaptureBuilder(object):
 
         elif self.__build_type == "scons":
             scons_analyzer = source_detective.SConsAnalyzer(self.__root_path,
-                                                            self.__output_path, self.__prefers, self.__build_path)
+                                                            self.__output_path, self.__prefers, self.__build_path,
+                                                            walks=self.__walks)
 
             try:
                 sub_paths, files_s, files_h, compile_db = \
@@ -567,7 +661,8 @@ class CaptureBuilder(object):
             # in order to get more information in building compile_commands.json.
 
             analyzer = source_detective.Analyzer(self.__root_path,
-                                                 self.__output_path, self.__prefers, self.__build_path)
+                                                 self.__output_path, self.__prefers, self.__build_path,
+                                                 walks=self.__walks)
             sub_paths, files_s, files_h = analyzer.get_project_infos()
             include_files = files_h
             files_count = len(files_s)
@@ -575,11 +670,17 @@ class CaptureBuilder(object):
             self._build_default_commands(sub_paths, files_s, source_infos)
 
         logger.info("End of Scaning project folders...")
+        flag_table.intern_source_infos(source_infos, self.__flag_table)
+        logger.info("Distinct flag sets: %d" % len(self.__flag_table))
+        instrument.count("sources", files_count)
+        instrument.count("source_infos", len(source_infos))
 
         # dumping data
-        scan_data_dump(os.path.join(self.__output_path, "project_scan_result.json"), list(source_infos))
+        scan_data_dump(os.path.join(self.__output_path, "project_scan_result.json"), source_infos,
+                       indent=self.__json_indent, compression=self.__compression)
         return source_infos, include_files, files_count
 
+    @instrument.timed()
     def judge_building(self):
         """Here we will check directly executing building tools, ignore the configure file content checking."""
         if self.__build_type == "other":
@@ -638,53 +739,310 @@ class CaptureBuilder(object):
             logger.info("Without other Useful tools, using default build_type:[%s]", self.__build_type)
             self.__build_path = self.__root_path
 
-    def command_prebuild(self, source_infos, generate_bitcode, files_count):
+    def reset_project_walk(self):
+        """Forget project walks, the next scan walks project again (only modified folders are listed)."""
+        self.__walks.clear()
+
+    def project_folders(self):
+        """All folders walked by analyzers."""
+        folders = []
+        for walk in self.__walks.values():
+            folders.extend(walk.folders)
+        return folders
+
+    def select_prebuild_infos(self, source_infos):
+        """If using such build type, the last two source_infos are default items, we default not building them."""
+        if self.__build_type in ["cmake", "make", "scons", "autotools", "cmakelist"]:
+            return source_infos[:-2]
+        return source_infos
+
+    def _create_command_builder(self, generate_bitcode):
         command_builder = CommandBuilder(timeout=1.0)
-        command_builder.distribute_jobs(source_infos)
         # setting basic config for process
         command_builder.basic_setting(COMPILER_COMMAND_MAP[self.__compiler_id],
-                                      self.__output_path, generate_bitcode)
+                                      self.__output_path, generate_bitcode, self.__output_format)
         command_builder.redis_setting()
-        result_list = command_builder.run()
+        return command_builder
+
+    def _split_bitcode_entry(self, json_ob):
+        """Pop bitcode command out of entry, return bitcode entry or None."""
+        bitcode_field = "bitcode_" + self.__output_format
+        if bitcode_field not in json_ob:
+            return None
+        command = json_ob.pop(bitcode_field)
+        # Values are never modified later, a shallow copy is enough.
+        bc_json_ob = dict(json_ob)
+        bc_json_ob[self.__output_format] = command
+        return bc_json_ob
+
+    @instrument.timed()
+    def command_prebuild(self, source_infos, generate_bitcode, files_count, update_all=False):
+        """
+        Build compile commands of sources, and write them into compile database batch by batch as workers produce
+            them. Every batch is filtered when it is written, only commands needing recompile are kept in memory.
+        :param update_all:              recompile all commands
+        :return:                        commands needing recompile
+        """
+        command_builder = self._create_command_builder(generate_bitcode)
+        command_builder.distribute_jobs(source_infos)
+        build_filter_ins = build_filter.BuildFilter(self.__output_path)
+        build_filter_ins.start(update_all)
+        output_list = []
+        commands_count = 0
+        bitcode_count = 0
+        with self._open_commands_writer("compile_commands") as writer, \
+                self._open_commands_writer("compile_commands_bc") as bc_writer:
+            for batch in command_builder.run_iter(name="command_prebuild",
+                                                  status_path=os.path.join(self.__output_path,
+                                                                           progress.DEFAULT_STATUS_FILE),
+                                                  process_pool=self.__process_pool):
+                batch_commands = []
+                for json_ob in batch:
+                    bc_json_ob = self._split_bitcode_entry(json_ob)
+                    if bc_json_ob is not None:
+                        bc_writer.write(bc_json_ob)
+                        batch_commands.append(bc_json_ob)
+                        bitcode_count += 1
+                    writer.write(json_ob)
+                    batch_commands.append(json_ob)
+                    commands_count += 1
+                output_list.extend(self.command_filter(build_filter_ins, batch_commands))
+        build_filter_ins.finish()
+
+        for db_name in ("compile_commands", "compile_commands_bc"):
+            self._merge_monolithic(db_name)
+        logger.info("All compile_commands count: %d" % (commands_count + bitcode_count))
+        logger.info("Need to recompile commands count: %d" % len(output_list))
+        instrument.count("commands", commands_count)
+        instrument.count("bitcode_commands", bitcode_count)
+        instrument.count("recompile", len(output_list))
+        return output_list
 
+    def build_commands(self, source_infos, generate_bitcode):
+        """
+        Build compile commands in present process without writing them, for small incremental updates the process
+            pool start up costs more than the work.
+        :return:            compile commands, bitcode compile commands
+        """
+        command_builder = self._create_command_builder(generate_bitcode)
         output_list = []
         bitcode_output_list = []
-        while len(result_list):
-            json_ob = result_list.pop()
-            if "bitcode_command" in json_ob:
-                command = json_ob.pop("bitcode_command")
-                bc_json_ob = copy.deepcopy(json_ob)
-                bc_json_ob["command"] = command
+        for json_ob in command_builder.mission(list(source_infos)):
+            bc_json_ob = self._split_bitcode_entry(json_ob)
+            if bc_json_ob is not None:
                 bitcode_output_list.append(bc_json_ob)
             output_list.append(json_ob)
-
-        commands_dump(os.path.join(self.__output_path, "compile_commands.json"), output_list)
-        commands_dump(os.path.join(self.__output_path, "compile_commands_bc.json"), bitcode_output_list)
         return output_list, bitcode_output_list
 
-    def command_filter(self, compile_commands, bc_compile_commands, update_all=False):
-        commands = copy.deepcopy(compile_commands)
-        commands.extend(bc_compile_commands)
-        logger.info("All compile_commands count: %d" % len(commands))
-
-        build_filter_ins = build_filter.BuildFilter(self.__output_path)
-        transfer_names = map(lambda obj: source_path_MD5Calc(obj["file"]), commands)
-        output_list = build_filter_ins.filter_building_source(list(transfer_names), commands, update_all)
+    def dump_commands(self, db_name, compile_commands):
+        """Rewrite whole compile database, unsharded database is replaced atomically."""
+        with self._open_commands_writer(db_name, atomic=True) as writer:
+            writer.write_many(compile_commands)
+        self._merge_monolithic(db_name)
 
-        logger.info("Need to recompile commands count: %d" % len(output_list))
-        return output_list
-
-    def command_exec(self, commands):
-        thread_pool = pool.Pool(command_exec_worker)
-        for item in commands:
-            thread_pool.add_item(item)
+    def patch_commands(self, db_name, changes, compile_commands):
+        """
+        Update entries of changed sources. Only shards holding them are rewritten, unsharded database is a single
+            json array, so it is rewritten atomically from compile_commands.
+        :param changes:                 {source path: entries}, empty entries for removed source
+        :param compile_commands:        all entries after changes
+        """
+        if self.__shard_by == "none":
+            self.dump_commands(db_name, compile_commands)
+            return
+        compile_db.patch_shards(compile_db.index_file_path(self.__output_path, db_name), changes,
+                                self.__root_path, shard_by=self.__shard_by)
+        self._merge_monolithic(db_name)
+
+    def _merge_monolithic(self, db_name):
+        if self.__shard_by == "none" or not self.__monolithic:
+            return
+        compile_db.merge_shards(compile_db.index_file_path(self.__output_path, db_name),
+                                json_stream.output_file_path(os.path.join(self.__output_path, db_name + ".json"),
+                                                             self.__compression),
+                                indent=self.__json_indent, compression=self.__compression)
+
+    def _open_commands_writer(self, db_name, atomic=False):
+        if self.__shard_by == "none":
+            return json_stream.JsonArrayWriter(
+                json_stream.output_file_path(os.path.join(self.__output_path, db_name + ".json"),
+                                             self.__compression),
+                self.__json_indent, self.__compression, atomic=atomic)
+        return compile_db.ShardedWriter(self.__output_path, self.__root_path, db_name=db_name,
+                                        shard_by=self.__shard_by, shard_size=self.__shard_size)
+
+    def command_filter(self, build_filter_ins, commands):
+        """Commands of one batch needing recompile, see build_filter.BuildFilter.filter_batch."""
+        file_codes = [source_path_MD5Calc(obj["file"]) for obj in commands]
+        return build_filter_ins.filter_batch(file_codes, commands)
+
+    @instrument.timed()
+    def command_exec(self, commands, co_schedule=True, object_cache=None, remote_pool=None, pair_compile=True):
+        """
+        Run compile commands, longest first by compile time of last captures.
+        Commands killed by watchdog for memory pressure are run again after the others, with half concurrency in
+        every retry round.
+        :param commands:
+        :param co_schedule:             dispatch .o and .bc commands of a source next to each other
+        :param object_cache:            ObjectCache which objects are linked from and saved into, None for no cache
+        :param remote_pool:             remote.RemotePool compiling preprocessed sources on capture workers, commands
+                                            run locally when all workers are busy
+        :param pair_compile:            run .o and .bc commands of a source as one task, the source is preprocessed
+                                            once for both when they use the same compiler (compiler_id=Clang)
+        """
+        timing_table = scheduler.TimingTable.load(os.path.join(self.__output_path, scheduler.DEFAULT_TIMING_FILE))
+        commands = scheduler.order_commands(commands, timing_table, co_schedule=co_schedule or pair_compile)
+        tasks = scheduler.group_pairs(commands) if pair_compile else [[command] for command in commands]
+        logger.info("Command_exec: %d commands in %d tasks, %d with known compile time."
+                    % (len(commands), len(tasks), len(timing_table)))
+
+        watchdog_instance = watchdog.current()
+        requeued = []
+        exec_counts = {"shared_preprocessing": 0, "cached": 0, "failed": 0}
+        counter_lock = threading.Lock()
+
+        def _count(name):
+            with counter_lock:
+                exec_counts[name] += 1
+
+        def _parse_unit(job_dict):
+            command = job_dict.get("command", None) or job_dict.get("arguments", None)
+            if not job_dict.get("file") or not command:
+                return None
+            return preprocess.CompileUnit.parse(command, job_dict.get("directory", None), job_dict["file"])
+
+        def _preprocess(unit, handle):
+            # Preprocessor is a local child process too, it takes a slot like local compiling with remote workers.
+            with executor.subprocess_slot() if remote_pool is not None else contextlib.nullcontext():
+                returncode, data = preprocess.preprocess(unit, watcher=handle)
+            # Errors are reported by compiling locally.
+            return data if returncode == 0 else None
+
+        def _compile(job_dict, handle, unit, data):
+            entry = object_cache.entry(unit, data) if object_cache is not None else None
+            if entry is not None:
+                if object_cache.fetch(entry):
+                    logger.info("compile: %s cached" % job_dict["file"])
+                    return 0, True
+                entry.remove_output()
+
+            returncode = None
+            if remote_pool is not None and data is not None:
+                returncode = command_exec_remote(job_dict, remote_pool, unit, data)
+            if returncode is None:
+                # Executor doesn't hold slots with remote workers, local compiling takes one here.
+                with executor.subprocess_slot() if remote_pool is not None else contextlib.nullcontext():
+                    # Compiled from the preprocessed source the cache key is made of, it is preprocessed only once.
+                    if data is not None:
+                        returncode = command_exec_preprocessed(job_dict, unit, data, watcher=handle)
+                    else:
+                        returncode = command_exec_one(job_dict, watcher=handle)
+            if returncode != 0 and handle is not None and handle.killed in watchdog.KILL_REQUEUE_REASONS:
+                requeued.append(job_dict)
+            elif returncode != 0:
+                _count("failed")
+            elif entry is not None:
+                object_cache.store(entry)
+            return returncode, False
+
+        def _exec_task(jobs):
+            """Compile commands of a task one by one, a pair sharing preprocessing is compiled from one preprocessing."""
+            units = [_parse_unit(job_dict) for job_dict in jobs] \
+                if object_cache is not None or remote_pool is not None or len(jobs) > 1 else [None] * len(jobs)
+            shared = len(units) == 2 and units[0] is not None and units[0].shares_preprocessing(units[1])
+            returncode = 0
+            data = None
+            for i, (job_dict, unit) in enumerate(zip(jobs, units)):
+                start_time = time.perf_counter()
+                handle = watchdog_instance.handle() if watchdog_instance is not None else None
+                if shared and i > 0:
+                    if data is not None:
+                        _count("shared_preprocessing")
+                elif unit is not None and (shared or object_cache is not None or remote_pool is not None):
+                    data = _preprocess(unit, handle)
+                else:
+                    data = None
+                job_returncode, cached = _compile(job_dict, handle, unit, data)
+                # Cache hits tell nothing about compile time.
+                if cached:
+                    _count("cached")
+                elif job_returncode == 0:
+                    timing_table.record(scheduler.timing_key(job_dict), time.perf_counter() - start_time)
+                returncode = returncode or job_returncode
+            return returncode
+
+        progress_monitor = progress.ProgressMonitor("command_exec", len(tasks),
+                                                    status_path=os.path.join(self.__output_path,
+                                                                             progress.DEFAULT_STATUS_FILE))
+        # Compilers are child processes, every running command holds a subprocess slot. With remote workers, there
+        # are threads for local slots and all worker slots.
+        exec_slot = executor.SLOT_SUBPROCESS
+        exec_workers = None
+        if remote_pool is not None:
+            exec_slot = None
+            exec_workers = executor.get_slots().limit(executor.SLOT_SUBPROCESS) + remote_pool.capacity
+        # Watched commands run in their own process groups and don't get the interrupt from terminal, they are killed
+        # before running tasks are waited.
+        on_cancel = watchdog_instance.terminate_all if watchdog_instance is not None else None
+        exec_pool = executor.Executor(_exec_task, name="command_exec", slot=exec_slot, workers=exec_workers,
+                                      progress=progress_monitor, on_cancel=on_cancel)
+        workers = exec_pool.workers_count
+        retries = 0
+        recovered = 0
         try:
-            thread_pool.init_thread_pool(thread_pool.get_item)
-            thread_pool.join_thread_pool()
+            with exec_pool:
+                exec_pool.map(tasks)
+            progress_monitor.finish()
+
+            max_retries = settings.get_settings().watchdog_max_retries
+            retry_round = 0
+            while requeued and retry_round < max_retries:
+                retry_round += 1
+                workers = max(1, workers // 2)
+                retry_commands = list(requeued)
+                del requeued[:]
+                retries += len(retry_commands)
+                logger.info("Command_exec retry round %d: %d commands killed by watchdog, %d workers."
+                            % (retry_round, len(retry_commands), workers))
+                exec_pool = executor.Executor(_exec_task, name="command_exec_retry", slot=exec_slot,
+                                              workers=workers, on_cancel=on_cancel)
+                with exec_pool:
+                    exec_pool.map([job_dict] for job_dict in retry_commands)
+                recovered += len(retry_commands) - len(requeued)
         except KeyboardInterrupt:
-            thread_pool.set_terminated()
-            logger.critical("Command_exec thread pool has terminated.")
+            # Waiting commands are dropped and running ones are killed by on_cancel, then workers are waited. The
+            # interruption may come while workers are waited without cancelling, so it is cancelled here again.
+            exec_pool.shutdown(wait=False, cancel=True)
+            exec_pool.shutdown()
+            logger.critical("Command_exec executor has terminated.")
             sys.exit(-1)
+        finally:
+            timing_table.save()
+
+        if object_cache is not None:
+            object_cache.evict()
+            cache_stats = object_cache.stats()
+            logger.info("Object cache: %d hits, %d misses, %d uncacheable (%.2f %% hit rate), %d stored."
+                        % (cache_stats["hits"], cache_stats["misses"], cache_stats["uncacheable"],
+                           cache_stats["hit_rate"], cache_stats["stored"]))
+        instrument.count("commands", len(commands))
+        instrument.count("tasks", len(tasks))
+        instrument.count("retried", retries)
+        instrument.count("given_up", len(requeued))
+        for name, value in exec_counts.items():
+            instrument.count(name, value)
+        if exec_counts["shared_preprocessing"]:
+            logger.info("Command_exec: %d commands compiled from preprocessed source of their object commands."
+                        % exec_counts["shared_preprocessing"])
+        if remote_pool is not None:
+            logger.info("Remote workers compiled: %s" % ", ".join("%s: %d" % item
+                                                                  for item in sorted(remote_pool.stats().items())))
+        if watchdog_instance is not None:
+            watchdog_stats = watchdog_instance.stats()
+            logger.info("Command_exec summary: %d commands, %d killed by watchdog (%s), %d retried, %d recovered, "
+                        "%d given up." % (len(commands), watchdog_stats["killed"],
+                                          ", ".join("%s: %d" % item for item in sorted(watchdog_stats["kills"].items())),
+                                          retries, recovered, len(requeued)))
 
 
 def parse_prefer_str(prefer_str, input_path):
@@ -696,30 +1054,8 @@ def parse_prefer_str(prefer_str, input_path):
     return prefers
 
 
-def main():
-    """
-        The process of build_capture.py:
-
-        If the input arguments are `project_root_path` and `result_output_path`, will use default configure.
-        The default more will firstly setting build_type as other, and step by step checking usable building type.
-
-        1. If there is a CMakeLists.txt file in project. We will set build_type=cmake.
-            i. Create a new directory named 'build' under result_output_path
-            ii. Move in 'build', and execute command: `cmake ${project_root_path}` to building cmake_building info.
-            iii. If cmake building success, entry the cmake analysis process.
-                If cmake building fail, will continue other checking.
-        2. I there is a 'configure' in root_project_path, using autotools building. set build_type=make.
-            i. same as 1.i.
-            ii. Move in 'build', and execute command: `${project_root_path}/configure` to building configure info.
-            iii. If configure success, set build_path as build, and go to make -n analysis.
-                If configure fail, will continue other checking.
-        3. If there is a 'SConstruct' in project_root_path, using scons building. set build_type=scons.
-            go to scons -n analysis.
-           If no 'SConstruct', continue other checking.
-        4. If there is a 'Makefile' in project_root_path, using make -n building. set build_type=make.
-        5. If 1-4 checking are all fail, we may using default command builder. set build_type=other.
-
-    """
+def create_parser():
+    """Arguments of build_capture.py, requests of capture server use the same arguments."""
     parser = argparse.ArgumentParser(description="")
     parser.add_argument("project_root_path",
                         help="The project root path you want to analyze.")
@@ -751,11 +1087,64 @@ def main():
     parser.add_argument("--extra_build_args", default="",
                         help='Arguments used in building tools. Usage: [--extra_build_args=" ARGS1 ARGS2.. "]')
 
+    parser.add_argument("--output_format", default=DEFAULT_OUTPUT_FORMAT, choices=OUTPUT_FORMATS,
+                        help="Compile database entry format, 'command' is a shell command string, "
+                             "'arguments' is an argv list without shell quoting. (default: %(default)s)")
+
+    parser.add_argument("--compact_json", action='store_true',
+                        help="Dump json result files without indent.")
+
+    parser.add_argument("--compress", default="none", choices=json_stream.COMPRESSIONS,
+                        help="Compression of compile_commands.json and scan result files. (default: %(default)s)")
+
+    parser.add_argument("--shard", default="none", choices=compile_db.SHARD_MODES,
+                        help="Split compile database into shards by top level directory or by entries count, "
+                             "with an index file for lookup. Shards are compact and uncompressed, --compact_json and "
+                             "--compress apply to the --monolithic file. (default: %(default)s)")
+
+    parser.add_argument("--shard_size", default=compile_db.DEFAULT_SHARD_SIZE, type=int,
+                        help="Max entries count in one shard. (default: %(default)s)")
+
+    parser.add_argument("--monolithic", action='store_true',
+                        help="Also produce monolithic compile_commands.json by concatenating shards.")
+
+    parser.add_argument("--remote_workers", default=None, metavar="HOST:PORT,...",
+                        help="Compile commands on capture workers too, start worker by: build_capture.py worker "
+                             "--listen HOST:PORT. (default: workers in capture.cfg)")
+    parser.add_argument("--object_cache", action='store_true',
+                        help="Link objects of identical commands from the object cache instead of compiling them, "
+                             "sources are preprocessed for the cache keys. (default: enabled in capture.cfg)")
+    parser.add_argument("--no_co_schedule", action='store_true',
+                        help="Dispatch .o and .bc commands of a source independently, instead of one after another.")
+    parser.add_argument("--no_pair_compile", action='store_true',
+                        help="Run .o and .bc commands of a source as two tasks, instead of one task preprocessing the "
+                             "source once for both when they use the same compiler.")
+
+    parser.add_argument("--profile", default=profiling.MODE_NONE, choices=profiling.PROFILE_MODES,
+                        help="Profile capture and its worker processes, results are saved in result_output_path: "
+                             "'cprofile' for merged cProfile stats, 'sample' for folded stacks of SIGPROF sampling "
+                             "(flamegraph.pl input), 'all' for both. (default: %(default)s)")
+
     parser.add_argument("-n", "--just-print", "--dry-run", action='store_true',
                         help="Just output compile_commands.json and other info, without running commands.")
 
-    args = vars(parser.parse_args())
+    parser.add_argument("--watch", action='store_true',
+                        help="Keep running, and update compile_commands.json when project files change. "
+                             "Commands are not executed in watch mode.")
+
+    parser.add_argument("--server", default=None, metavar="SOCKET",
+                        help="Send the capture request to capture server listening on unix socket SOCKET, "
+                             "start server by: build_capture.py serve --socket SOCKET")
+
+    return parser
 
+
+def run_capture(args, process_pool=None):
+    """
+    Run one capture.
+    :param args:                        parsed arguments dict, see create_parser
+    :param process_pool:                shared process pool of capture server, None for creating pools of this capture
+    """
     input_path = args.get("project_root_path", None)
     output_path = args.get("result_output_path", None)
     build_type = args.get("build_type", "other")
@@ -766,6 +1155,19 @@ def main():
     update_all = args.get("update_all", False)
     extra_build_args = args.get("extra_build_args", "")
     build_path = args.get("build_path", "")
+    output_format = args.get("output_format", DEFAULT_OUTPUT_FORMAT)
+    compact_json = args.get("compact_json", False)
+    compression = args.get("compress", "none")
+    shard_by = args.get("shard", "none")
+    shard_size = args.get("shard_size", compile_db.DEFAULT_SHARD_SIZE)
+    monolithic = args.get("monolithic", False)
+    watch_mode = args.get("watch", False)
+    co_schedule = not args.get("no_co_schedule", False)
+    pair_compile = co_schedule and not args.get("no_pair_compile", False)
+    use_object_cache = args.get("object_cache", False) or settings.get_settings().object_cache_enabled
+    profile_mode = args.get("profile", profiling.MODE_NONE)
+    remote_workers = [address for address in (args.get("remote_workers") or "").split(",") if address.strip()] \
+        or settings.get_settings().remote_workers
 
     # parse_logger.addConsoleHandler()
     if input_path is None or output_path is None:
@@ -776,49 +1178,129 @@ def main():
     output_path = os.path.abspath(output_path)
 
     logger_path = os.path.join(output_path, "capture.log")
-    parse_logger.addFileHandler(logger_path, "capture")
-
-    if just_print:
-        logger.info("Using dry-run mode.")
+    file_handler = parse_logger.addFileHandler(logger_path, "capture")
+    # Only logs of this capture, other requests of capture server run in other threads.
+    file_handler.addFilter(parse_logger.ThreadFilter(threading.current_thread().name))
+    # Commands and probes of this capture are watched for memory and time limits.
+    watchdog_instance = watchdog.Watchdog.from_settings().start()
+    # Phases of this capture are dumped next to capture.log.
+    profiler = instrument.Profiler().start()
+    profile_session = profiling.Session(profile_mode, output_path).start()
+    try:
+        if just_print:
+            logger.info("Using dry-run mode.")
+
+        # Get prefers directories
+        if "all" in prefers:
+            prefers = parse_prefer_str("all", input_path)
+        logger.info("prefer directories: %s" % str(prefers))
+
+        if compiler_id not in COMPILER_COMMAND_MAP:
+            logger.warning("No such compiler_id! Use default compiler_id")
+            compiler_id = None
+
+        def create_capture_builder():
+            capture_builder = CaptureBuilder(input_path, output_path, compiler_id=compiler_id,
+                                             prefers=prefers, build_type=build_type, build_path=build_path,
+                                             extra_build_args=extra_build_args, output_format=output_format,
+                                             compact_json=compact_json, compression=compression,
+                                             shard_by=shard_by, shard_size=shard_size, monolithic=monolithic,
+                                             process_pool=process_pool)
+            if build_type == "other":
+                capture_builder.judge_building()
+            return capture_builder
+
+        if watch_mode:
+            logger.info("Using watch mode.")
+            watch.CaptureWatcher(create_capture_builder, generate_bitcode=generate_bitcode).run()
+            return
+
+        # CaptureBuilder
+        capture_builder = create_capture_builder()
+        source_infos, include_files, files_count = capture_builder.scan_project()
+        logger.info("all files: %d, all includes: %d" % (files_count, len(include_files)))
+
+        filter_result = capture_builder.command_prebuild(capture_builder.select_prebuild_infos(source_infos),
+                                                         generate_bitcode, files_count, update_all)
+        if not just_print:
+            logger.info("Start building object file and bc file.")
+            remote_pool = None
+            if remote_workers:
+                _settings = settings.get_settings()
+                remote_pool = remote.RemotePool.connect(remote_workers, _settings.remote_connect_timeout,
+                                                        _settings.remote_job_timeout)
+            try:
+                capture_builder.command_exec(filter_result, co_schedule=co_schedule,
+                                             object_cache=object_cache.ObjectCache.from_settings()
+                                             if use_object_cache else None,
+                                             remote_pool=remote_pool, pair_compile=pair_compile)
+            finally:
+                if remote_pool is not None:
+                    remote_pool.close()
+            logger.info("Building object file and bc file completed.")
+        else:
+            files = map(lambda x: x.get("file", ""), filter_result)
+            files = sorted(files)
+            file_name = "files_need_to_compile.txt"
+            with open(os.path.join(output_path, file_name), "w") as fout:
+                for file in files:
+                    fout.write(file + "\n")
+            logger.info("Dumping files need to compile in %s." % file_name)
+    finally:
+        profile_session.stop()
+        profiler.stop()
+        profiler.dump(os.path.join(output_path, instrument.DEFAULT_PROFILE_FILE))
+        watchdog_instance.stop()
+        logger.removeHandler(file_handler)
+        file_handler.close()
 
-    # Get prefers directories
-    if "all" in prefers:
-        prefers = parse_prefer_str("all", input_path)
-    logger.info("prefer directories: %s" % str(prefers))
 
-    if compiler_id not in COMPILER_COMMAND_MAP:
-        logger.warning("No such compiler_id! Use default compiler_id")
-        compiler_id = None
+def main():
+    """
+        The process of build_capture.py:
 
-    # CaptureBuilder
-    capture_builder = CaptureBuilder(input_path, output_path, compiler_id=compiler_id,
-                                     prefers=prefers, build_type=build_type, build_path=build_path,
-                                     extra_build_args=extra_build_args)
+        If the input arguments are `project_root_path` and `result_output_path`, will use default configure.
+        The default more will firstly setting build_type as other, and step by step checking usable building type.
 
-    if build_type == "other":
-        capture_builder.judge_building()
-    source_infos, include_files, files_count = capture_builder.scan_project()
-    logger.info("all files: %d, all includes: %d" % (files_count, len(include_files)))
+        1. If there is a CMakeLists.txt file in project. We will set build_type=cmake.
+            i. Create a new directory named 'build' under result_output_path
+            ii. Move in 'build', and execute command: `cmake ${project_root_path}` to building cmake_building info.
+            iii. If cmake building success, entry the cmake analysis process.
+                If cmake building fail, will continue other checking.
+        2. I there is a 'configure' in root_project_path, using autotools building. set build_type=make.
+            i. same as 1.i.
+            ii. Move in 'build', and execute command: `${project_root_path}/configure` to building configure info.
+            iii. If configure success, set build_path as build, and go to make -n analysis.
+                If configure fail, will continue other checking.
+        3. If there is a 'SConstruct' in project_root_path, using scons building. set build_type=scons.
+            go to scons -n analysis.
+           If no 'SConstruct', continue other checking.
+        4. If there is a 'Makefile' in project_root_path, using make -n building. set build_type=make.
+        5. If 1-4 checking are all fail, we may using default command builder. set build_type=other.
 
-    # If using such build type, the last two source_infos are default items, we default not building them.
-    if capture_builder.build_type in ["cmake", "make", "scons", "autotools", "cmakelist"]:
-        result, bc_result = capture_builder.command_prebuild(source_infos[:-2], generate_bitcode, files_count)
-    else:
-        result, bc_result = capture_builder.command_prebuild(source_infos, generate_bitcode, files_count)
+    """
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        server.serve_main(sys.argv[2:], run_capture)
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "worker":
+        sys.exit(remote.worker_main(sys.argv[2:]))
 
-    filter_result = capture_builder.command_filter(result, bc_result, update_all)
-    if not just_print:
-        logger.info("Start building object file and bc file.")
-        capture_builder.command_exec(filter_result)
-        logger.info("Building object file and bc file completed.")
-    else:
-        files = map(lambda x: x.get("file", ""), filter_result)
-        files = sorted(files)
-        file_name = "files_need_to_compile.txt"
-        with open(os.path.join(output_path, file_name), "w") as fout:
-            for file in files:
-                fout.write(file + "\n")
-        logger.info("Dumping files need to compile in %s." % file_name)
+    parser = create_parser()
+    args = vars(parser.parse_args())
+    if args.get("shard", "none") != "none" and args.get("compress", "none") != "none" and not args.get("monolithic"):
+        parser.error("Shards are not compressed, --compress with --shard needs --monolithic.")
+
+    socket_path = args.pop("server", None)
+    if socket_path:
+        if args.get("watch"):
+            parser.error("--watch can't run in capture server.")
+        # Paths are relative to client working directory.
+        for key in ("project_root_path", "result_output_path", "build_path"):
+            if args.get(key):
+                args[key] = os.path.abspath(args[key])
+        sys.exit(server.request(socket_path, args))
+
+    run_capture(args)
 
 
 if __name__ == "__main__":
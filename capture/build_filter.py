@@ -13,11 +13,13 @@ import os
 import sys
 import time
 
+import capture.utils.capture_util as capture_util
+
 try:
-    import redis
+    redis = capture_util.lazy_module("redis")
 except ImportError:
     sys.path.append("./util/redis")
-    import redis
+    redis = capture_util.lazy_module("redis")
 
 import logging
 logger = logging.getLogger("capture")
@@ -91,40 +93,50 @@ class BuildFilter(object):
             status, result = _action(action, *args, **kwargs)
         return result
 
-    def filter_building_source(self, file_codes, compile_commands, update_all=False):
-        """
+    def start(self, update_all=False):
+        """Start filtering of a capture, batches are filtered by filter_batch, and saved by finish."""
+        if update_all:
+            self._redis_filename.flushall()
+            self._redis_update_time.flushall()
 
+    def filter_batch(self, file_codes, compile_commands, update_mapping=True):
+        """
+        Filter one batch of compile commands, .o and .bc commands of a source should be in the same batch.
         :param file_codes:
         :param compile_commands:
-        :param update_all:
+        :param update_mapping:                  save file_name mapping of the batch before checking
         :return:
             need_compile_commands:      compile_command in compile_commands needed to update
         """
-        need_compile_commands = []
-        files = []
-
-        if update_all:
-            self._redis_filename.flushall()
-            self._redis_update_time.flushall()
-
-        if self._redis_filename.dbsize() != len(file_codes):
+        if update_mapping:
             self.update_file_mapping(file_codes, compile_commands)
 
-        for tuple in zip(file_codes, compile_commands):
-            file_code = tuple[0]
-            json_obj = tuple[1]
-            file_path = json_obj["file"]
+        need_compile_commands = []
+        for file_code, json_obj in zip(file_codes, compile_commands):
             if self.check_update_time(file_code):
                 need_compile_commands.append(json_obj)
-            files.append(file_path)
 
-        for tuple in zip(file_codes, files):
-            self.set_update_time(tuple[0], tuple[1])
+        for file_code, json_obj in zip(file_codes, compile_commands):
+            self.set_update_time(file_code, json_obj["file"])
+        return need_compile_commands
 
+    def finish(self):
         self._do_action(self._redis_filename.save)
         self._do_action(self._redis_update_time.save)
 
-        return need_compile_commands
+    def filter_building_source(self, file_codes, compile_commands, update_all=False):
+        """
 
+        :param file_codes:
+        :param compile_commands:
+        :param update_all:
+        :return:
+            need_compile_commands:      compile_command in compile_commands needed to update
+        """
+        self.start(update_all)
+        need_compile_commands = self.filter_batch(file_codes, compile_commands,
+                                                  self._redis_filename.dbsize() != len(file_codes))
+        self.finish()
+        return need_compile_commands
 
 # vi:set tw=0 ts=4 sw=4 nowrap fdm=indent
@@ -9,17 +9,27 @@
     @Note:
 """
 
+import os
 import sys
 import time
 import multiprocessing
 import signal
 import logging
 
+from capture.pool.progress import ProgressMonitor
+import capture.pool.executor as executor
+import capture.utils.instrument as instrument
+import capture.utils.profiling as profiling
+
 logger = logging.getLogger("capture")
 
 # default configure
 CPU_CORE_COUNT = multiprocessing.cpu_count()
 
+# Builder instance used by pool workers. It is inherited by the forked worker processes via the pool initializer,
+# so the builder is never pickled per task.
+_worker_builder = None
+
 
 def register(func):
     def add_signal(*args, **kwargs):
@@ -28,100 +38,149 @@ def register(func):
     return add_signal
 
 
+@register
+def _init_worker(builder):
+    global _worker_builder
+    _worker_builder = builder
+
+
+def _run_mission(builder, jobs):
+    """:return:                     (pid, jobs count, seconds, cpu seconds, peak rss of worker, result batch)"""
+    start_time = time.perf_counter()
+    start_cpu = time.process_time()
+    if builder.profile_options is not None:
+        batch = profiling.profile_call(builder.profile_options, builder.mission, jobs)
+    else:
+        batch = builder.mission(jobs)
+    return os.getpid(), len(jobs), time.perf_counter() - start_time, time.process_time() - start_cpu, \
+        instrument.peak_rss(), batch
+
+
+def _run_chunk(jobs):
+    return _run_mission(_worker_builder, jobs)
+
+
+def _run_builder_chunk(builder_jobs):
+    """Chunk entry for shared process pool, the builder is sent with its chunk."""
+    builder, jobs = builder_jobs
+    return _run_mission(builder, jobs)
+
+
+def create_shared_pool(worker_num=CPU_CORE_COUNT):
+    """Process pool shared by missions of several builders, e.g. concurrent requests of capture server."""
+    return multiprocessing.Pool(processes=worker_num, initializer=_init_worker, initargs=(None,))
+
+
 class ProcessBuilder(object):
-    def __init__(self, process_logger=None, lock_nums=1, process_amount=CPU_CORE_COUNT, timeout=1.0):
+    def __init__(self, process_logger=None, process_amount=CPU_CORE_COUNT, timeout=1.0, chunk_size=None):
+        """
+        :param process_amount:              default worker count.
+        :param timeout:
+        :param chunk_size:                  jobs count sent to a worker at once, the default value is computed
+                                                from jobs count and worker count.
+        """
         self.process_amount = process_amount
-        self._manager = multiprocessing.Manager()
-        # self._queue = self._manager.Queue()
-        # self._queue = queue.Queue()
-        self._queue = multiprocessing.Queue()
+        self._jobs = []
         self._timeout = timeout
+        self._chunk_size = chunk_size
+        # profiling.WorkerOptions when capture runs with --profile, see run_iter.
+        self.profile_options = None
 
         self._logger = logger
 
         if process_logger is None:
             self._process_logger = logger
-        self.lock = [self._manager.Lock() for _ in range(lock_nums)]
+
+    def __getstate__(self):
+        # Builder is pickled with every chunk sent to shared pool, jobs are sent by chunks instead.
+        state = self.__dict__.copy()
+        state["_jobs"] = []
+        return state
 
     @property
     def timeout(self):
         return self._timeout
 
-    @register
-    def mission(self, queue, result):
-        """Multi process mission execution"""
-        pass
+    def mission(self, jobs):
+        """
+        Multi process mission execution.
+        :param jobs:                        a chunk of jobs.
+        :return:                            result list of this chunk, it is sent back to main process at once.
+        """
+        return []
 
     def distribute_jobs(self, jobs):
         """Mission distribution."""
-        for job in jobs:
-            self._queue.put(job)
+        self._jobs.extend(jobs)
 
     def log_mission(self, logger, level="debug", massage=""):
         """多进程读写日志"""
         log_function = getattr(logger, level.lower())
         log_function(massage)
 
-    def log_total_missions(self, queue, check_interval=1.0):
-        """Automatically report mission complete percent status"""
-        total_count = queue.qsize()
-        if total_count == 0:
-            self._logger.warning("No data in job queue.")
-            return
-        left_count = total_count
-        last_time = left_count
-        self._logger.info("Mission process: %f %%" % 0.0)
-        while left_count != 0:
-            if left_count != total_count and last_time != left_count:
-                self._logger.info("Mission process: %f %%" % \
-                    ((total_count - left_count) / float(total_count) * 100.0))
-                last_time = left_count
-            time.sleep(check_interval)
-            left_count = queue.qsize()
-        self._logger.info("Mission process: %f %%" % \
-                ((total_count - left_count) / float(total_count) * 100.0))
-        return
-
-    def run(self, process_log_path=None, worker_num=CPU_CORE_COUNT):
+    def _split_jobs(self, worker_num):
+        chunk_size = self._chunk_size
+        if not chunk_size:
+            # Several chunks per worker to keep balance, but large enough to make IPC cost ignorable.
+            chunk_size = max(1, len(self._jobs) // (worker_num * 4))
+        return [self._jobs[i:i + chunk_size] for i in range(0, len(self._jobs), chunk_size)]
+
+    def run_iter(self, worker_num=CPU_CORE_COUNT, status_path=None, name="mission", process_pool=None):
         """
-            Start running multi-process mission
+            Start running multi-process mission, and yield result batches as soon as workers finish them.
+            Every worker builds results of a jobs chunk locally, and sends them back in one batch.
+        :param status_path:             progress status file path
+        :param name:                    mission name used in progress report
+        :param process_pool:            shared pool from create_shared_pool, None for a pool of this mission only.
         """
-        resultlist = self._manager.list()
+        if len(self._jobs) == 0:
+            self._logger.warning("No data in job queue.")
+            return
+
+        chunks = self._split_jobs(worker_num)
         self._logger.info("Multiprocess mission Start...")
-        start_time = time.clock()
-
-        # 添加全局任务监控进程
-        process_list = []
-        p = multiprocessing.Process(target=self.log_total_missions, args=(self._queue,))
-        process_list.append(p)
-        p.start()
-
-        for i in range(worker_num):
-            p = multiprocessing.Process(target=self.mission,
-                                        args=(self._queue, resultlist,))
-            process_list.append(p)
-            p.start()
-
-        try:
-            for p in process_list:
-                p.join()
-        except KeyboardInterrupt:
-            for p in process_list:
-                p.terminate()
-                p.join()
-            logger.critical("Mission stop by keyboard!")
-            sys.exit(-1)
-
-        end_time = time.clock()
-        self._logger.info("All Process Time: %f" % (end_time - start_time))
+        # Set before workers get the builder, by forking or with every chunk.
+        session = profiling.current()
+        self.profile_options = session.worker_options() if session is not None else None
+
+        progress = ProgressMonitor(name, len(self._jobs), status_path=status_path)
+        if process_pool is None:
+            func, tasks = _run_chunk, chunks
+        else:
+            func, tasks = _run_builder_chunk, [(self, chunk) for chunk in chunks]
+        # Cpu time and memory of workers are not in capture process, workers report them with every chunk.
+        with instrument.phase("process_pool") as record:
+            record.count("jobs", len(self._jobs))
+            record.count("chunks", len(chunks))
+            try:
+                # Own pool is closed when all chunks are done, or terminated when the consumer stops iteration early.
+                with executor.ProcessExecutor(name, workers=min(worker_num, len(chunks)), initializer=_init_worker,
+                                              initargs=(self,), process_pool=process_pool) as process_executor:
+                    for pid, count, latency, cpu, rss, batch in process_executor.imap_unordered(func, tasks):
+                        progress.report(count, worker=pid, latency=latency)
+                        record.count("worker_cpu", cpu)
+                        record.peak("worker_peak_rss", rss)
+                        yield batch
+            except KeyboardInterrupt:
+                logger.critical("Mission stop by keyboard!")
+                sys.exit(-1)
+
+            progress.finish()
+        self._logger.info("All Process Time: %f, worker cpu time: %f" % (record.wall, record.counts["worker_cpu"]))
         self._logger.info("Multiprocess mission complete...")
+
+    def run(self, worker_num=CPU_CORE_COUNT, status_path=None, name="mission", process_pool=None):
+        """
+            Start running multi-process mission, and return all results in one list.
+        """
+        resultlist = []
+        for batch in self.run_iter(worker_num=worker_num, status_path=status_path, name=name,
+                                   process_pool=process_pool):
+            resultlist.extend(batch)
         return resultlist
 
     def mission_test(self, case):
-        _queue = self._manager.QUEUE()
-        for line in case:
-            _queue.put(line)
-        return self.mission(_queue, self.lock)
+        return self.mission(list(case))
 
 
 # vi:set tw=0 ts=4 sw=4 nowrap fdm=indent
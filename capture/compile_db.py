@@ -0,0 +1,426 @@
+# !/bin/env python
+# -*- coding: utf-8 -*_
+"""
+
+    @FileName: compile_db.py
+    @Author: zengzhishi(zengzs1995@gmail.com)
+    @CreatTime: 2018-04-04 11:05:47
+    @LastModif: 2018-04-04 11:05:47
+    @Note: Sharded compilation database.
+    Entries are split into shards by top level directory or by entries count, and an index file maps every source
+    file to (shard, offset, length), so a single entry can be read without loading the whole database.
+
+        compile_commands.index.json
+        compile_commands.d/0000-src.json
+        compile_commands.d/0001-lib.json
+        ...
+
+    Shards are always compact and uncompressed, entries are read by their offsets. Indent and compression only apply to
+    the monolithic database built by merge_shards. Watch mode updates changed sources by patch_shards, which rewrites
+    only shards holding them.
+
+    Usage:
+        index = CompileDBIndex("output/compile_commands.index.json")
+        entries = index.lookup("/project/src/main.c")
+"""
+
+import os
+import re
+import json
+import logging
+import collections
+
+import capture.utils.json_stream as json_stream
+
+logger = logging.getLogger("capture")
+
+SHARD_MODES = ("none", "directory", "count")
+DEFAULT_SHARD_SIZE = 10000
+# Open shard files of one writer, projects may have thousands of top level directories.
+MAX_OPEN_SHARDS = 64
+INDEX_VERSION = 1
+OTHER_SHARD_KEY = "_other"
+
+
+def index_file_path(output_path, db_name="compile_commands"):
+    return os.path.join(output_path, db_name + ".index.json")
+
+
+def shard_folder_path(output_path, db_name="compile_commands"):
+    return os.path.join(output_path, db_name + ".d")
+
+
+def entry_source_path(entry):
+    """Absolute source path of a compile entry, it is the key in index."""
+    file_path = entry["file"]
+    if not os.path.isabs(file_path):
+        file_path = os.path.join(entry.get("directory", ""), file_path)
+    return os.path.normpath(file_path)
+
+
+def shard_key(root_path, shard_by, source_path):
+    """Shard key of source, top level directory for directory mode, empty for count mode."""
+    if shard_by == "count":
+        return ""
+    if not source_path.startswith(root_path + os.path.sep):
+        return OTHER_SHARD_KEY
+    relative_path = source_path[len(root_path) + 1:]
+    if os.path.sep not in relative_path:
+        # Sources in top level folder.
+        return OTHER_SHARD_KEY
+    return relative_path.split(os.path.sep, 1)[0]
+
+
+def _shard_name(shard_id, key):
+    name = "%04d" % shard_id
+    if key:
+        name += "-" + re.sub(r"[^A-Za-z0-9_.+-]", "_", key)
+    return name + ".json"
+
+
+def _dump_index(index_path, index_data):
+    tmp_path = index_path + ".tmp"
+    with open(tmp_path, "w") as fout:
+        json.dump(index_data, fout)
+    os.replace(tmp_path, index_path)
+
+
+class _ShardFile(object):
+    """One shard, a compact json array with one entry per line."""
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self.closed = False
+        self._fout = open(path, "wb")
+        self._fout.write(b"[\n")
+        self._pos = 2
+
+    @property
+    def is_open(self):
+        return self._fout is not None
+
+    def write(self, entry):
+        """Write entry and return its (offset, length) in shard file."""
+        if self._fout is None:
+            # File handle is released by writer, continue at the end of shard.
+            self._fout = open(self.path, "ab")
+        data = json.dumps(entry).encode("utf8")
+        if self.count:
+            self._fout.write(b",\n")
+            self._pos += 2
+        offset = self._pos
+        self._fout.write(data)
+        self._pos += len(data)
+        self.count += 1
+        return offset, len(data)
+
+    def release(self):
+        """Close file handle only, the shard is reopened in append mode by next write."""
+        if self._fout is not None:
+            self._fout.close()
+            self._fout = None
+
+    def close(self, terminate=True):
+        if self.closed:
+            return
+        if terminate:
+            if self._fout is None:
+                self._fout = open(self.path, "ab")
+            self._fout.write(b"\n]\n" if self.count else b"]\n")
+        self.release()
+        self.closed = True
+
+
+class ShardedWriter(object):
+    """
+    Writer with the same interface as json_stream.JsonArrayWriter, but splits entries into shards.
+
+    shard_by:
+        directory           one shard per top level directory of project, big directory is split by shard_size.
+        count               a new shard every shard_size entries.
+
+    Shards of all top level directories stay writable, but at most max_open_shards of them keep open file handles,
+    the least recently written one is released and reopened in append mode when needed.
+    """
+    def __init__(self, output_path, root_path, db_name="compile_commands", shard_by="directory",
+                 shard_size=DEFAULT_SHARD_SIZE, max_open_shards=MAX_OPEN_SHARDS):
+        if shard_by not in SHARD_MODES[1:]:
+            raise ValueError("Unknown shard mode: %s" % shard_by)
+        self._root_path = os.path.abspath(root_path)
+        self._index_path = index_file_path(output_path, db_name)
+        self._shard_folder = shard_folder_path(output_path, db_name)
+        self._shard_by = shard_by
+        self._shard_size = shard_size if shard_size and shard_size > 0 else DEFAULT_SHARD_SIZE
+
+        if not os.path.exists(self._shard_folder):
+            os.makedirs(self._shard_folder)
+        else:
+            for file_name in os.listdir(self._shard_folder):
+                if file_name.endswith(".json"):
+                    os.remove(os.path.join(self._shard_folder, file_name))
+
+        self._shards = []               # shard file names, position is shard id
+        self._max_open_shards = max(1, max_open_shards)
+        self._opened = {}               # shard key -> (shard id, _ShardFile)
+        self._handles = collections.OrderedDict()   # shard id -> _ShardFile with open file, least recent first
+        self._files = {}                # source path -> [[shard id, offset, length], ...]
+        self._count = 0
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def index_path(self):
+        return self._index_path
+
+    def _get_shard(self, key):
+        if key in self._opened:
+            shard_id, shard = self._opened[key]
+            if shard.count < self._shard_size:
+                return shard_id, shard
+            shard.close()
+            self._handles.pop(shard_id, None)
+
+        shard_id = len(self._shards)
+        name = _shard_name(shard_id, key)
+        self._shards.append(name)
+        shard = _ShardFile(os.path.join(self._shard_folder, name))
+        self._opened[key] = (shard_id, shard)
+        return shard_id, shard
+
+    def write(self, entry):
+        source_path = entry_source_path(entry)
+        shard_id, shard = self._get_shard(shard_key(self._root_path, self._shard_by, source_path))
+        offset, length = shard.write(entry)
+        self._handles[shard_id] = shard
+        self._handles.move_to_end(shard_id)
+        while len(self._handles) > self._max_open_shards:
+            _, least_recent = self._handles.popitem(last=False)
+            least_recent.release()
+        self._files.setdefault(source_path, []).append([shard_id, offset, length])
+        self._count += 1
+
+    def write_many(self, entries):
+        for entry in entries:
+            self.write(entry)
+
+    def close(self):
+        if self._opened is None:
+            return
+        for _, shard in self._opened.values():
+            shard.close()
+        self._opened = None
+        self._handles.clear()
+
+        index_data = {
+            "version": INDEX_VERSION,
+            "shard_folder": os.path.basename(self._shard_folder),
+            "shards": self._shards,
+            "files": self._files,
+        }
+        _dump_index(self._index_path, index_data)
+        logger.info("Dumping %d entries into %d shards, index: %s" %
+                    (self._count, len(self._shards), self._index_path))
+
+    def abort(self):
+        """Stop writing, shards are left unterminated and no index is written, so nothing looks complete."""
+        if self._opened is None:
+            return
+        for _, shard in self._opened.values():
+            shard.close(terminate=False)
+        self._opened = None
+        self._handles.clear()
+        if os.path.exists(self._index_path):
+            # Index of last capture points to removed shards.
+            os.remove(self._index_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+        return False
+
+
+class CompileDBIndex(object):
+    """Lookup entries of sharded compilation database by seeking straight to them."""
+    def __init__(self, index_path):
+        with open(index_path, "r") as fin:
+            index_data = json.load(fin)
+        if index_data.get("version") != INDEX_VERSION:
+            raise ValueError("Unsupported compile database index version: %s" % index_data.get("version"))
+        self._shard_folder = os.path.join(os.path.dirname(os.path.abspath(index_path)), index_data["shard_folder"])
+        self._shards = index_data["shards"]
+        self._files = index_data["files"]
+        self._handles = {}
+
+    @property
+    def shard_paths(self):
+        return [os.path.join(self._shard_folder, name) for name in self._shards]
+
+    def files(self):
+        return self._files.keys()
+
+    def __contains__(self, source_path):
+        return os.path.normpath(os.path.abspath(source_path)) in self._files
+
+    def _read(self, shard_id, offset, length):
+        fin = self._handles.get(shard_id)
+        if fin is None:
+            fin = open(os.path.join(self._shard_folder, self._shards[shard_id]), "rb")
+            self._handles[shard_id] = fin
+        fin.seek(offset)
+        return json.loads(fin.read(length).decode("utf8"))
+
+    def lookup(self, source_path):
+        """Return all entries of the source file, empty list if not found."""
+        locations = self._files.get(os.path.normpath(os.path.abspath(source_path)), [])
+        return [self._read(shard_id, offset, length) for shard_id, offset, length in locations]
+
+    def lookup_directory(self, directory):
+        """Yield entries of all source files under the directory."""
+        prefix = os.path.normpath(os.path.abspath(directory)) + os.path.sep
+        for source_path, locations in self._files.items():
+            if source_path.startswith(prefix):
+                for shard_id, offset, length in locations:
+                    yield self._read(shard_id, offset, length)
+
+    def close(self):
+        for fin in self._handles.values():
+            fin.close()
+        self._handles = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+
+def _shard_entry_lines(index):
+    for shard_path in index.shard_paths:
+        with open(shard_path, "rb") as fin:
+            for line in fin:
+                line = line.rstrip(b",\n")
+                if line not in (b"[", b"]", b"[]", b""):
+                    yield line
+
+
+def _rewrite_shard(shard_path, changes):
+    """
+    Rewrite one shard with entries of changed sources replaced, the shard is replaced atomically.
+    :return:                        {source path: [[offset, length], ...]} of all entries in new shard
+    """
+    kept = []
+    if os.path.exists(shard_path):
+        with open(shard_path, "rb") as fin:
+            for line in fin:
+                line = line.rstrip(b",\n")
+                if line in (b"[", b"]", b"[]", b""):
+                    continue
+                entry = json.loads(line.decode("utf8"))
+                if entry_source_path(entry) not in changes:
+                    kept.append(entry)
+
+    locations = {}
+    tmp_path = shard_path + ".tmp"
+    shard = _ShardFile(tmp_path)
+    try:
+        for entry in kept:
+            locations.setdefault(entry_source_path(entry), []).append(list(shard.write(entry)))
+        for source_path, entries in changes.items():
+            for entry in entries:
+                locations.setdefault(source_path, []).append(list(shard.write(entry)))
+    except BaseException:
+        shard.close(terminate=False)
+        os.remove(tmp_path)
+        raise
+    shard.close()
+    os.replace(tmp_path, shard_path)
+    return locations
+
+
+def patch_shards(index_path, changes, root_path, shard_by="directory"):
+    """
+    Replace entries of changed sources, only shards holding them are rewritten. New sources are appended to the last
+        shard of their key, so shards may grow over shard_size until the database is written again by ShardedWriter.
+    :param changes:                 {source path: entries}, empty entries for removed source
+    :param root_path:
+    :param shard_by:                shard mode the database was written with
+    :return:                        ids of rewritten shards
+    """
+    with open(index_path, "r") as fin:
+        index_data = json.load(fin)
+    if index_data.get("version") != INDEX_VERSION:
+        raise ValueError("Unsupported compile database index version: %s" % index_data.get("version"))
+    shard_folder = os.path.join(os.path.dirname(os.path.abspath(index_path)), index_data["shard_folder"])
+    shards = index_data["shards"]
+    files = index_data["files"]
+    root_path = os.path.abspath(root_path)
+
+    shard_changes = {}              # shard id -> {source path: entries}
+    for source_path, entries in changes.items():
+        locations = files.get(source_path)
+        if locations:
+            # Entries of source are removed from all shards, and new entries take place of the first one.
+            for shard_id, _, _ in locations:
+                shard_changes.setdefault(shard_id, {}).setdefault(source_path, [])
+            shard_changes[locations[0][0]][source_path] = entries
+            continue
+        if not entries:
+            continue
+        key = shard_key(root_path, shard_by, source_path)
+        for shard_id in range(len(shards) - 1, -1, -1):
+            if shards[shard_id] == _shard_name(shard_id, key):
+                break
+        else:
+            shard_id = len(shards)
+            shards.append(_shard_name(shard_id, key))
+        shard_changes.setdefault(shard_id, {})[source_path] = entries
+
+    for shard_id, source_changes in shard_changes.items():
+        locations = _rewrite_shard(os.path.join(shard_folder, shards[shard_id]), source_changes)
+        for source_path in list(files):
+            if any(location[0] == shard_id for location in files[source_path]):
+                others = [location for location in files[source_path] if location[0] != shard_id]
+                if others:
+                    files[source_path] = others
+                else:
+                    del files[source_path]
+        for source_path, offsets in locations.items():
+            files.setdefault(source_path, []).extend([shard_id, offset, length] for offset, length in offsets)
+
+    _dump_index(index_path, index_data)
+    logger.info("Patching %d sources in %d shards, index: %s" % (len(changes), len(shard_changes), index_path))
+    return sorted(shard_changes)
+
+
+def merge_shards(index_path, output_path, indent=None, compression=None):
+    """
+    Build monolithic compile_commands.json from entry lines of all shards.
+    :param output_path:             with compression suffix, see json_stream.output_file_path
+    :param indent:                  None for compact mode, then entry lines are concatenated without parsing
+    :param compression:             none, gzip or zstd
+    """
+    index = CompileDBIndex(index_path)
+    if indent is not None or json_stream.check_compression(compression) != "none":
+        with json_stream.JsonArrayWriter(output_path, indent, compression) as writer:
+            for line in _shard_entry_lines(index):
+                writer.write(json.loads(line.decode("utf8")))
+            return writer.count
+
+    count = 0
+    with open(output_path, "wb") as fout:
+        fout.write(b"[")
+        for line in _shard_entry_lines(index):
+            fout.write(b"\n" + line if count == 0 else b",\n" + line)
+            count += 1
+        fout.write(b"\n]\n" if count else b"]\n")
+    return count
+
+# vi:set tw=0 ts=4 sw=4 nowrap fdm=indent
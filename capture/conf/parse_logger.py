@@ -82,6 +82,18 @@ def addFileHandler(filePath, logger_field="capture", format=None, levelname='non
         if level is not None:
             filehandler.setLevel(level)
         logger.addHandler(filehandler)
+        return filehandler
+
+
+class ThreadFilter(logging.Filter):
+    """Pass records of a thread and the threads named after it, e.g. MainThread and MainThread-worker-0."""
+    def __init__(self, thread_name):
+        super(ThreadFilter, self).__init__()
+        self._thread_name = thread_name
+        self._prefix = thread_name + "-"
+
+    def filter(self, record):
+        return record.threadName == self._thread_name or record.threadName.startswith(self._prefix)
 
 
 def getLogger(conf, logger_field="capture", new_output=None):
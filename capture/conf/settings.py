@@ -0,0 +1,104 @@
+# !/bin/env python
+# -*- coding: utf-8 -*_
+"""
+
+    @FileName: settings.py
+    @Author: zengzhishi(zengzs1995@gmail.com)
+    @CreatTime: 2018-04-13 09:51:24
+    @LastModif: 2018-04-13 09:51:24
+    @Note: Settings from capture.cfg, the file is parsed once on first use and shared by all modules.
+
+    Usage:
+        import capture.conf.settings as settings
+        settings.get_settings().source_file_suffix
+"""
+
+import os
+import configparser
+import threading
+
+CONFIG_FOLDER = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CONFIG_FILE = os.path.join(CONFIG_FOLDER, "capture.cfg")
+
+
+def _split(value, sep=","):
+    return [item.strip() for item in value.split(sep) if item.strip()]
+
+
+class Settings(object):
+    def __init__(self, config_file=DEFAULT_CONFIG_FILE):
+        config = configparser.ConfigParser()
+        if not config.read(config_file):
+            raise IOError("Can't read capture config file: %s" % config_file)
+        self.config_file = config_file
+
+        # Default
+        self.default_flags = config.get("Default", "default_flags").split()
+        self.default_macros = config.get("Default", "default_macros").split(",")
+        self.default_cxx_flags = config.get("Default", "default_cxx_flags").split()
+        self.c_file_suffix = set(config.get("Default", "source_c_suffix").split(","))
+        self.cxx_file_suffix = set(config.get("Default", "source_cxx_suffix").split(","))
+        self.source_file_suffix = self.c_file_suffix | self.cxx_file_suffix
+        self.include_file_suffix = set(config.get("Default", "include_suffix").split(","))
+        self.log_config_file = os.path.join(CONFIG_FOLDER, config.get("Default", "logging_config"))
+
+        # Compiler
+        compiler_ids = config.get("Compiler", "compiler_id").split(",")
+        c_compilers = config.get("Compiler", "c_compiler").split(",")
+        cxx_compilers = config.get("Compiler", "cxx_compiler").split(",")
+        if len(compiler_ids) != len(c_compilers) or len(cxx_compilers) != len(compiler_ids):
+            raise ValueError("Compiler configure error!")
+        self.compiler_map = {}
+        for compiler_id, c_compiler, cxx_compiler in zip(compiler_ids, c_compilers, cxx_compilers):
+            self.compiler_map[compiler_id] = {
+                "CXX": cxx_compiler,
+                "C": c_compiler
+            }
+        self.default_compile_command = self.compiler_map[compiler_ids[0]]["CXX"]
+
+        # Ignore
+        self.ignore_files = _split(config.get("Ignore", "ignore_files", fallback=""))
+        self.exclude_patterns = _split(config.get("Ignore", "exclude", fallback=""))
+
+        # Executor, 0 for cpu count
+        self.cpu_slots = config.getint("Executor", "cpu_slots", fallback=0)
+        self.subprocess_slots = config.getint("Executor", "subprocess_slots", fallback=0)
+        self.queue_size = config.getint("Executor", "queue_size", fallback=1024)
+
+        # Watchdog, 0 for no limit
+        self.watchdog_interval = config.getfloat("Watchdog", "interval", fallback=1.0)
+        self.watchdog_memory_percent = config.getfloat("Watchdog", "memory_percent", fallback=94.0)
+        self.watchdog_max_rss = config.getint("Watchdog", "max_rss_mb", fallback=0) * 1024 * 1024
+        self.watchdog_timeout = config.getfloat("Watchdog", "timeout", fallback=0)
+        self.watchdog_max_retries = config.getint("Watchdog", "max_retries", fallback=2)
+
+        # ObjectCache, empty path for ~/.cache/capture/objects
+        self.object_cache_enabled = config.getboolean("ObjectCache", "enabled", fallback=False)
+        self.object_cache_path = os.path.expanduser(config.get("ObjectCache", "path", fallback=""))
+        self.object_cache_max_size = config.getint("ObjectCache", "max_size_mb", fallback=5120) * 1024 * 1024
+
+        # Remote, comma separated HOST:PORT of capture workers, 0 for no job timeout
+        self.remote_workers = _split(config.get("Remote", "workers", fallback=""))
+        self.remote_connect_timeout = config.getfloat("Remote", "connect_timeout", fallback=5.0)
+        self.remote_job_timeout = config.getfloat("Remote", "job_timeout", fallback=0) or None
+        self.remote_token_file = config.get("Remote", "token_file", fallback="").strip() or None
+
+        # SCons
+        self.scons_verbose = config.get("SCons", "verbose").split(",")
+
+
+_settings = None
+_lock = threading.Lock()
+
+
+def get_settings():
+    """Shared settings, capture.cfg is parsed on first call."""
+    global _settings
+    if _settings is None:
+        with _lock:
+            if _settings is None:
+                _settings = Settings()
+    return _settings
+
+
+# vi:set tw=0 ts=4 sw=4 nowrap fdm=indent
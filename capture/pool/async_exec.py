@@ -0,0 +1,293 @@
+# !/bin/env python
+# -*- coding: utf-8 -*_
+"""
+
+    @FileName: async_exec.py
+    @Author: zengzhishi(zengzs1995@gmail.com)
+    @CreatTime: 2018-04-18 10:12:45
+    @LastModif: 2018-04-18 10:12:45
+    @Note: asyncio subprocess engine.
+    Many child processes are waited by one event loop instead of one thread each. Running processes are limited by a
+    semaphore sized to subprocess slots (and take outer make jobserver tokens), every job can have a timeout, and
+    results are returned as ProcessResult in job order. Jobs are watched by the current watchdog of the thread.
+    Commands are started without shell when possible, see spawn.split_command.
+    Children are reaped by the runner instead of the child watcher of asyncio: exits are seen by pidfd without reaping,
+    so watched process groups are unwatched while their pid can't be reused yet.
+
+    Usage:
+        results = run_jobs([ProcessJob("gcc -c a.c -o /dev/null", cwd="/project"), ...], timeout=60)
+        # first job succeeding in job order of every group, groups run at the same time
+        [(index, result), ...] = run_first_success([c_probe_jobs, cxx_probe_jobs])
+"""
+
+import os
+import time
+import signal
+import asyncio
+import logging
+import functools
+import threading
+import subprocess
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+import capture.pool.executor as executor
+import capture.pool.jobserver as jobserver
+import capture.pool.watchdog as watchdog
+import capture.utils.instrument as instrument
+import capture.utils.spawn as spawn
+
+logger = logging.getLogger("capture")
+
+_READ_SIZE = 64 * 1024
+
+ProcessJob = collections.namedtuple("ProcessJob", ["command", "cwd", "env", "timeout"], defaults=(None, None, None))
+ProcessResult = collections.namedtuple("ProcessResult", ["job", "returncode", "output", "truncated", "elapsed",
+                                                         "timed_out", "killed"])
+
+
+def _as_job(job):
+    return job if isinstance(job, ProcessJob) else ProcessJob(job)
+
+
+def _kill_group(process):
+    # Children of the job (e.g. cc1 of gcc) are killed too.
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def _release_late_token(client, future):
+    # Token got by the acquiring thread after its job is cancelled.
+    if future.cancelled() or future.exception() is not None:
+        return
+    token = future.result()
+    if token is not None:
+        client.release(token)
+
+
+class AsyncRunner(object):
+    """Run jobs in an event loop, one runner is used by one loop."""
+    def __init__(self, limit=None, timeout=None, capture=True, max_output=spawn.DEFAULT_MAX_OUTPUT,
+                 jobserver_client=None, watchdog_instance=None):
+        """
+        :param limit:                   max running processes, default is subprocess slots limit
+        :param timeout:                 default seconds limit of every job, None for no limit
+        :param capture:                 read output of jobs, or send it to /dev/null
+        :param max_output:              max bytes of output kept for a job, None for no limit
+        :param jobserver_client:        default is the client of outer make jobserver if there is one
+        :param watchdog_instance:       default is the current watchdog of the thread creating runner
+        """
+        self._limit = max(1, limit or executor.get_slots().limit(executor.SLOT_SUBPROCESS))
+        self._timeout = timeout
+        self._capture = capture
+        self._max_output = max_output
+        self._jobserver_client = jobserver_client if jobserver_client is not None else jobserver.get_client()
+        self._watchdog = watchdog_instance if watchdog_instance is not None else watchdog.current()
+        self._semaphore = None
+
+    @property
+    def limit(self):
+        return self._limit
+
+    async def _read_output(self, process):
+        loop = asyncio.get_running_loop()
+        stream = asyncio.StreamReader(limit=_READ_SIZE, loop=loop)
+        transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(stream, loop=loop),
+                                                    process.stdout)
+        chunks = []
+        size = 0
+        truncated = False
+        try:
+            while True:
+                data = await stream.read(_READ_SIZE)
+                if not data:
+                    break
+                if self._max_output is not None:
+                    left = self._max_output - size
+                    if len(data) > left:
+                        truncated = True
+                        data = data[:left]
+                if data:
+                    chunks.append(data)
+                    size += len(data)
+        finally:
+            transport.close()
+        return b"".join(chunks), truncated
+
+    async def _wait_exited(self, process):
+        """Wait until process exits without reaping it, see spawn.wait_exited."""
+        loop = asyncio.get_running_loop()
+        try:
+            pidfd = os.pidfd_open(process.pid)
+        except (AttributeError, OSError):
+            # No pidfd before Linux 5.3 and on other systems.
+            await loop.run_in_executor(None, spawn.wait_exited, process.pid)
+            return
+        exited = loop.create_future()
+        loop.add_reader(pidfd, lambda: exited.done() or exited.set_result(None))
+        try:
+            await exited
+        finally:
+            loop.remove_reader(pidfd)
+            os.close(pidfd)
+
+    async def _communicate(self, process):
+        output, truncated = None, False
+        if self._capture:
+            output, truncated = await self._read_output(process)
+        await self._wait_exited(process)
+        return output, truncated
+
+    async def _spawn(self, job):
+        command = job.command
+        if isinstance(command, (list, tuple)):
+            argv = list(command)
+        else:
+            argv = spawn.split_command(command) or [spawn.SHELL_PATH, "-c", command]
+        process = subprocess.Popen(argv, cwd=job.cwd or None, env=job.env, stdin=subprocess.DEVNULL,
+                                   stdout=subprocess.PIPE if self._capture else subprocess.DEVNULL,
+                                   stderr=subprocess.STDOUT, start_new_session=True)
+        instrument.count_subprocess()
+        return process
+
+    async def _acquire_token(self):
+        """
+        Jobserver token of outer make. Waiting for it blocks, so it runs in a thread, which is stopped when the job is
+        cancelled, e.g. by first_success, and gives back a token it still gets.
+        """
+        cancel = threading.Event()
+        future = asyncio.get_running_loop().run_in_executor(None, self._jobserver_client.acquire, cancel)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            cancel.set()
+            future.add_done_callback(functools.partial(_release_late_token, self._jobserver_client))
+            raise
+
+    async def run(self, job):
+        """Run one job, never raises for failing commands."""
+        job = _as_job(job)
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._limit)
+        async with self._semaphore:
+            token = None
+            if self._jobserver_client is not None:
+                token = await self._acquire_token()
+            try:
+                return await self._run(job)
+            finally:
+                if token is not None:
+                    self._jobserver_client.release(token)
+
+    async def _run(self, job):
+        start_time = time.perf_counter()
+        try:
+            process = await self._spawn(job)
+        except (OSError, ValueError) as e:
+            logger.warning("Subprocess command:[%s] execute fail: %s" % (job.command, e))
+            return ProcessResult(job, -1, None, False, time.perf_counter() - start_time, False, None)
+
+        handle = None
+        if self._watchdog is not None:
+            handle = self._watchdog.handle()
+            handle.watch(process.pid)
+        timeout = job.timeout if job.timeout is not None else self._timeout
+        try:
+            output, truncated = await asyncio.wait_for(self._communicate(process), timeout)
+            timed_out = False
+        except asyncio.TimeoutError:
+            logger.warning("Subprocess command:[%s] timeout after %ss, killed." % (job.command, timeout))
+            _kill_group(process)
+            await self._wait_exited(process)
+            output, truncated, timed_out = None, False, True
+        except BaseException:
+            _kill_group(process)
+            await self._wait_exited(process)
+            raise
+        finally:
+            # The child has exited but is not reaped yet, its pid can't be reused by another process group.
+            if handle is not None:
+                handle.unwatch(process.pid)
+            returncode = process.wait()
+            if process.stdout is not None:
+                process.stdout.close()
+        return ProcessResult(job, returncode, output, truncated, time.perf_counter() - start_time, timed_out,
+                             handle.killed if handle is not None else None)
+
+    async def run_all(self, jobs, on_result=None):
+        """
+        Run jobs concurrently, return results in job order.
+        :param on_result:               function(index, ProcessResult) called as soon as a job is done
+        """
+        jobs = [_as_job(job) for job in jobs]
+        results = [None] * len(jobs)
+        pending = collections.deque(enumerate(jobs))
+
+        async def _worker():
+            # Fixed workers instead of one task per job, so huge job lists don't create huge task lists.
+            while pending:
+                index, job = pending.popleft()
+                results[index] = await self.run(job)
+                if on_result is not None:
+                    on_result(index, results[index])
+
+        await asyncio.gather(*[_worker() for _ in range(min(self._limit, len(jobs)))])
+        return results
+
+    async def first_success(self, jobs):
+        """
+        Run jobs concurrently, return (index, result) of the first job in job order that succeeds, (None, None) if
+        all fail. Jobs after it are cancelled once it is known.
+        """
+        tasks = [asyncio.ensure_future(self.run(job)) for job in jobs]
+        try:
+            for index, task in enumerate(tasks):
+                result = await task
+                if result.returncode == 0:
+                    return index, result
+            return None, None
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def _run_loop(main):
+    """
+    Run coroutine main in a new event loop. Default executor threads (jobserver tokens, waiting processes without
+        pidfd) are named after the calling thread, so their logs pass parse_logger.ThreadFilter of capture requests.
+    """
+    thread_name_prefix = threading.current_thread().name + "-async"
+
+    async def _main():
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(thread_name_prefix=thread_name_prefix))
+        return await main
+    return asyncio.run(_main())
+
+
+def run_jobs(jobs, on_result=None, **runner_kwargs):
+    """Run jobs in a new event loop, see AsyncRunner.run_all. runner_kwargs are passed to AsyncRunner."""
+    jobs = list(jobs)
+    if not jobs:
+        return []
+    return _run_loop(AsyncRunner(**runner_kwargs).run_all(jobs, on_result=on_result))
+
+
+def run_first_success(job_groups, **runner_kwargs):
+    """
+    Run groups of jobs in a new event loop, see AsyncRunner.first_success.
+    :return:                        (index, result) of every group, (None, None) for groups with no success
+    """
+    job_groups = [list(jobs) for jobs in job_groups]
+    if not any(job_groups):
+        return [(None, None)] * len(job_groups)
+
+    async def _run_groups():
+        runner = AsyncRunner(**runner_kwargs)
+        return await asyncio.gather(*[runner.first_success(jobs) for jobs in job_groups])
+    return list(_run_loop(_run_groups()))
+
+
+# vi:set tw=0 ts=4 sw=4 nowrap fdm=indent
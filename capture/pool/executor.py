@@ -0,0 +1,411 @@
+# !/bin/env python
+# -*- coding: utf-8 -*_
+"""
+
+    @FileName: executor.py
+    @Author: zengzhishi(zengzs1995@gmail.com)
+    @CreatTime: 2018-04-14 10:21:37
+    @LastModif: 2018-04-14 10:21:37
+    @Note: Executors of capture missions.
+    Executor runs tasks in threads, a task holds a slot of its kind while running: "cpu" slots for python work,
+    "subprocess" slots for waiting child processes (compilers, probes...). Slots are shared by all executors of the
+    process, so concurrent captures of capture server don't oversubscribe the host.
+    ProcessExecutor runs chunks of jobs in a process pool with bounded in-flight chunks.
+    Both have bounded queues (submit blocks when full), stop workers only on shutdown, and record task timing.
+
+    Usage:
+        with Executor(compile_one, name="command_exec") as executor:
+            for command in commands:
+                executor.submit(command)
+"""
+
+import time
+import queue
+import logging
+import threading
+import contextlib
+import collections
+import multiprocessing
+
+import capture.conf.settings as settings
+import capture.pool.jobserver as jobserver
+
+logger = logging.getLogger("capture")
+
+CPU_CORE_COUNT = multiprocessing.cpu_count()
+
+# slot kinds
+SLOT_CPU = "cpu"
+SLOT_SUBPROCESS = "subprocess"
+
+# Put into work queue for every worker on shutdown.
+_STOP_ITEM = object()
+
+# executor states
+_NEW = 0
+_RUNNING = 1
+_SHUTDOWN = 2
+
+TaskResult = collections.namedtuple("TaskResult", ["item", "value", "error", "queued", "elapsed", "worker"])
+
+
+class ExecutorError(Exception):
+    def __init__(self, message=None):
+        if message:
+            self.args = (message,)
+        else:
+            self.args = ("Executor Error happen!",)
+
+
+class Slots(object):
+    """Concurrency limits of each slot kind."""
+    def __init__(self, cpu=CPU_CORE_COUNT, subprocess=CPU_CORE_COUNT, jobserver_client=None):
+        """
+        :param cpu:
+        :param subprocess:
+        :param jobserver_client:        jobserver.JobserverClient of outer make, a subprocess slot also holds one
+                                            of its tokens.
+        """
+        self._limits = {
+            SLOT_CPU: max(1, cpu),
+            SLOT_SUBPROCESS: max(1, subprocess),
+        }
+        self._semaphores = dict((kind, threading.BoundedSemaphore(limit)) for kind, limit in self._limits.items())
+        self._jobserver_client = jobserver_client
+
+    def limit(self, kind):
+        return self._limits[kind]
+
+    @contextlib.contextmanager
+    def hold(self, kind):
+        semaphore = self._semaphores[kind]
+        semaphore.acquire()
+        try:
+            if kind == SLOT_SUBPROCESS and self._jobserver_client is not None:
+                with self._jobserver_client.token():
+                    yield
+            else:
+                yield
+        finally:
+            semaphore.release()
+
+
+_slots = None
+_slots_lock = threading.Lock()
+
+
+def get_slots():
+    """Slots shared by the process, limits come from capture.cfg, 0 for cpu count."""
+    global _slots
+    if _slots is None:
+        with _slots_lock:
+            if _slots is None:
+                config = settings.get_settings()
+                _slots = Slots(cpu=config.cpu_slots or CPU_CORE_COUNT,
+                               subprocess=config.subprocess_slots or CPU_CORE_COUNT,
+                               jobserver_client=jobserver.get_client())
+    return _slots
+
+
+def subprocess_slot():
+    """Hold a subprocess slot of the process while running a child process outside executors, e.g. probes."""
+    return get_slots().hold(SLOT_SUBPROCESS)
+
+
+def set_slots(slots):
+    global _slots
+    with _slots_lock:
+        _slots = slots
+
+
+class TaskStats(object):
+    """Timing of finished tasks."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.total_queued = 0.0
+        self._start_time = time.perf_counter()
+        self._end_time = None
+
+    def add_submitted(self):
+        with self._lock:
+            self.submitted += 1
+
+    def add_cancelled(self):
+        with self._lock:
+            self.cancelled += 1
+
+    def add(self, elapsed, queued, failed=False):
+        with self._lock:
+            self.completed += 1
+            if failed:
+                self.failed += 1
+            self.total_time += elapsed
+            self.max_time = max(self.max_time, elapsed)
+            self.total_queued += queued
+
+    def finish(self):
+        self._end_time = time.perf_counter()
+
+    def to_dict(self):
+        with self._lock:
+            end_time = self._end_time if self._end_time is not None else time.perf_counter()
+            return {
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "cancelled": self.cancelled,
+                "wall_time": end_time - self._start_time,
+                "total_time": self.total_time,
+                "avg_time": self.total_time / self.completed if self.completed else 0.0,
+                "max_time": self.max_time,
+                "avg_queued": self.total_queued / self.completed if self.completed else 0.0,
+            }
+
+
+def _log_stats(name, stats):
+    logger.info("[%s] tasks: %d done, %d failed, %d cancelled; task time avg: %.3fs, max: %.3fs; wall time: %.3fs"
+                % (name, stats["completed"], stats["failed"], stats["cancelled"], stats["avg_time"],
+                   stats["max_time"], stats["wall_time"]))
+
+
+class Executor(object):
+    def __init__(self, func, name="executor", slot=SLOT_SUBPROCESS, workers=None, queue_size=None,
+                 slots=None, progress=None, callback=None, on_cancel=None):
+        """
+        :param func:                    task function, called with the submitted item
+        :param name:                    executor name used in thread names and logs
+        :param slot:                    slot kind a task holds while running, None for tasks taking slots themselves
+        :param workers:                 worker threads count, default is the limit of slot kind
+        :param queue_size:              max waiting tasks, submit blocks when queue is full, 0 for unbounded,
+                                            default comes from capture.cfg
+        :param slots:                   Slots, default is the one shared by the process
+        :param progress:                ProgressMonitor which finished tasks report into
+        :param callback:                function(TaskResult) called in worker thread after every task
+        :param on_cancel:               function called once when tasks are cancelled, before workers are waited,
+                                            e.g. killing running commands which don't get the interruption
+        """
+        self._func = func
+        self._name = name
+        self._slot = slot
+        self._slots = slots if slots is not None else get_slots()
+        self._workers_count = max(1, workers or self._slots.limit(slot if slot is not None else SLOT_CPU))
+        if queue_size is None:
+            queue_size = settings.get_settings().queue_size
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._progress = progress
+        self._callback = callback
+        self._on_cancel = on_cancel
+
+        self._lock = threading.Lock()
+        self._state = _NEW
+        self._cancelled = False
+        self._finished = False
+        self._threads = []
+        self._stats = TaskStats()
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def workers_count(self):
+        return self._workers_count
+
+    def stats(self):
+        return self._stats.to_dict()
+
+    def start(self):
+        with self._lock:
+            if self._state != _NEW:
+                return self
+            self._state = _RUNNING
+        # Threads are named after the creating thread, so their logs can be told apart by request.
+        parent_name = threading.current_thread().name
+        for i in range(self._workers_count):
+            thread = threading.Thread(target=self._worker, name="%s-%s-%d" % (parent_name, self._name, i))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def submit(self, item):
+        """Queue a task, block while the queue is full."""
+        if self._state == _NEW:
+            self.start()
+        if self._state != _RUNNING:
+            raise ExecutorError("Executor %s is shut down." % self._name)
+        self._stats.add_submitted()
+        self._queue.put((item, time.perf_counter()))
+
+    def map(self, items):
+        for item in items:
+            self.submit(item)
+
+    def _worker(self):
+        worker_name = threading.current_thread().name
+        while True:
+            entry = self._queue.get()
+            try:
+                if entry is _STOP_ITEM:
+                    return
+                if self._cancelled:
+                    self._stats.add_cancelled()
+                    continue
+                self._run_task(entry[0], entry[1], worker_name)
+            finally:
+                self._queue.task_done()
+
+    def _run_task(self, item, submit_time, worker_name):
+        value = None
+        error = None
+        with self._slots.hold(self._slot) if self._slot is not None else contextlib.nullcontext():
+            start_time = time.perf_counter()
+            try:
+                value = self._func(item)
+            except Exception as e:
+                logger.exception("[%s] Task fail." % self._name)
+                error = e
+            elapsed = time.perf_counter() - start_time
+        queued = start_time - submit_time
+        self._stats.add(elapsed, queued, failed=error is not None)
+        if self._progress is not None:
+            self._progress.report(1, worker=worker_name, latency=elapsed)
+        if self._callback is not None:
+            self._callback(TaskResult(item, value, error, queued, elapsed, worker_name))
+
+    def shutdown(self, wait=True, cancel=False):
+        """
+        Stop the executor, no more tasks can be submitted.
+        :param wait:                    wait for workers to exit
+        :param cancel:                  drop waiting tasks, running tasks are finished unless on_cancel stops them
+        """
+        on_cancel = None
+        if cancel:
+            with self._lock:
+                if not self._cancelled:
+                    on_cancel = self._on_cancel
+                self._cancelled = True
+        if on_cancel is not None:
+            try:
+                on_cancel()
+            except Exception:
+                logger.exception("[%s] Cancel callback fail." % self._name)
+        with self._lock:
+            stopping = self._state == _RUNNING
+            self._state = _SHUTDOWN
+        if stopping:
+            # Workers go on draining queue, so a full queue is never a dead lock here.
+            for _ in self._threads:
+                self._queue.put(_STOP_ITEM)
+        if wait:
+            for thread in self._threads:
+                thread.join()
+            with self._lock:
+                finished, self._finished = self._finished, True
+            if not finished:
+                self._stats.finish()
+                _log_stats(self._name, self._stats.to_dict())
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown(wait=True, cancel=exc_type is not None)
+        return False
+
+
+class ProcessExecutor(object):
+    """
+    Run chunks of jobs in process pool. At most max_inflight chunks are submitted and not consumed, so results
+    waiting in main process are bounded too.
+    """
+    def __init__(self, name="mission", workers=None, initializer=None, initargs=(), process_pool=None,
+                 max_inflight=None):
+        """
+        :param name:
+        :param workers:                 process count of own pool, default is cpu slots limit
+        :param initializer:             initializer of own pool
+        :param initargs:
+        :param process_pool:            shared pool, it is not stopped on shutdown. None for creating own pool.
+        :param max_inflight:            default is twice of workers count
+        """
+        self._name = name
+        self._workers_count = max(1, workers or get_slots().limit(SLOT_CPU))
+        self._own_pool = process_pool is None
+        if self._own_pool:
+            process_pool = multiprocessing.Pool(processes=self._workers_count, initializer=initializer,
+                                                initargs=initargs)
+        self._pool = process_pool
+        self._inflight = max(1, max_inflight or self._workers_count * 2)
+        self._results = queue.Queue()
+        self._stats = TaskStats()
+        self._closed = False
+
+    def stats(self):
+        return self._stats.to_dict()
+
+    def _submit(self, func, chunk):
+        submit_time = time.perf_counter()
+        self._stats.add_submitted()
+
+        def _done(value):
+            self._results.put((value, None, time.perf_counter() - submit_time))
+
+        def _fail(error):
+            self._results.put((None, error, time.perf_counter() - submit_time))
+
+        self._pool.apply_async(func, (chunk,), callback=_done, error_callback=_fail)
+
+    def imap_unordered(self, func, chunks):
+        """Yield results of chunks in finishing order, a worker error is raised in caller."""
+        if self._closed:
+            raise ExecutorError("Executor %s is shut down." % self._name)
+        pending = 0
+        chunks = iter(chunks)
+        exhausted = False
+        while True:
+            while not exhausted and pending < self._inflight:
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    exhausted = True
+                    break
+                self._submit(func, chunk)
+                pending += 1
+            if pending == 0:
+                return
+            value, error, elapsed = self._results.get()
+            pending -= 1
+            self._stats.add(elapsed, 0.0, failed=error is not None)
+            if error is not None:
+                raise error
+            yield value
+
+    def shutdown(self, cancel=False):
+        if self._closed:
+            return
+        self._closed = True
+        if self._own_pool:
+            if cancel:
+                self._pool.terminate()
+            else:
+                self._pool.close()
+            self._pool.join()
+        self._stats.finish()
+        _log_stats(self._name, self._stats.to_dict())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown(cancel=exc_type is not None)
+        return False
+
+
+# vi:set tw=0 ts=4 sw=4 nowrap fdm=indent
@@ -0,0 +1,337 @@
+# !/bin/env python
+# -*- coding: utf-8 -*_
+"""
+
+    @FileName: jobserver.py
+    @Author: zengzhishi(zengzs1995@gmail.com)
+    @CreatTime: 2018-04-15 09:36:52
+    @LastModif: 2018-04-15 09:36:52
+    @Note: GNU make jobserver support.
+    When capture runs inside an outer `make -j`, MAKEFLAGS holds --jobserver-auth=R,W (pipe fds) or
+    --jobserver-auth=fifo:PATH (make 4.4). Every child process capture starts then takes a token from the outer
+    jobserver, so the host is not oversubscribed by outer jobs x capture threads. Like a make recipe, capture owns one
+    implicit token, so one child process always runs without reading the jobserver.
+    Without outer jobserver, capture serves tokens itself for child `make -n` invocations.
+
+    Usage:
+        client = get_client()
+        if client is not None:
+            with client.token():
+                run_compiler()
+"""
+
+import os
+import re
+import errno
+import select
+import logging
+import threading
+import contextlib
+import subprocess
+
+logger = logging.getLogger("capture")
+
+# Returned by acquire for the implicit token of this process, nothing is read from jobserver for it.
+IMPLICIT_TOKEN = b""
+
+# Seconds between implicit token checks while waiting jobserver tokens.
+_POLL_INTERVAL = 0.1
+
+# Parallel sub makes print their commands by groups, so "Entering directory" lines still match the commands.
+OUTPUT_SYNC_FLAG = "-Orecurse"
+
+# jobserver kinds
+JOBSERVER_FDS = "fds"
+JOBSERVER_FIFO = "fifo"
+
+
+class JobserverError(Exception):
+    def __init__(self, message=None):
+        if message:
+            self.args = (message,)
+        else:
+            self.args = ("Jobserver Error happen!",)
+
+
+def parse_makeflags(makeflags):
+    """
+    Find jobserver in MAKEFLAGS.
+    :param makeflags:
+    :return:                    (JOBSERVER_FDS, (read_fd, write_fd)), (JOBSERVER_FIFO, path) or None
+    """
+    jobserver = None
+    for word in (makeflags or "").split():
+        if word == "--":
+            # Variables overridden on command line follow.
+            break
+        for option in ("--jobserver-auth=", "--jobserver-fds="):
+            if not word.startswith(option):
+                continue
+            value = word[len(option):]
+            if value.startswith("fifo:"):
+                jobserver = (JOBSERVER_FIFO, value[len("fifo:"):])
+                continue
+            fds = value.split(",")
+            try:
+                if len(fds) == 2:
+                    jobserver = (JOBSERVER_FDS, (int(fds[0]), int(fds[1])))
+            except ValueError:
+                logger.warning("Unknown jobserver in MAKEFLAGS: %s" % word)
+    return jobserver
+
+
+def update_makeflags(makeflags, flags, drop=()):
+    """
+    Add flags into MAKEFLAGS, output sync flag is always added.
+    :param makeflags:
+    :param flags:
+    :param drop:                prefixes of flags removed from makeflags
+    """
+    words = (makeflags or "").split()
+    # Variables overridden on command line follow "--".
+    variables = words[words.index("--"):] if "--" in words else []
+    drop = tuple(drop) + ("-O", "--output-sync")
+    words = [word for word in words[:len(words) - len(variables)] if not word.startswith(drop)]
+    if words and not words[0].startswith("-"):
+        # Single letter flags word of MAKEFLAGS.
+        words[0] = "-" + words[0]
+    words.extend(flags)
+    words.append(OUTPUT_SYNC_FLAG)
+    return " ".join(words + variables)
+
+
+def _fd_is_open(fd):
+    try:
+        os.fstat(fd)
+        return True
+    except OSError:
+        return False
+
+
+def _open_nonblocking(fd):
+    """
+    Open fd again with O_NONBLOCK, the new open file description is private to this process, so flags of the pipe
+    shared with make are not changed. Without /proc, O_NONBLOCK is set on fd itself, as make 4.x does.
+    """
+    try:
+        return os.open("/proc/self/fd/%d" % fd, os.O_RDONLY | os.O_NONBLOCK | os.O_CLOEXEC)
+    except OSError:
+        os.set_blocking(fd, False)
+        return fd
+
+
+class JobserverClient(object):
+    """
+    Tokens of an outer jobserver, thread safe.
+    Tokens are read without blocking, the byte seen by select may be taken by another client first.
+    """
+    def __init__(self, read_fd, write_fd, owns_fds=False):
+        """
+        :param read_fd:
+        :param write_fd:
+        :param owns_fds:                close fds on close(), for fds opened from fifo
+        """
+        self._fds = (read_fd, write_fd)
+        self._read_fd = _open_nonblocking(read_fd)
+        self._write_fd = write_fd
+        self._owns_fds = owns_fds
+        self._lock = threading.Lock()
+        self._implicit_free = True
+
+    @classmethod
+    def from_makeflags(cls, makeflags):
+        """Return client of jobserver in MAKEFLAGS, None if there is no usable jobserver."""
+        jobserver = parse_makeflags(makeflags)
+        if jobserver is None:
+            return None
+        kind, value = jobserver
+        if kind == JOBSERVER_FIFO:
+            try:
+                fd = os.open(value, os.O_RDWR | os.O_CLOEXEC)
+            except OSError as e:
+                logger.warning("Opening jobserver fifo %s fail: %s" % (value, e))
+                return None
+            return cls(fd, fd, owns_fds=True)
+
+        read_fd, write_fd = value
+        if read_fd < 0 or not _fd_is_open(read_fd) or not _fd_is_open(write_fd):
+            # Outer make only passes the fds to recipes marked with '+' or using $(MAKE).
+            logger.warning("Jobserver fds %d,%d in MAKEFLAGS are not open, prefix the rule running capture "
+                           "with '+' to share the jobserver." % (read_fd, write_fd))
+            return None
+        return cls(read_fd, write_fd)
+
+    @property
+    def fds(self):
+        """Fds child make processes need to inherit."""
+        if self._owns_fds:
+            return ()
+        return self._fds
+
+    def _take_implicit(self):
+        with self._lock:
+            if self._implicit_free:
+                self._implicit_free = False
+                return True
+            return False
+
+    def acquire(self, cancel=None):
+        """
+        Block until a token is got, and return it.
+        :param cancel:                  threading.Event, None is returned soon after it is set
+        """
+        while True:
+            if cancel is not None and cancel.is_set():
+                return None
+            if self._take_implicit():
+                return IMPLICIT_TOKEN
+            try:
+                readable, _, _ = select.select([self._read_fd], [], [], _POLL_INTERVAL)
+            except InterruptedError:
+                continue
+            if not readable:
+                continue
+            try:
+                token = os.read(self._read_fd, 1)
+            except BlockingIOError:
+                # Another client got the token first, wait again.
+                continue
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise JobserverError("Reading jobserver token fail: %s" % e)
+            if not token:
+                raise JobserverError("Jobserver is closed.")
+            return token
+
+    def release(self, token):
+        if token == IMPLICIT_TOKEN:
+            with self._lock:
+                self._implicit_free = True
+            return
+        while True:
+            try:
+                os.write(self._write_fd, token)
+                return
+            except InterruptedError:
+                continue
+            except OSError as e:
+                logger.warning("Returning jobserver token fail: %s" % e)
+                return
+
+    @contextlib.contextmanager
+    def token(self):
+        token = self.acquire()
+        try:
+            yield
+        finally:
+            self.release(token)
+
+    def close(self):
+        if self._read_fd < 0:
+            return
+        if self._read_fd not in self._fds:
+            os.close(self._read_fd)
+        if self._owns_fds:
+            os.close(self._fds[0])
+        self._read_fd = self._write_fd = -1
+
+
+class JobserverServer(object):
+    """
+    Jobserver pipe for child make processes. The child make owns an implicit token, so slots - 1 tokens are put
+    into the pipe.
+    """
+    def __init__(self, slots):
+        self._slots = max(1, slots)
+        self._read_fd, self._write_fd = os.pipe()
+        os.write(self._write_fd, b"+" * (self._slots - 1))
+
+    @property
+    def fds(self):
+        return self._read_fd, self._write_fd
+
+    def makeflags(self, makeflags=""):
+        """MAKEFLAGS for child make, --jobserver-auth=R,W is understood by make 4.2 and later."""
+        return update_makeflags(makeflags, ["-j%d" % self._slots,
+                                            "--jobserver-auth=%d,%d" % (self._read_fd, self._write_fd)],
+                                drop=("-j", "--jobserver-auth=", "--jobserver-fds="))
+
+    def environ(self, environ=None):
+        environ = dict(os.environ if environ is None else environ)
+        environ["MAKEFLAGS"] = self.makeflags(environ.get("MAKEFLAGS", ""))
+        environ.pop("MFLAGS", None)
+        return environ
+
+    def close(self):
+        if self._read_fd >= 0:
+            os.close(self._read_fd)
+            os.close(self._write_fd)
+            self._read_fd = self._write_fd = -1
+
+
+_client = None
+_client_loaded = False
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Client of outer jobserver found in MAKEFLAGS of this process, None if capture is not run by make -j."""
+    global _client, _client_loaded
+    if not _client_loaded:
+        with _client_lock:
+            if not _client_loaded:
+                _client = JobserverClient.from_makeflags(os.environ.get("MAKEFLAGS", ""))
+                if _client is not None:
+                    logger.info("Using jobserver of outer make.")
+                _client_loaded = True
+    return _client
+
+
+def _make_version(make):
+    try:
+        out = subprocess.check_output([make, "--version"], stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    match = re.match(r"GNU Make (\d+)\.(\d+)", out.decode("utf8", "replace"))
+    if match is None:
+        return None
+    return int(match.group(1)), int(match.group(2))
+
+
+_make_versions = {}
+
+
+def make_supports_jobserver(make="make"):
+    """--jobserver-auth is understood since GNU make 4.2."""
+    if make not in _make_versions:
+        _make_versions[make] = _make_version(make)
+    version = _make_versions[make]
+    return version is not None and version >= (4, 2)
+
+
+@contextlib.contextmanager
+def child_make_environ(slots, make="make"):
+    """
+    Environ and fds for child make, it shares outer jobserver if there is one, otherwise capture serves tokens.
+    :param slots:                   jobs count of capture jobserver
+    :param make:                    make program, old make runs without jobserver
+    :return:                        (environ, pass_fds), environ is None for inheriting environ of capture
+    """
+    client = get_client()
+    if client is not None:
+        environ = dict(os.environ)
+        environ["MAKEFLAGS"] = update_makeflags(environ.get("MAKEFLAGS", ""), [])
+        yield environ, client.fds
+        return
+    if slots <= 1 or not make_supports_jobserver(make):
+        yield None, ()
+        return
+    server = JobserverServer(slots)
+    try:
+        yield server.environ(), server.fds
+    finally:
+        server.close()
+
+
+# vi:set tw=0 ts=4 sw=4 nowrap fdm=indent
@@ -0,0 +1,132 @@
+# !/bin/env python
+# -*- coding: utf-8 -*_
+"""
+
+    @FileName: progress.py
+    @Author: zengzhishi(zengzs1995@gmail.com)
+    @CreatTime: 2018-04-02 10:12:31
+    @LastModif: 2018-04-02 10:12:31
+    @Note: Progress and throughput metrics channel, which workers report completed work into.
+"""
+
+import os
+import json
+import time
+import threading
+import logging
+
+logger = logging.getLogger("capture")
+
+DEFAULT_STATUS_FILE = "capture_status.json"
+
+
+class ProgressMonitor(object):
+    """
+    Collect completed count, throughput, per-worker latency and ETA of a phase.
+
+    Workers (or the collecting side of a process pool) call `report` after every finished work item, nothing is
+    polled. Log lines and the status file are refreshed at most once per `report_interval` seconds.
+    """
+    def __init__(self, name, total, status_path=None, report_interval=1.0):
+        """
+        :param name:                    phase name, eg: command_prebuild
+        :param total:                   work items count of this phase
+        :param status_path:             machine-readable status file path, None for no status file
+        :param report_interval:         min interval seconds between two log/status outputs
+        """
+        self._name = name
+        self._total = total
+        self._status_path = status_path
+        self._report_interval = report_interval
+
+        self._lock = threading.Lock()
+        self._completed = 0
+        self._workers = {}
+        self._start_time = time.time()
+        self._last_report_time = 0.0
+        self._finished = False
+
+    @property
+    def completed(self):
+        return self._completed
+
+    def report(self, count=1, worker=None, latency=None):
+        """
+        :param count:                   finished work items count
+        :param worker:                  worker name, used for latency statistic
+        :param latency:                 seconds the worker used for these items
+        """
+        with self._lock:
+            self._completed += count
+            if worker is not None and latency is not None:
+                stat = self._workers.setdefault(str(worker), {"count": 0, "total_latency": 0.0, "max_latency": 0.0})
+                stat["count"] += count
+                stat["total_latency"] += latency
+                stat["max_latency"] = max(stat["max_latency"], latency / count if count else latency)
+
+            now = time.time()
+            if now - self._last_report_time < self._report_interval and self._completed < self._total:
+                return
+            self._last_report_time = now
+            self._output(self._snapshot(now))
+
+    def finish(self):
+        with self._lock:
+            self._finished = True
+            snapshot = self._snapshot(time.time())
+            self._output(snapshot)
+        return snapshot
+
+    def snapshot(self):
+        with self._lock:
+            return self._snapshot(time.time())
+
+    def _snapshot(self, now):
+        elapsed = now - self._start_time
+        items_per_sec = self._completed / elapsed if elapsed > 0 else 0.0
+        left = max(self._total - self._completed, 0)
+        eta = left / items_per_sec if items_per_sec > 0 else None
+
+        workers = {}
+        for worker, stat in self._workers.items():
+            workers[worker] = {
+                "count": stat["count"],
+                "avg_latency": stat["total_latency"] / stat["count"] if stat["count"] else 0.0,
+                "max_latency": stat["max_latency"],
+            }
+        return {
+            "phase": self._name,
+            "finished": self._finished,
+            "total": self._total,
+            "completed": self._completed,
+            "percent": self._completed / float(self._total) * 100.0 if self._total else 100.0,
+            "elapsed": elapsed,
+            "items_per_sec": items_per_sec,
+            "eta": eta,
+            "workers": workers,
+        }
+
+    def _output(self, snapshot):
+        logger.info("[%s] Mission process: %d/%d (%.2f %%), %.2f items/s, ETA: %s" % (
+            snapshot["phase"], snapshot["completed"], snapshot["total"], snapshot["percent"],
+            snapshot["items_per_sec"], "%.1fs" % snapshot["eta"] if snapshot["eta"] is not None else "unknown"))
+        if self._status_path:
+            dump_status(self._status_path, snapshot)
+
+
+def dump_status(status_path, snapshot):
+    """Write status file atomically, readers never see a half written file."""
+    tmp_path = status_path + ".tmp"
+    try:
+        with open(tmp_path, "w") as fout:
+            json.dump(snapshot, fout, indent=4)
+        os.replace(tmp_path, status_path)
+    except OSError:
+        logger.warning("Dumping status file %s fail." % status_path)
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+
+
+# vi:set tw=0 ts=4 sw=4 nowrap fdm=indent
@@ -14,9 +14,13 @@
 
 import os
 import signal
-import psutil
 import time
 
+import capture.utils.capture_util as capture_util
+
+# psutil is only used when memory is checked.
+psutil = capture_util.lazy_module("psutil")
+
 
 class Register(object):
     def __init__(self):
@@ -65,15 +69,37 @@ class Register(object):
             raise Exception("Can not interrupt a no-group process.")
         os.killpg(gpid, signal.SIGKILL)
 
-    def terminate_large_memory_process(self, percent=94):
-        """ Largest percent 94%. """
-        svmem = psutil.virtual_memory()
+    @property
+    def registered_gpids(self):
+        return list(self.__gpid_time_maps.keys())
+
+    @staticmethod
+    def group_rss(gpid):
+        """ Rss bytes of the group leader and all its children. """
+        gp = psutil.Process(pid=gpid)
+
+        # All the children is in the same group[must]
+        children = gp.children(recursive=True)
+        cur_rss = gp.memory_info().rss
+        for child in children:
+            cur_rss += child.memory_info().rss
+        return cur_rss
+
+    def terminate_large_memory_process(self, percent=94, used_percent=None, group_rss=None):
+        """ Largest percent 94%.
+        :param percent:                 kill the largest process and group when memory used percent is over it
+        :param used_percent:            memory used percent sampled by caller, default is read by psutil
+        :param group_rss:               {gpid: rss} sampled by caller, default is read by psutil
+        :return:                        killed gpid, None if no group is killed
+        """
+        if used_percent is None:
+            used_percent = psutil.virtual_memory().percent
         max_memory_used_pid = None
         max_memory_pid_used = 0
         max_memory_used_gpid = None
         max_memory_gpid_used = 0
 
-        if svmem.percent > percent:
+        if used_percent > percent:
             for pid in self.__pid_time_maps.keys():
                 p = psutil.Process(pid=pid)
                 if p.memory_info().rss > max_memory_pid_used:
@@ -81,13 +107,7 @@ class Register(object):
                     max_memory_used_pid = pid
 
             for gpid in self.__gpid_time_maps.keys():
-                gp = psutil.Process(pid=gpid)
-
-                # All the children is in the same group[must]
-                children = gp.children(recursive=True)
-                cur_rss = gp.memory_info().rss
-                for child in children:
-                    cur_rss += child.memory_info().rss
+                cur_rss = group_rss.get(gpid, 0) if group_rss is not None else self.group_rss(gpid)
                 if cur_rss > max_memory_gpid_used:
                     max_memory_gpid_used = cur_rss
                     max_memory_used_gpid = gpid
@@ -96,9 +116,24 @@ class Register(object):
             self.__terminate_pid(max_memory_used_pid)
         if max_memory_used_gpid:
             self.__terminate_gpid(max_memory_used_gpid)
+        return max_memory_used_gpid
+
+    def terminate_over_memory_process(self, max_rss, group_rss):
+        """ Kill groups using more than max_rss bytes.
+        :param group_rss:               {gpid: rss} sampled by caller
+        :return:                        killed gpids
+        """
+        killed = []
+        for gpid in self.__gpid_time_maps.keys():
+            if group_rss.get(gpid, 0) > max_rss:
+                self.__terminate_gpid(gpid)
+                killed.append(gpid)
+        return killed
 
     def terminate_long_time_process(self, timeout=900):
-        """ Time out 15 min. """
+        """ Time out 15 min.
+        :return:                        killed gpids
+        """
         end_time = time.time()
         for pid, start_time in self.__pid_time_maps.items():
             consume_time = end_time - start_time
@@ -107,12 +142,14 @@ class Register(object):
                 self.__terminate_pid(pid=pid)
                 break
 
+        killed = []
         for gpid, start_time in self.__gpid_time_maps.items():
             consume_time = end_time - start_time
             if consume_time > timeout:
-                # Only one, it will change 'self.__pid_time_maps'
+                # Killing doesn't change 'self.__gpid_time_maps', groups are deregistered after they are waited.
                 self.__terminate_gpid(gpid=gpid)
-                break
+                killed.append(gpid)
+        return killed
 
     def _terminating(self):
         """ Call it while catching an interruption or abort. """
@@ -0,0 +1,213 @@
+# !/bin/env python
+# -*- coding: utf-8 -*_
+"""
+
+    @FileName: scheduler.py
+    @Author: zengzhishi(zengzs1995@gmail.com)
+    @CreatTime: 2018-04-16 10:05:13
+    @LastModif: 2018-04-16 10:05:13
+    @Note: Longest job first ordering of compile commands.
+    A few giant translation units dispatched at the end leave other cores idle, so commands are ordered by predicted
+    cost: compile time of last captures kept in a timing table, or file size x include count for unknown files,
+    scaled by the known timings. .o and .bc commands of one source can be kept next to each other, so the source and
+    its headers are still in page cache for the second one, or grouped into one task run by one worker.
+
+    Usage:
+        table = TimingTable.load(os.path.join(output_path, DEFAULT_TIMING_FILE))
+        for command in order_commands(commands, table):
+            ...
+        for task in group_pairs(order_commands(commands, table)):
+            ...                                         # [object_command, bitcode_command] or [command]
+        table.save()
+"""
+
+import os
+import re
+import json
+import logging
+import threading
+
+logger = logging.getLogger("capture")
+
+DEFAULT_TIMING_FILE = "capture_timings.json"
+TIMING_TABLE_VERSION = 1
+
+# Weight of new duration in moving average of compile time.
+TIMING_SMOOTHING = 0.5
+
+# Includes are at the top of file, the rest is not read.
+_INCLUDE_SCAN_SIZE = 64 * 1024
+_INCLUDE_REGEX = re.compile(rb"^[ \t]*#[ \t]*include\b", re.MULTILINE)
+
+# command kinds
+KIND_OBJECT = "o"
+KIND_BITCODE = "bc"
+
+
+def command_kind(command):
+    """KIND_BITCODE for commands building .bc file, else KIND_OBJECT."""
+    argv = command.get("arguments")
+    if argv:
+        output = argv[-1]
+    else:
+        output = (command.get("command") or "").rstrip()
+    return KIND_BITCODE if output.endswith(".bc") else KIND_OBJECT
+
+
+def timing_key(command):
+    return "%s:%s" % (command_kind(command), command.get("file", ""))
+
+
+class TimingTable(object):
+    """
+    Compile seconds of commands in last captures, saved as:
+        {"version": 1, "timings": {"o:/path/a.c": 1.5, "bc:/path/a.c": 2.1, ...}}
+    """
+    def __init__(self, path=None, timings=None):
+        self._path = path
+        self._timings = timings if timings is not None else {}
+        self._lock = threading.Lock()
+        self._changed = False
+
+    def __len__(self):
+        return len(self._timings)
+
+    @classmethod
+    def load(cls, path):
+        """An empty table is returned if the file is missing or broken."""
+        if not path or not os.path.exists(path):
+            return cls(path)
+        try:
+            with open(path, "r") as fin:
+                data = json.load(fin)
+        except (IOError, OSError, ValueError):
+            logger.warning("Loading timing table %s fail." % path)
+            return cls(path)
+        if data.get("version") != TIMING_TABLE_VERSION:
+            return cls(path)
+        return cls(path, data.get("timings", {}))
+
+    def get(self, key):
+        return self._timings.get(key)
+
+    def record(self, key, seconds):
+        with self._lock:
+            last = self._timings.get(key)
+            if last is not None:
+                seconds = last + (seconds - last) * TIMING_SMOOTHING
+            self._timings[key] = seconds
+            self._changed = True
+
+    def items(self):
+        return self._timings.items()
+
+    def save(self, path=None):
+        path = path or self._path
+        if not path or not self._changed:
+            return
+        tmp_path = path + ".tmp"
+        try:
+            with open(tmp_path, "w") as fout:
+                fout.write(json.dumps({"version": TIMING_TABLE_VERSION, "timings": self._timings},
+                                      separators=(",", ":")))
+            os.replace(tmp_path, path)
+            self._changed = False
+        except (IOError, OSError):
+            logger.warning("Dumping timing table %s fail." % path)
+
+
+def source_weight(file_path, cache=None):
+    """File size x (1 + include count), cost of files never compiled before."""
+    if cache is not None and file_path in cache:
+        return cache[file_path]
+    try:
+        size = os.path.getsize(file_path)
+        with open(file_path, "rb") as fin:
+            includes = len(_INCLUDE_REGEX.findall(fin.read(_INCLUDE_SCAN_SIZE)))
+    except (IOError, OSError):
+        size = 0
+        includes = 0
+    weight = float(size * (1 + includes))
+    if cache is not None:
+        cache[file_path] = weight
+    return weight
+
+
+def estimate_costs(commands, timing_table=None):
+    """
+    Predicted seconds of every command. Weights of unknown files are scaled by seconds per weight of known ones,
+    so both are comparable; without known files, the weights are used directly.
+    """
+    known = []
+    unknown = []
+    weights = {}
+    costs = [0.0] * len(commands)
+    for i, command in enumerate(commands):
+        seconds = timing_table.get(timing_key(command)) if timing_table is not None else None
+        if seconds is not None:
+            costs[i] = seconds
+            known.append(i)
+        else:
+            unknown.append(i)
+
+    if unknown:
+        scale = 1.0
+        if known:
+            known_weight = sum(source_weight(commands[i].get("file", ""), weights) for i in known)
+            if known_weight > 0:
+                scale = sum(costs[i] for i in known) / known_weight
+        for i in unknown:
+            costs[i] = source_weight(commands[i].get("file", ""), weights) * scale
+    return costs
+
+
+def order_commands(commands, timing_table=None, co_schedule=True):
+    """
+    Order commands longest first.
+    :param commands:
+    :param timing_table:                TimingTable, None for ordering by source weights only
+    :param co_schedule:                 keep commands of the same source next to each other, ordered by their sum
+    :return:                            ordered command list
+    """
+    commands = list(commands)
+    costs = estimate_costs(commands, timing_table)
+    if not co_schedule:
+        order = sorted(range(len(commands)), key=lambda i: costs[i], reverse=True)
+        return [commands[i] for i in order]
+
+    groups = {}
+    for i, command in enumerate(commands):
+        groups.setdefault(command.get("file", ""), []).append(i)
+    ordered_groups = sorted(groups.values(), key=lambda indexes: sum(costs[i] for i in indexes), reverse=True)
+    result = []
+    for indexes in ordered_groups:
+        indexes.sort(key=lambda i: costs[i], reverse=True)
+        result.extend(commands[i] for i in indexes)
+    return result
+
+
+def group_pairs(commands):
+    """
+    Group the .o and .bc commands of every source into one task, the object command is the first one. Tasks are in
+    order of their first commands.
+    :return:                            list of command lists
+    """
+    tasks = []
+    unpaired = {}
+    for command in commands:
+        key = (command.get("directory", ""), command.get("file", ""))
+        kind = command_kind(command)
+        task = unpaired.pop(key, None)
+        if task is not None and command_kind(task[0]) != kind:
+            if kind == KIND_OBJECT:
+                task.insert(0, command)
+            else:
+                task.append(command)
+            continue
+        task = [command]
+        tasks.append(task)
+        unpaired[key] = task
+    return tasks
+
+
+# vi:set tw=0 ts=4 sw=4 nowrap fdm=indent
@@ -0,0 +1,240 @@
+# !/bin/env python
+# -*- coding: utf-8 -*_
+"""
+
+    @FileName: watchdog.py
+    @Author: zengzhishi(zengzs1995@gmail.com)
+    @CreatTime: 2018-04-19 09:36:17
+    @LastModif: 2018-04-19 09:36:17
+    @Note: Watchdog thread enforcing memory and time limits of child processes.
+    Compile commands and probes run in their own process groups, which are registered in the watchdog while they run.
+    Every interval, rss of the groups is sampled from /proc (psutil on other systems), and groups are killed by policy:
+        memory_pressure:    memory used percent of the host is over the limit, the largest group is killed
+        rss_limit:          a group uses more rss than the limit
+        timeout:            a group runs longer than the limit
+    Groups killed by memory pressure can be run again with lower concurrency, see KILL_REQUEUE_REASONS.
+
+    Usage:
+        with Watchdog.from_settings() as dog:          # dog is current watchdog of this thread
+            handle = dog.handle()
+            spawn.run(command, watcher=handle)
+            handle.killed                               # kill reason, None if not killed
+"""
+
+import os
+import time
+import logging
+import threading
+
+import capture.conf.settings as settings
+import capture.pool.register as register
+import capture.utils.capture_util as capture_util
+
+# psutil is only used on systems without /proc.
+psutil = capture_util.lazy_module("psutil")
+
+logger = logging.getLogger("capture")
+
+KILL_MEMORY_PRESSURE = "memory_pressure"
+KILL_RSS_LIMIT = "rss_limit"
+KILL_TIMEOUT = "timeout"
+# Less concurrent commands use less memory, other limits would kill the command again.
+KILL_REQUEUE_REASONS = (KILL_MEMORY_PRESSURE,)
+
+_PROC_PATH = "/proc"
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+_local = threading.local()
+
+
+def current():
+    """Running watchdog started by this thread, None if there is no one."""
+    return getattr(_local, "watchdog", None)
+
+
+def sample_group_rss(gpids):
+    """
+    Rss bytes of process groups, all processes of a group are summed.
+    :return:                        {gpid: rss}, groups already exited are missing
+    """
+    gpids = set(gpids)
+    if not gpids:
+        return {}
+    if not os.path.isdir(_PROC_PATH):
+        group_rss = {}
+        for gpid in gpids:
+            try:
+                group_rss[gpid] = register.Register.group_rss(gpid)
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                pass
+        return group_rss
+
+    group_rss = {}
+    for name in os.listdir(_PROC_PATH):
+        if not name.isdigit():
+            continue
+        try:
+            with open(os.path.join(_PROC_PATH, name, "stat"), "rb") as fin:
+                stat = fin.read()
+        except (IOError, OSError):
+            continue
+        # Command name in parentheses may contain spaces, fields are split after it.
+        fields = stat[stat.rfind(b")") + 2:].split()
+        try:
+            gpid = int(fields[2])
+            if gpid in gpids:
+                group_rss[gpid] = group_rss.get(gpid, 0) + int(fields[21]) * _PAGE_SIZE
+        except (IndexError, ValueError):
+            continue
+    return group_rss
+
+
+def memory_used_percent():
+    """Percent of host memory not available for new processes."""
+    try:
+        meminfo = {}
+        with open(os.path.join(_PROC_PATH, "meminfo"), "r") as fin:
+            for line in fin:
+                key, _, value = line.partition(":")
+                meminfo[key] = int(value.split()[0])
+        return (meminfo["MemTotal"] - meminfo["MemAvailable"]) * 100.0 / meminfo["MemTotal"]
+    except (IOError, OSError, KeyError, ValueError, IndexError, ZeroDivisionError):
+        return psutil.virtual_memory().percent
+
+
+class WatchHandle(object):
+    """Watching of one command, it is passed to spawn.run or asyncio runner as watcher."""
+    def __init__(self, watchdog):
+        self._watchdog = watchdog
+        self.killed = None
+
+    def watch(self, gpid):
+        self._watchdog.watch(gpid)
+
+    def unwatch(self, gpid):
+        """Called after the group leader exits and before it is waited."""
+        reason = self._watchdog.unwatch(gpid)
+        if reason is not None:
+            self.killed = reason
+
+
+class Watchdog(object):
+    def __init__(self, interval=1.0, memory_percent=94.0, max_rss=0, timeout=0):
+        """
+        :param interval:                seconds between two samplings
+        :param memory_percent:          memory pressure limit of host, 0 for no limit
+        :param max_rss:                 rss bytes limit of a command, 0 for no limit
+        :param timeout:                 seconds limit of a command, 0 for no limit
+        """
+        self._interval = interval
+        self._memory_percent = memory_percent
+        self._max_rss = max_rss
+        self._timeout = timeout
+
+        self._register = register.Register()
+        # Registering, killing and deregistering are serialized, a waited group is never killed.
+        self._lock = threading.Lock()
+        self._killed = {}
+        self._kills = {KILL_MEMORY_PRESSURE: 0, KILL_RSS_LIMIT: 0, KILL_TIMEOUT: 0}
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._previous = None
+
+    @classmethod
+    def from_settings(cls):
+        _settings = settings.get_settings()
+        return cls(interval=_settings.watchdog_interval, memory_percent=_settings.watchdog_memory_percent,
+                   max_rss=_settings.watchdog_max_rss, timeout=_settings.watchdog_timeout)
+
+    @property
+    def enabled(self):
+        return bool(self._memory_percent or self._max_rss or self._timeout)
+
+    def handle(self):
+        return WatchHandle(self)
+
+    def watch(self, gpid):
+        with self._lock:
+            self._register.register_gpid(gpid)
+
+    def unwatch(self, gpid):
+        """:return:                     kill reason of the group, None if it is not killed"""
+        with self._lock:
+            self._register.deregister_gpid(gpid)
+            return self._killed.pop(gpid, None)
+
+    def _mark_killed(self, gpids, reason):
+        for gpid in gpids:
+            if gpid is None or gpid in self._killed:
+                continue
+            logger.warning("Watchdog killed process group %d: %s." % (gpid, reason))
+            self._killed[gpid] = reason
+            self._kills[reason] += 1
+
+    def check(self):
+        """Sample running groups once and kill them by policy."""
+        with self._lock:
+            gpids = [gpid for gpid in self._register.registered_gpids if gpid not in self._killed]
+            if not gpids:
+                return
+            try:
+                if self._timeout:
+                    self._mark_killed(self._register.terminate_long_time_process(self._timeout), KILL_TIMEOUT)
+                if self._max_rss or self._memory_percent:
+                    group_rss = sample_group_rss(gpids)
+                    for gpid in self._killed:
+                        group_rss.pop(gpid, None)
+                    if self._max_rss:
+                        self._mark_killed(self._register.terminate_over_memory_process(self._max_rss, group_rss),
+                                          KILL_RSS_LIMIT)
+                    if self._memory_percent and group_rss:
+                        gpid = self._register.terminate_large_memory_process(
+                            self._memory_percent, used_percent=memory_used_percent(), group_rss=group_rss)
+                        self._mark_killed([gpid], KILL_MEMORY_PRESSURE)
+            except (OSError, psutil.Error) as e:
+                # A group exited while it is sampled or killed, it is checked again next time.
+                logger.debug("Watchdog checking fail: %s" % e)
+
+    def _run(self):
+        while not self._stop_event.wait(self._interval):
+            self.check()
+
+    def start(self):
+        self._previous = current()
+        _local.watchdog = self
+        if self.enabled and self._thread is None:
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name="%s-watchdog" % threading.current_thread().name)
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def stop(self):
+        _local.watchdog = self._previous
+        self._previous = None
+        if self._thread is not None:
+            self._stop_event.set()
+            self._thread.join()
+            self._thread = None
+
+    def terminate_all(self):
+        """Kill all running groups, called while catching an interruption."""
+        with self._lock:
+            try:
+                self._register._terminating()
+            except Exception as e:
+                logger.warning("Watchdog terminating fail: %s" % e)
+
+    def stats(self):
+        with self._lock:
+            return {"kills": dict(self._kills), "killed": sum(self._kills.values())}
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+        return False
+
+
+# vi:set tw=0 ts=4 sw=4 nowrap fdm=indent
@@ -0,0 +1,510 @@
+# !/bin/env python
+# -*- coding: utf-8 -*_
+"""
+
+    @FileName: remote.py
+    @Author: zengzhishi(zengzs1995@gmail.com)
+    @CreatTime: 2018-04-21 14:06:52
+    @LastModif: 2018-04-21 14:06:52
+    @Note: Remote compiling of command_exec on capture workers.
+    Sources are preprocessed by the capture host, so workers need no project files or headers, only the compilers.
+    Workers tell their slots count, and every job is sent to the worker with most free slots, a worker never gets
+    more running jobs than its slots. Failing workers are dropped, their jobs are compiled locally.
+
+    Workers run compilers for anyone passing their hello, so they need a shared token: CAPTURE_WORKER_TOKEN in
+    environment, or the file of [Remote] token_file in capture.cfg, on both sides. The token is never sent, the
+    coordinator answers a random challenge by HMAC-SHA256 of it. Jobs only get a compiler of the allowed names and
+    code generation options, see check_argv, so they can't load plugins, change the toolchain, or read other files.
+    The protocol is not encrypted, listen on a trusted network only.
+
+    Protocol on TCP, every frame is (header size, payload size) as two uint32 in network order, a json header, and
+    payload bytes:
+        worker -> coordinator:      {"type": "challenge", "version": 2, "nonce": "..."}
+        coordinator -> worker:      {"type": "hello", "version": 2, "mac": "hex of HMAC-SHA256(token, nonce)"}
+        worker -> coordinator:      {"type": "hello", "version": 2, "slots": 8}
+        coordinator -> worker:      {"type": "compile", "argv": [...], "source_suffix": ".i", "output_suffix": ".o",
+                                     "directory": "..."} + preprocessed source
+        worker -> coordinator:      {"type": "result", "returncode": 0, "output": "..."} + object file
+
+    Usage:
+        $ export CAPTURE_WORKER_TOKEN=...                      # on the worker hosts and the capture host
+        $ python build_capture.py worker --listen 10.0.0.5:7632 --slots 16
+        $ python build_capture.py --remote_workers host1:7632,host2:7632 @project_root_path@ @result_output_path@
+"""
+
+import os
+import re
+import hmac
+import json
+import struct
+import socket
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+import socketserver
+import multiprocessing
+
+import capture.conf.settings as settings
+import capture.utils.spawn as spawn
+
+logger = logging.getLogger("capture")
+
+PROTOCOL_VERSION = 2
+DEFAULT_PORT = 7632
+TOKEN_ENVIRONMENT = "CAPTURE_WORKER_TOKEN"
+# Arguments replaced by paths of the job folder on worker.
+SOURCE_PLACEHOLDER = "@CAPTURE_SOURCE@"
+OUTPUT_PLACEHOLDER = "@CAPTURE_OUTPUT@"
+
+_FRAME_HEADER = struct.Struct("!II")
+_MAX_HEADER_SIZE = 16 * 1024 * 1024
+_MAX_PAYLOAD_SIZE = 1024 * 1024 * 1024
+_SUFFIX_REGEX = re.compile(r"^\.[A-Za-z0-9+]{1,8}$")
+# A worker failing this many times in a row is not used any more.
+_MAX_NODE_FAILURES = 3
+# Seconds a connection can take to pass the hello.
+_HELLO_TIMEOUT = 10
+
+# Code generation options jobs can have, anything else is refused. Values can't be paths, so no option reads files
+# out of the job folder.
+_ALLOWED_OPTIONS = frozenset(("-c", "-w", "-pipe", "-ansi", "-pedantic", "-pedantic-errors", "-pthread",
+                              "-emit-llvm"))
+_ALLOWED_OPTION_REGEX = re.compile(r"^(-O[0-3sgz]?|-Ofast|-g[\w.=-]*|-std=[\w+]+|-m[\w.=+-]+|-f[\w.=+-]+|"
+                                   r"-W[\w.=+-]*|--param=[\w-]+=[\w.]+|--target=[\w.-]+)$")
+# Prefix maps only rewrite file names written into outputs, their values can be any path.
+_PREFIX_MAP_REGEX = re.compile(r"^-f(debug|macro|file|profile)-prefix-map=[^=]*=[^=]*$")
+# Options with the next argument as value, and the pattern of value.
+_ALLOWED_VALUE_OPTIONS = {
+    "--param": re.compile(r"^[\w-]+=[\w.]+$"),
+    "-target": re.compile(r"^[\w.-]+$"),
+}
+# Options of the above patterns loading code, or reading files by name.
+_REFUSED_OPTION_PREFIXES = ("-mllvm", "-fplugin", "-fpass-plugin", "-fprofile-use", "-fprofile-instr-use",
+                            "-fprofile-sample-use", "-fprofile-dir", "-fauto-profile", "-fsanitize-blacklist",
+                            "-fsanitize-ignorelist", "-fxray-attr-list", "-fxray-always-instrument",
+                            "-fxray-never-instrument", "-fmodule", "-fprebuilt-module", "-fcrash-diagnostics")
+
+
+class RemoteError(Exception):
+    """Error happen in talking with capture workers"""
+    def __init__(self, message=None):
+        if message:
+            self.args = (message,)
+        else:
+            self.args = ("Remote Error happen!",)
+
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size > 0:
+        data = sock.recv(min(size, 1024 * 1024))
+        if not data:
+            raise ConnectionError("Connection closed.")
+        chunks.append(data)
+        size -= len(data)
+    return b"".join(chunks)
+
+
+def send_frame(sock, header, payload=b""):
+    header_data = json.dumps(header).encode("utf8")
+    sock.sendall(_FRAME_HEADER.pack(len(header_data), len(payload)) + header_data)
+    if payload:
+        sock.sendall(payload)
+
+
+def recv_frame(sock):
+    """:return:                     (header dict, payload bytes), ConnectionError is raised if peer is gone"""
+    header_size, payload_size = _FRAME_HEADER.unpack(_recv_exact(sock, _FRAME_HEADER.size))
+    if header_size > _MAX_HEADER_SIZE or payload_size > _MAX_PAYLOAD_SIZE:
+        raise RemoteError("Frame is too large: %d, %d" % (header_size, payload_size))
+    header = json.loads(_recv_exact(sock, header_size).decode("utf8"))
+    payload = _recv_exact(sock, payload_size) if payload_size else b""
+    return header, payload
+
+
+def parse_address(address):
+    host, _, port = address.strip().rpartition(":")
+    if not host:
+        return port or "127.0.0.1", DEFAULT_PORT
+    return host, int(port)
+
+
+def load_token(token_file=None):
+    """
+    Shared token of capture workers, from environment or the token file.
+    :param token_file:              default is [Remote] token_file of capture.cfg
+    :return:                        token string, None if there is no one
+    """
+    token = os.environ.get(TOKEN_ENVIRONMENT)
+    if token:
+        return token
+    token_file = token_file or settings.get_settings().remote_token_file
+    if not token_file:
+        return None
+    try:
+        with open(token_file, "r") as fin:
+            return fin.read().strip() or None
+    except (IOError, OSError) as e:
+        logger.warning("Reading capture worker token %s fail: %s" % (token_file, e))
+        return None
+
+
+def _token_mac(token, nonce):
+    return hmac.new(token.encode("utf8"), nonce.encode("utf8"), "sha256").hexdigest()
+
+
+def check_argv(argv):
+    """
+    Check arguments after the compiler of a job: placeholders, code generation options and their values only.
+    :return:                        reason of refusing argv, None if argv is allowed
+    """
+    sources = outputs = 0
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        if arg == SOURCE_PLACEHOLDER:
+            sources += 1
+        elif arg == "-o":
+            if i + 1 >= len(argv) or argv[i + 1] != OUTPUT_PLACEHOLDER:
+                return "Output is not the placeholder."
+            outputs += 1
+            i += 1
+        elif arg in _ALLOWED_VALUE_OPTIONS:
+            if i + 1 >= len(argv) or not _ALLOWED_VALUE_OPTIONS[arg].match(argv[i + 1]):
+                return "Option value is not allowed: %s" % " ".join(argv[i:i + 2])
+            i += 1
+        elif _PREFIX_MAP_REGEX.match(arg):
+            pass
+        elif arg not in _ALLOWED_OPTIONS and (not _ALLOWED_OPTION_REGEX.match(arg) or ".." in arg
+                                              or arg.startswith(_REFUSED_OPTION_PREFIXES)):
+            return "Option is not allowed: %s" % arg
+        i += 1
+    if sources != 1 or outputs != 1:
+        return "Job needs one source and one output."
+    return None
+
+
+def default_allowed_compilers():
+    compilers = {"gcc", "g++", "cc", "c++", "clang", "clang++"}
+    for compiler_info in settings.get_settings().compiler_map.values():
+        compilers.update(compiler_info.values())
+    return compilers
+
+
+# Worker side
+class CompileRequestHandler(socketserver.BaseRequestHandler):
+    def _hello(self):
+        """:return:                     True if the coordinator knows the token"""
+        nonce = os.urandom(16).hex()
+        self.request.settimeout(_HELLO_TIMEOUT)
+        send_frame(self.request, {"type": "challenge", "version": PROTOCOL_VERSION, "nonce": nonce})
+        header, _ = recv_frame(self.request)
+        mac = header.get("mac")
+        if header.get("type") != "hello" or header.get("version") != PROTOCOL_VERSION or not isinstance(mac, str) \
+                or not hmac.compare_digest(mac, _token_mac(self.server.token, nonce)):
+            logger.warning("Capture worker refuses %s:%d: bad hello." % self.client_address[:2])
+            send_frame(self.request, {"type": "error", "error": "Bad hello or token."})
+            return False
+        self.request.settimeout(None)
+        send_frame(self.request, {"type": "hello", "version": PROTOCOL_VERSION, "slots": self.server.slots})
+        return True
+
+    def handle(self):
+        try:
+            if not self._hello():
+                return
+        except (ConnectionError, OSError, RemoteError, ValueError):
+            return
+        while True:
+            try:
+                header, payload = recv_frame(self.request)
+            except (ConnectionError, OSError, RemoteError, ValueError):
+                return
+            message_type = header.get("type")
+            if message_type == "compile":
+                result, data = self.server.compile(header, payload)
+                send_frame(self.request, result, data)
+            else:
+                send_frame(self.request, {"type": "error", "error": "Unknown request: %s" % message_type})
+                return
+
+
+class WorkerServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, token, slots=multiprocessing.cpu_count(), allowed_compilers=None):
+        """
+        :param address:                 (host, port) listened on, port 0 for any free port
+        :param token:                   shared token coordinators should know
+        :param slots:                   max concurrent compiling jobs
+        :param allowed_compilers:       compiler names jobs can run, default are compilers in capture.cfg
+        """
+        if not token:
+            raise ValueError("Capture worker needs a token.")
+        self.token = token
+        self.slots = max(1, slots)
+        self.allowed_compilers = set(allowed_compilers or default_allowed_compilers())
+        self._semaphore = threading.BoundedSemaphore(self.slots)
+        socketserver.TCPServer.__init__(self, address, CompileRequestHandler)
+
+    def compile(self, header, payload):
+        argv = header.get("argv") or []
+        if not argv or os.path.basename(argv[0]) not in self.allowed_compilers:
+            return {"type": "result", "returncode": -1, "output": "Compiler is not allowed: %s" % argv[:1]}, b""
+        reason = check_argv(argv[1:])
+        if reason is not None:
+            return {"type": "result", "returncode": -1, "output": reason}, b""
+        source_suffix = header.get("source_suffix", ".i")
+        output_suffix = header.get("output_suffix", ".o")
+        if not _SUFFIX_REGEX.match(source_suffix) or not _SUFFIX_REGEX.match(output_suffix):
+            return {"type": "result", "returncode": -1, "output": "Bad file suffix."}, b""
+
+        with self._semaphore:
+            job_path = tempfile.mkdtemp(prefix="capture-worker-")
+            try:
+                source = os.path.join(job_path, "source" + source_suffix)
+                output = os.path.join(job_path, "output" + output_suffix)
+                with open(source, "wb") as fout:
+                    fout.write(payload)
+                argv = [source if arg == SOURCE_PLACEHOLDER else output if arg == OUTPUT_PLACEHOLDER else arg
+                        for arg in argv]
+                if header.get("directory") and any(arg.startswith("-g") for arg in argv):
+                    # Debug info keeps working directory of the capture host.
+                    argv.append("-fdebug-prefix-map=%s=%s" % (job_path, header["directory"]))
+                returncode, out, _ = spawn.run(argv, cwd=job_path, max_output=spawn.DEFAULT_MAX_OUTPUT)
+                data = b""
+                if returncode == 0:
+                    with open(output, "rb") as fin:
+                        data = fin.read()
+                return {"type": "result", "returncode": returncode,
+                        "output": out.decode("utf8", "replace") if out else ""}, data
+            except (IOError, OSError) as e:
+                return {"type": "result", "returncode": -1, "output": str(e)}, b""
+            finally:
+                shutil.rmtree(job_path, ignore_errors=True)
+
+
+def serve_worker(address, token, slots, allowed_compilers=None):
+    server = WorkerServer(address, token, slots, allowed_compilers)
+    logger.info("Capture worker is listening on %s:%d, slots: %d" % (server.server_address[0],
+                                                                    server.server_address[1], server.slots))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Capture worker stopped.")
+    finally:
+        server.server_close()
+    return 0
+
+
+def worker_main(argv):
+    parser = argparse.ArgumentParser(prog="build_capture.py worker",
+                                     description="Run capture worker compiling preprocessed sources.")
+    parser.add_argument("--listen", default="127.0.0.1:%d" % DEFAULT_PORT,
+                        help="HOST:PORT the worker listens on. (default: %(default)s)")
+    parser.add_argument("--slots", default=multiprocessing.cpu_count(), type=int,
+                        help="Max concurrent compiling jobs. (default: %(default)s)")
+    parser.add_argument("--allow", default=None,
+                        help="Comma separated compiler names jobs can run, default are the compilers in capture.cfg.")
+    parser.add_argument("--token_file", default=None,
+                        help="File of the shared token, default is %s in environment, or [Remote] token_file in "
+                             "capture.cfg." % TOKEN_ENVIRONMENT)
+    args = parser.parse_args(argv)
+    token = load_token(args.token_file)
+    if not token:
+        parser.error("Capture worker needs a token: set %s, or give --token_file." % TOKEN_ENVIRONMENT)
+    allowed = [name.strip() for name in args.allow.split(",") if name.strip()] if args.allow else None
+    return serve_worker(parse_address(args.listen), token, args.slots, allowed)
+
+
+# Coordinator side
+def _write_file(path, data):
+    tmp_path = "%s.tmp.%d.%d" % (path, os.getpid(), threading.get_ident())
+    try:
+        with open(tmp_path, "wb") as fout:
+            fout.write(data)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+class RemoteNode(object):
+    def __init__(self, address, slots):
+        self.address = address
+        self.slots = slots
+        self.busy = 0
+        self.jobs = 0
+        self.failures = 0
+        self.alive = True
+        self.idle_sockets = []
+
+    @property
+    def name(self):
+        return "%s:%d" % self.address
+
+
+class RemotePool(object):
+    """Workers and their connections, jobs are dispatched by free slots of workers."""
+    def __init__(self, nodes, token, connect_timeout=5.0, job_timeout=None):
+        """
+        :param nodes:                   RemoteNode list
+        :param token:                   shared token of workers
+        :param connect_timeout:         seconds of connecting and hello
+        :param job_timeout:             seconds of one compiling job, None for no limit
+        """
+        self._nodes = nodes
+        self._token = token
+        self._connect_timeout = connect_timeout
+        self._job_timeout = job_timeout
+        self._condition = threading.Condition()
+
+    @classmethod
+    def connect(cls, addresses, connect_timeout=5.0, job_timeout=None, token=None):
+        """
+        Ask slots of workers, unreachable workers are skipped.
+        :param token:                   default is load_token(), no worker is used without a token
+        """
+        token = token or load_token()
+        pool = cls([], token, connect_timeout, job_timeout)
+        if not token:
+            logger.warning("No capture worker is used: set %s or [Remote] token_file." % TOKEN_ENVIRONMENT)
+            return pool
+        for address in addresses:
+            address = parse_address(address) if isinstance(address, str) else tuple(address)
+            node = RemoteNode(address, 0)
+            try:
+                sock = pool._open(node)
+            except (OSError, RemoteError, ValueError) as e:
+                logger.warning("Capture worker %s is not used: %s" % (node.name, e))
+                continue
+            node.idle_sockets.append(sock)
+            pool._nodes.append(node)
+            logger.info("Capture worker %s: %d slots." % (node.name, node.slots))
+        return pool
+
+    def _open(self, node):
+        sock = socket.create_connection(node.address, timeout=self._connect_timeout)
+        try:
+            header, _ = recv_frame(sock)
+            if header.get("type") != "challenge" or header.get("version") != PROTOCOL_VERSION \
+                    or not isinstance(header.get("nonce"), str):
+                raise RemoteError("Bad challenge from %s: %s" % (node.name, header))
+            send_frame(sock, {"type": "hello", "version": PROTOCOL_VERSION,
+                              "mac": _token_mac(self._token, header["nonce"])})
+            header, _ = recv_frame(sock)
+            if header.get("type") != "hello" or header.get("version") != PROTOCOL_VERSION:
+                raise RemoteError("Bad hello from %s: %s" % (node.name, header))
+            node.slots = max(1, int(header.get("slots", 1)))
+            sock.settimeout(self._job_timeout)
+            return sock
+        except BaseException:
+            sock.close()
+            raise
+
+    @property
+    def nodes(self):
+        return list(self._nodes)
+
+    @property
+    def capacity(self):
+        with self._condition:
+            return sum(node.slots for node in self._nodes if node.alive)
+
+    def acquire(self, block=True):
+        """
+        Take a slot of the worker with most free slots in proportion to its slots.
+        :return:                        RemoteNode, None if no worker is free and block is False, or no worker alive
+        """
+        with self._condition:
+            while True:
+                free_nodes = [node for node in self._nodes if node.alive and node.busy < node.slots]
+                if free_nodes:
+                    node = max(free_nodes, key=lambda n: ((n.slots - n.busy) / float(n.slots), n.slots))
+                    node.busy += 1
+                    return node
+                if not block or not any(node.alive for node in self._nodes):
+                    return None
+                self._condition.wait()
+
+    def release(self, node, sock=None, failed=False):
+        with self._condition:
+            node.busy -= 1
+            if failed:
+                node.failures += 1
+                if node.failures >= _MAX_NODE_FAILURES and node.alive:
+                    node.alive = False
+                    logger.warning("Capture worker %s fails %d times, it is not used any more."
+                                   % (node.name, node.failures))
+            else:
+                node.failures = 0
+                node.jobs += 1
+                if sock is not None:
+                    node.idle_sockets.append(sock)
+            self._condition.notify_all()
+
+    def compile(self, unit, data, block=False):
+        """
+        Compile preprocessed source of unit on a worker, object is written into unit.output.
+        :param unit:                    preprocess.CompileUnit
+        :param data:                    preprocessed source
+        :param block:                   wait for a free worker slot
+        :return:                        (returncode, compiler output), None if no worker is free or the worker fails,
+                                            then the caller should compile locally
+        """
+        argv = unit.compile_argv(SOURCE_PLACEHOLDER, OUTPUT_PLACEHOLDER)
+        reason = check_argv(argv[1:])
+        if reason is not None:
+            # Workers would refuse it too.
+            logger.debug("Compiling %s locally: %s" % (unit.source, reason))
+            return None
+        node = self.acquire(block)
+        if node is None:
+            return None
+        sock = None
+        try:
+            with self._condition:
+                sock = node.idle_sockets.pop() if node.idle_sockets else None
+            if sock is None:
+                sock = self._open(node)
+            send_frame(sock, {
+                "type": "compile",
+                "argv": argv,
+                "source_suffix": unit.preprocessed_suffix,
+                "output_suffix": unit.suffix,
+                "directory": os.path.abspath(unit.directory),
+            }, data)
+            header, payload = recv_frame(sock)
+            if header.get("type") != "result":
+                raise RemoteError("Bad result from %s: %s" % (node.name, header))
+            returncode = header.get("returncode", -1)
+            if returncode == -1:
+                # Compiler can't be started on worker, it is not an error of the source.
+                raise RemoteError(header.get("output", ""))
+            if returncode == 0:
+                _write_file(unit.output, payload)
+        except (OSError, RemoteError, ValueError) as e:
+            logger.warning("Compiling %s on capture worker %s fail: %s" % (unit.source, node.name, e))
+            if sock is not None:
+                sock.close()
+            self.release(node, failed=True)
+            return None
+        self.release(node, sock)
+        return returncode, header.get("output", "")
+
+    def stats(self):
+        with self._condition:
+            return dict((node.name, node.jobs) for node in self._nodes)
+
+    def close(self):
+        with self._condition:
+            for node in self._nodes:
+                for sock in node.idle_sockets:
+                    sock.close()
+                node.idle_sockets = []
+
+
+# vi:set tw=0 ts=4 sw=4 nowrap fdm=indent
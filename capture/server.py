@@ -0,0 +1,193 @@
+# !/bin/env python
+# -*- coding: utf-8 -*_
+"""
+
+    @FileName: server.py
+    @Author: zengzhishi(zengzs1995@gmail.com)
+    @CreatTime: 2018-04-12 10:08:35
+    @LastModif: 2018-04-12 10:08:35
+    @Note: Capture server, runs capture requests in a long running process.
+    Interpreter start up, module imports, PLY lexers and config loading are paid once, tree indexes stay in memory,
+    and concurrent requests share one process pool.
+
+    Protocol on unix socket, one json object per line:
+        client -> server:   {"args": {...build_capture.py arguments...}}
+        server -> client:   {"log": "..."}              (any times)
+                            {"returncode": 0}           (last line)
+
+    Usage:
+        $ python build_capture.py serve --socket /tmp/capture.sock
+        $ python build_capture.py --server /tmp/capture.sock @project_root_path@ @result_output_path@
+"""
+
+import os
+import sys
+import json
+import socket
+import logging
+import argparse
+import tempfile
+import threading
+import itertools
+import socketserver
+
+import capture.building_process as building_process
+import capture.conf.parse_logger as parse_logger
+
+logger = logging.getLogger("capture")
+
+DEFAULT_SOCKET_PATH = os.path.join(tempfile.gettempdir(), "capture-%d.sock" % os.getuid())
+
+_request_counter = itertools.count(1)
+
+
+class _RequestLogHandler(logging.Handler):
+    """Send log records of one request back to its client."""
+    def __init__(self, wfile):
+        super(_RequestLogHandler, self).__init__()
+        self._wfile = wfile
+        self._closed = False
+
+    def emit(self, record):
+        if self._closed:
+            return
+        try:
+            _send(self._wfile, {"log": self.format(record)})
+        except (OSError, ValueError):
+            # Client is gone, the capture keeps running.
+            self._closed = True
+
+
+def _send(wfile, message):
+    wfile.write((json.dumps(message) + "\n").encode("utf8"))
+    wfile.flush()
+
+
+class CaptureRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode("utf8"))
+            args = request["args"]
+            if not isinstance(args, dict):
+                raise TypeError()
+        except (ValueError, KeyError, TypeError):
+            _send(self.wfile, {"returncode": 2, "error": "Bad capture request."})
+            return
+
+        thread_name = "capture-request-%d" % next(_request_counter)
+        threading.current_thread().name = thread_name
+        log_handler = _RequestLogHandler(self.wfile)
+        log_handler.setFormatter(parse_logger.console_formatter)
+        log_handler.addFilter(parse_logger.ThreadFilter(thread_name))
+        logger.addHandler(log_handler)
+        logger.info("Capture request: %s -> %s" % (args.get("project_root_path"), args.get("result_output_path")))
+
+        returncode = 0
+        try:
+            self.server.run_capture(args, process_pool=self.server.process_pool)
+        except SystemExit as e:
+            returncode = e.code if isinstance(e.code, int) else 1
+        except Exception:
+            logger.exception("Capture request fail.")
+            returncode = 1
+        finally:
+            logger.removeHandler(log_handler)
+
+        try:
+            _send(self.wfile, {"returncode": returncode})
+        except (OSError, ValueError):
+            pass
+
+
+class CaptureServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, run_capture, process_pool):
+        """
+        :param socket_path:
+        :param run_capture:             function(args, process_pool) running one capture
+        :param process_pool:            process pool shared by requests
+        """
+        self.run_capture = run_capture
+        self.process_pool = process_pool
+        socketserver.UnixStreamServer.__init__(self, socket_path, CaptureRequestHandler)
+
+
+def _is_serving(socket_path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+
+def serve(socket_path, run_capture, worker_num=building_process.CPU_CORE_COUNT):
+    if os.path.exists(socket_path):
+        if _is_serving(socket_path):
+            logger.critical("Capture server is already listening on %s" % socket_path)
+            return 1
+        os.unlink(socket_path)
+
+    # Workers are forked before any request thread starts.
+    process_pool = building_process.create_shared_pool(worker_num)
+    server = CaptureServer(socket_path, run_capture, process_pool)
+    os.chmod(socket_path, 0o600)
+    logger.info("Capture server is listening on %s, workers: %d" % (socket_path, worker_num))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Capture server stopped.")
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        process_pool.terminate()
+        process_pool.join()
+    return 0
+
+
+def serve_main(argv, run_capture):
+    parser = argparse.ArgumentParser(prog="build_capture.py serve", description="Run capture server.")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET_PATH,
+                        help="Unix socket path the server listens on. (default: %(default)s)")
+    parser.add_argument("--workers", default=building_process.CPU_CORE_COUNT, type=int,
+                        help="Process count of the shared process pool. (default: %(default)s)")
+    args = parser.parse_args(argv)
+    sys.exit(serve(args.socket, run_capture, max(1, args.workers)))
+
+
+def request(socket_path, args, output=None):
+    """
+    Send capture request, print logs of the capture, and return its return code.
+    :param socket_path:
+    :param args:                        build_capture.py arguments, paths should be absolute.
+    :param output:                      file logs are written to, default is stdout.
+    """
+    output = output or sys.stdout
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except OSError as e:
+        logger.critical("Connecting capture server %s fail: %s" % (socket_path, e))
+        sock.close()
+        return 1
+
+    with sock, sock.makefile("rwb") as stream:
+        _send(stream, {"args": args})
+        for line in stream:
+            message = json.loads(line.decode("utf8"))
+            if "log" in message:
+                output.write(message["log"] + "\n")
+                output.flush()
+            if "returncode" in message:
+                if message.get("error"):
+                    logger.critical(message["error"])
+                return message["returncode"]
+    logger.critical("Capture server closed connection before capture finished.")
+    return 1
+
+
+# vi:set tw=0 ts=4 sw=4 nowrap fdm=indent
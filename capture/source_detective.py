@@ -4,40 +4,80 @@
 import os
 import shutil
 import subprocess
-import queue
 import copy
-import configparser
-
-import capture.utils.parse_cmake as parse_cmake
-import capture.utils.parse_make as parse_make
-import capture.utils.parse_scons as parse_scons
-import capture.utils.parse_autotools as parse_autotools
-import capture.utils.parse_cmakelists as parse_cmakelists
 
 import capture.utils.capture_util as capture_util
+import capture.utils.instrument as instrument
+import capture.utils.project_walk as project_walk
+import capture.utils.ignore_rules as ignore_rules
+import capture.conf.settings as settings
+
+# Building type backends are imported when their analyzer runs, e.g. autotools one pulls in ply.
+parse_cmake = capture_util.lazy_module("capture.utils.parse_cmake")
+parse_make = capture_util.lazy_module("capture.utils.parse_make")
+parse_scons = capture_util.lazy_module("capture.utils.parse_scons")
+parse_autotools = capture_util.lazy_module("capture.utils.parse_autotools")
+parse_cmakelists = capture_util.lazy_module("capture.utils.parse_cmakelists")
 
 import logging
 logger = logging.getLogger("capture")
 
-DEFAULT_CONFIG_FILE = os.path.join("capture", "conf", "capture.cfg")
-
 # suffix config loading
-config = configparser.ConfigParser()
-config.read(DEFAULT_CONFIG_FILE)
+_settings = settings.get_settings()
+
+DEFAULT_FLAGS = _settings.default_flags
+DEFAULT_MACROS = _settings.default_macros
+DEFAULT_CXX_FLAGS = _settings.default_cxx_flags
 
-DEFAULT_FLAGS = config.get("Default", "default_flags").split()
-DEFAULT_MACROS = config.get("Default", "default_macros").split(",")
-DEFAULT_CXX_FLAGS = config.get("Default", "default_cxx_flags").split()
+c_file_suffix = _settings.c_file_suffix
+cxx_file_suffix = _settings.cxx_file_suffix
+source_file_suffix = _settings.source_file_suffix
+include_file_suffix = _settings.include_file_suffix
+SUFFIX_KINDS = project_walk.build_suffix_kinds(source_file_suffix, include_file_suffix)
 
-c_file_suffix_str = config.get("Default", "source_c_suffix")
-cxx_file_suffix_str = config.get("Default", "source_cxx_suffix")
+IGNORE_FILES = _settings.ignore_files
+EXCLUDE_PATTERNS = _settings.exclude_patterns
 
-c_file_suffix = set(c_file_suffix_str.split(","))
-cxx_file_suffix = set(cxx_file_suffix_str.split(","))
-source_file_suffix = c_file_suffix | cxx_file_suffix
-include_file_suffix = set(config.get("Default", "include_suffix").split(","))
+VERBOSE_LIST = _settings.scons_verbose
 
-VERBOSE_LIST = config.get("SCons", "verbose").split(',')
+
+def get_ignore_matcher(root_path, exclude_paths=None):
+    """
+    Ignore rules of project: exclude patterns in config, and generated folders like output path inside project.
+    :param root_path:
+    :param exclude_paths:               folders will not be scan.
+    :return:
+    """
+    patterns = list(EXCLUDE_PATTERNS)
+    abs_root_path = os.path.abspath(root_path)
+    for path in exclude_paths or []:
+        if not path:
+            continue
+        abs_path = os.path.abspath(path)
+        if abs_path.startswith(abs_root_path + os.path.sep):
+            relative_path = abs_path[len(abs_root_path):].replace(os.path.sep, "/")
+            patterns.append(ignore_rules.escape_glob(relative_path) + "/")
+    return ignore_rules.IgnoreMatcher.from_patterns(root_path, patterns, IGNORE_FILES)
+
+
+def get_project_walk(root_path, prefers, walks=None, exclude_paths=None, index_path=None):
+    """
+    Return walk of project, walks with the same root_path and prefers are shared through walks dict.
+    :param root_path:
+    :param prefers:
+    :param walks:                       {(root_path, prefers, exclude_paths): ProjectWalk}
+    :param exclude_paths:               folders will not be scan.
+    :param index_path:                  tree index file path, folders not modified since last walk are not listed.
+    :return:
+    """
+    key = (root_path, tuple(prefers), tuple(exclude_paths or []))
+    if walks is not None and key in walks:
+        return walks[key]
+    walk = project_walk.ProjectWalk(root_path, prefers, SUFFIX_KINDS,
+                                    ignore=get_ignore_matcher(root_path, exclude_paths), index_path=index_path)
+    if walks is not None:
+        walks[key] = walk
+    return walk
 
 
 def get_directions(path):
@@ -120,8 +160,9 @@ def get_relative_build_path(path, project_path, cmake_build_path):
 
 
 def set_default(infos):
-    infos["flags"] = DEFAULT_FLAGS
-    infos["definitions"] = DEFAULT_MACROS
+    # Copies, settings are shared by all captures of the process.
+    infos["flags"] = list(DEFAULT_FLAGS)
+    infos["definitions"] = list(DEFAULT_MACROS)
     return
 
 
@@ -166,45 +207,19 @@ def get_definitions(path):
     return definitions
 
 
-def autotools_project_walk(root_path, prefers):
-    to_walks = queue.Queue()
-
-    definitions = get_definitions(root_path)
-    to_walks.put((root_path, definitions))
-
-    prefer_paths = set()
-    for name in prefers:
-        file_path = os.path.join(root_path, name)
-        prefer_paths.add(file_path)
-
-    level = 0
-    while not to_walks.empty():
-        (present_path, old_definitions) = to_walks.get()
+def autotools_project_walk(root_path, prefers, walks=None):
+    folder_definitions = {}
+    for present_path, records in get_project_walk(root_path, prefers, walks).folder_records:
         definitions = get_definitions(present_path)
-        def_str = ""
-        print("\tscan path:" + present_path)
-
+        # Folders without macros inherit from parent folder.
         if len(definitions) == 0:
-            definitions = old_definitions
+            definitions = folder_definitions.get(os.path.dirname(present_path), [])
+        folder_definitions[present_path] = definitions
 
+        def_str = ""
         for def_s in definitions:
             def_str += " " + def_s
-
-        filelists = os.listdir(present_path)
-        files = []
-        for file_name in filelists:
-            file_path = os.path.join(present_path, file_name)
-            if os.path.isdir(file_path):
-                if not level:
-                    if file_path in prefer_paths:
-                        to_walks.put((file_path, definitions))
-                else:
-                    if file_name[0] != '.':                         # exclude hidden file.
-                        to_walks.put((file_path, definitions))
-            else:
-                files.append(file_name)
-        level = 1
-        yield (present_path, files, def_str)
+        yield (present_path, records, def_str)
 
 
 def get_present_path_autotools(root_path, prefers):
@@ -228,21 +243,15 @@ def get_present_path_autotools(root_path, prefers):
     files_s_defs = []
     files_s = []
     files_h = []
-    for line_tulpe in autotools_project_walk(root_path, prefers):
-        folder = line_tulpe[0]
-        file_names = line_tulpe[1]
-        definition = line_tulpe[2]
+    for folder, records, definition in autotools_project_walk(root_path, prefers):
         paths.append(folder)
-        for file_name in file_names:
-            slice = file_name.split('.')
-            suffix = slice[-1]
-            if len(slice) > 1:
-                if suffix in source_file_suffix:
-                    output_name_prefix = folder[root_path_length + 1:].replace(os.path.sep, "_")
-                    files_s.append((os.path.join(folder, file_name), output_name_prefix))
-                    files_s_defs.append(definition)
-                elif suffix in include_file_suffix:
-                    files_h.append(os.path.join(folder, file_name))
+        for record in records:
+            if record.kind == project_walk.SOURCE:
+                output_name_prefix = folder[root_path_length + 1:].replace(os.path.sep, "_")
+                files_s.append((record.path, output_name_prefix))
+                files_s_defs.append(definition)
+            elif record.kind == project_walk.HEADER:
+                files_h.append(record.path)
     return paths, files_s, files_h, files_s_defs
 
 
@@ -276,59 +285,28 @@ class AnalyzerError(Exception):
 
 
 class Analyzer(object):
-    def __init__(self, root_path, output_path, prefers, build_path=None):
+    def __init__(self, root_path, output_path, prefers, build_path=None, walks=None):
+        """
+        :param walks:                   dict of project walks shared by analyzers, see get_project_walk
+        """
         self._project_path = root_path
         self._output_path = output_path
         self._prefers = prefers
         self._build_path = build_path if build_path else self._project_path
+        self._walks = walks
 
-    def selective_walk(self):
-        """Scan project and return present_path and files"""
-        to_walks = queue.Queue()
-
-        to_walks.put(self._project_path)
-
-        prefer_paths = set()
-        for name in self._prefers:
-            file_path = os.path.join(self._project_path, name)
-            prefer_paths.add(file_path)
-
-        level = 0
-        while not to_walks.empty():
-            present_path = to_walks.get()
-            logger.info("\tscan path: %s" % present_path)
-
-            files = []
-            for file_name in os.listdir(present_path):
-                file_path = os.path.join(present_path, file_name)
-                if os.path.isdir(file_path):
-                    if not level:
-                        if file_path in prefer_paths:
-                            to_walks.put(file_path)
-                    else:
-                        if file_name[0] != '.':                         # Exclude hidden files
-                            to_walks.put(file_path)
-                else:
-                    files.append(file_name)
-            level = 1
-            yield (present_path, files)
+    def project_walk(self):
+        index_path = None
+        if self._output_path and os.path.isdir(self._output_path):
+            index_path = os.path.join(self._output_path, project_walk.DEFAULT_TREE_INDEX_FILE)
+        return get_project_walk(self._project_path, self._prefers, self._walks,
+                                exclude_paths=[self._output_path], index_path=index_path)
 
     def get_project_infos(self):
-        paths = []
-        files_s = []
-        files_h = []
-        for line_tulpe in self.selective_walk():
-            folder = line_tulpe[0]
-            file_paths = line_tulpe[1]
-            paths.append(folder)
-            for file_path in file_paths:
-                slice = file_path.split('.')
-                suffix = slice[-1]
-                if len(slice) > 1:
-                    if suffix in source_file_suffix:
-                        files_s.append(os.path.join(folder, file_path))
-                    elif suffix in include_file_suffix:
-                        files_h.append(os.path.join(folder, file_path))
+        walk = self.project_walk()
+        paths = walk.folders
+        files_s = walk.files(project_walk.SOURCE)
+        files_h = walk.files(project_walk.HEADER)
         return paths, files_s, files_h
 
 
@@ -345,17 +323,20 @@ class SConsAnalyzer(Analyzer):
         else:
             output = open(os.path.join(self._output_path, "scons_infos.txt"), "w+")
 
-        if build_args:
-            output = parse_scons.create_command_infos(self._build_path, output,
-                                                      VERBOSE_LIST, build_args=build_args)
-        else:
-            output = parse_scons.create_command_infos(self._build_path, output, VERBOSE_LIST)
-        if not output:
-            raise AnalyzerError("Without SConstruct in project.")
-        output.flush()
-        output.seek(0)
-        line_count, skip_count, compile_db = parse_scons.parse_flags(output, self._build_path)
-        output.close()
+        with instrument.phase("parse_scons"):
+            if build_args:
+                output = parse_scons.create_command_infos(self._build_path, output,
+                                                          VERBOSE_LIST, build_args=build_args)
+            else:
+                output = parse_scons.create_command_infos(self._build_path, output, VERBOSE_LIST)
+            if not output:
+                raise AnalyzerError("Without SConstruct in project.")
+            output.flush()
+            output.seek(0)
+            line_count, skip_count, compile_db = parse_scons.parse_flags(output, self._build_path)
+            output.close()
+            instrument.count("lines", line_count)
+            instrument.count("entries", len(compile_db))
         logger.info("Parse scons building result: [line_count: %d] [skip_count: %d]" %
                     (line_count, skip_count))
         return paths, files_s, files_h, compile_db
@@ -374,18 +355,21 @@ class MakeAnalyzer(Analyzer):
         else:
             output = open(os.path.join(self._output_path, "make_infos.txt"), "w+")
 
-        if build_args:
-            output = parse_make.create_command_infos(self._build_path, output, make_args=build_args)
-        else:
-            output = parse_make.create_command_infos(self._build_path, output)
+        with instrument.phase("parse_make"):
+            if build_args:
+                output = parse_make.create_command_infos(self._build_path, output, make_args=build_args)
+            else:
+                output = parse_make.create_command_infos(self._build_path, output)
 
-        if not output:
-            raise AnalyzerError("Not found Makefile in project.")
-        output.flush()
-        output.seek(0)
+            if not output:
+                raise AnalyzerError("Not found Makefile in project.")
+            output.flush()
+            output.seek(0)
 
-        line_count, skip_count, compile_db = parse_make.parse_flags(output, self._build_path)
-        output.close()
+            line_count, skip_count, compile_db = parse_make.parse_flags(output, self._build_path)
+            output.close()
+            instrument.count("lines", line_count)
+            instrument.count("entries", len(compile_db))
         logger.info("Parse make building result: [line_count: %d] [skip_count: %d]" %
                     (line_count, skip_count))
 
@@ -471,24 +455,15 @@ class CMakeAnalyzer(Analyzer):
             files_s_infos -> list
             files_s_infos = [[files_s, flags, defs, includes, exec_path], ...]
         """
-        to_walks = queue.Queue()
-        to_walks.put(self._project_path)
         # Mark sources have been compiled
         used_file_s_set = set()
         # Add all includes for compiling undefined source
         include_set = set()
-        # Add prefer folders
-        prefer_paths = set()
-        for name in self._prefers:
-            file_path = os.path.join(self._project_path, name)
-            prefer_paths.add(file_path)
 
-        level = 0
         other_file_s = []
-        while not to_walks.empty():
-            present_path = to_walks.get()
+        for present_path, records in self.project_walk().folder_records:
             if check_cmake(present_path, self._project_path, self._build_path):
-                logger.info("\tscan path: %s" % present_path)
+                logger.info("\tscan cmake path: %s" % present_path)
                 info_list = self.get_cmake_info(present_path)
                 if self._build_path:
                     exec_path = self._build_path
@@ -505,22 +480,11 @@ class CMakeAnalyzer(Analyzer):
                     data_dict["config_from"] = present_path
                 yield info_list
 
-            for file_name in os.listdir(present_path):
-                file_path = os.path.abspath(os.path.join(present_path, file_name))
-                if os.path.isdir(file_path):
-                    if not level:
-                        if file_path in prefer_paths:
-                            to_walks.put(file_path)
-                    else:
-                        if file_name[0] != '.':
-                            to_walks.put(file_path)
-                else:
+            for record in records:
+                if record.kind == project_walk.SOURCE or record.kind == project_walk.HEADER:
+                    file_path = os.path.abspath(record.path)
                     if file_path not in used_file_s_set:
-                        slice = file_name.split('.')
-                        suffix = slice[-1]
-                        if suffix in source_file_suffix or suffix in include_file_suffix:
-                            other_file_s.append(file_path)
-            level = 1
+                        other_file_s.append(file_path)
 
         # Build up undefined sources list
         undefind_files = []
@@ -541,6 +505,7 @@ class CMakeAnalyzer(Analyzer):
         }]
         yield undefind_info_list
 
+    @instrument.timed("parse_cmake")
     def get_project_infos(self):
         if len(self._prefers) == 0:
             self._prefers = ["src", "include", "lib", "modules"]
@@ -552,7 +517,7 @@ class CMakeAnalyzer(Analyzer):
             "source_files": [],
             "exec_directory": self._project_path,
             "compiler_type": "CXX",
-            "flags": DEFAULT_CXX_FLAGS,
+            "flags": list(DEFAULT_CXX_FLAGS),
             "custom_flags": [],
             "custom_definitions": [],
         }
@@ -589,6 +554,7 @@ class CMakeAnalyzer(Analyzer):
         if len(cxx_files_info["source_files"]):
             source_infos.append(cxx_files_info)
 
+        instrument.count("targets", len(source_infos))
         return source_infos, include_files, files_count
 
 
@@ -598,24 +564,23 @@ class AutoToolsAnalyzer(Analyzer):
         files_s = []
         files_h = []
         files_am = []
-        for line_tulpe in self.selective_walk():
-            folder = line_tulpe[0]
-            file_paths = line_tulpe[1]
+        walk = self.project_walk()
+        for folder, records in walk.folder_records:
             paths.append(folder)
-            for file_path in file_paths:
-                slice = file_path.split('.')
-                suffix = slice[-1]
-                if len(slice) > 1:
-                    if suffix in source_file_suffix:
-                        files_s.append(os.path.join(folder, file_path))
-                    elif suffix in include_file_suffix:
-                        files_h.append(os.path.join(folder, file_path))
-                    elif suffix == "am":
-                        # Saving Makefile.am path
-                        files_am.append(os.path.join(folder, file_path))
-
-        auto_tools_parser = parse_autotools.AutoToolsParser(self._project_path, self._output_path)
-        result = auto_tools_parser.get_project_analysis_result(files_am)
+            for record in records:
+                if record.kind == project_walk.SOURCE:
+                    files_s.append(record.path)
+                elif record.kind == project_walk.HEADER:
+                    files_h.append(record.path)
+                elif record.kind == project_walk.MAKEFILE_AM:
+                    # Saving Makefile.am path
+                    files_am.append(record.path)
+
+        with instrument.phase("parse_autotools"):
+            auto_tools_parser = parse_autotools.AutoToolsParser(self._project_path, self._output_path)
+            result = auto_tools_parser.get_project_analysis_result(files_am)
+            instrument.count("makefile_am", len(files_am))
+            instrument.count("targets", len(result))
 
         defined_file_set = set()
         for am_info in result:
@@ -663,9 +628,11 @@ class CMakeListAnalyzer(Analyzer):
     def get_project_infos_cmakelist(self):
         paths, files_s, files_h = self.get_project_infos()
 
-        cmake_parser = parse_cmakelists.CMakeParser(self._project_path, self._output_path)
-        result_info = cmake_parser.get_project_analysis_result()
-        cmake_parser.dump_cmake_info()
+        with instrument.phase("parse_cmakelists"):
+            cmake_parser = parse_cmakelists.CMakeParser(self._project_path, self._output_path)
+            result_info = cmake_parser.get_project_analysis_result()
+            cmake_parser.dump_cmake_info()
+            instrument.count("targets", len(result_info))
 
         undefined_c_info = {
             "source_files": [],
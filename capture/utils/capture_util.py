@@ -13,6 +13,12 @@ import os
 import subprocess
 import logging
 import re
+import sys
+import shlex
+import importlib.util
+
+import capture.utils.instrument as instrument
+import capture.utils.spawn as spawn
 
 logger = logging.getLogger("capture")
 
@@ -48,13 +54,27 @@ def_escape = {' ': '\\ ',
               }
 
 
-def subproces_calling(cmd="", cwd=None, stdout=subprocess.PIPE, stderr=subprocess.STDOUT):
+# Options whose value may be joined into the same token with a space.
+filename_flags = ("-o", "-I", "-isystem", "-iquote", "-include", "-imacros", "-isysroot")
+
+
+def subproces_calling(cmd="", cwd=None, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=None, pass_fds=()):
+    """
+    cmd can be a shell command string, or an argv list. Command strings are only run by shell when they use shell
+        features, see spawn.split_command.
+    :param env:                     environ of child process, None for environ of capture
+    :param pass_fds:                fds inherited by child process, e.g. jobserver pipe
+    """
+    logger.debug("Excute command: %s" % cmd)
+    if stdout in (subprocess.PIPE, subprocess.DEVNULL) and stderr == subprocess.STDOUT:
+        returncode, out, _ = spawn.run(cmd, cwd=cwd, env=env, capture=stdout == subprocess.PIPE, pass_fds=pass_fds)
+        return returncode, out, None
+
+    argv = cmd if isinstance(cmd, (list, tuple)) else spawn.split_command(cmd)
     try:
-        logger.debug("Excute command: %s" % cmd)
-        if cwd:
-            p = subprocess.Popen(cmd, shell=True, cwd=cwd, stdout=stdout, stderr=stderr)
-        else:
-            p = subprocess.Popen(cmd, shell=True, stdout=stdout, stderr=stderr)
+        p = subprocess.Popen(argv if argv is not None else cmd, shell=argv is None, cwd=cwd or None,
+                             stdout=stdout, stderr=stderr, env=env, pass_fds=pass_fds)
+        instrument.count_subprocess()
 
         out, err = p.communicate()
         return p.returncode, out, err
@@ -71,6 +91,23 @@ def replace_escape(string):
     return output_string
 
 
+def shell_token_to_args(token):
+    """
+    Turn a token prepared for shell command line into argv items, as the shell would do.
+        -DNAME="a b"            =>      ['-DNAME=a b']
+        -include /path/a.h      =>      ['-include', '/path/a.h']
+        -I/path with space/inc  =>      ['-I/path with space/inc']
+    """
+    if '"' in token or "'" in token or "\\" in token:
+        try:
+            return shlex.split(token)
+        except ValueError:
+            return [token]
+    if token[:1] == "-" and " " in token and token.split(" ", 1)[0] in filename_flags:
+        return token.split(" ", 1)
+    return [token]
+
+
 def undefined_split(line, info_dict=None):
     """
     A split util function for cutting undefined line into pieces.
@@ -177,15 +214,24 @@ def strip_quotes(s):
         return s
 
 
+def system_path_command(compiler="gcc", type="c"):
+    return "echo | %s -E -v -x %s -" % (compiler, type)
+
+
 def get_system_path(compiler="gcc", type="c"):
     """
     Acquire default compiler system headers path
     """
     # Checking system headers
-    cmd = "echo | %s -E -v -x %s -" % (compiler, type)
+    cmd = system_path_command(compiler, type)
     returncode, out, err = subproces_calling(cmd)
+    return parse_system_path(returncode, out)
+
+
+def parse_system_path(returncode, out):
+    """Get system headers path from output of system_path_command."""
     lines = []
-    out = out.decode("utf8")
+    out = out.decode("utf8") if out is not None else ""
     outlines = out.split("\n")
     outlines.reverse()
     try:
@@ -212,6 +258,27 @@ def get_system_macros(compiler="gcc", type="c"):
     pass
 
 
+def lazy_module(name):
+    """
+    Import module on first attribute access, so heavy modules (redis, psutil, ply...) only cost start up time
+    when they are used.
+    :param name:                    full module name
+    :return:                        module, ImportError is raised at once if it can't be found.
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError("No module named '%s'" % name, name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
 # Analysis Error happen
 class ParserError(Exception):
     """Error happen in analyze file"""
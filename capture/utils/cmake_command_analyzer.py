@@ -24,6 +24,7 @@ import functools
 #     parse_logger.addFileHandler("./capture.log", "capture")
 # else:
 import capture.utils.capture_util as capture_util
+import capture.pool.async_exec as async_exec
 import capture.utils.parse_autotools as parse_autotools
 
 logger = logging.getLogger("capture")
@@ -1019,9 +1020,7 @@ def check_include_files_analyzer(match_args_line, result, options, reverses):
     transfer_args1 = "".join(transfer_slices)
     includes = transfer_args1.split(";")
 
-    cstatus, system_c_path = capture_util.get_system_path()
-    cxxstatus, system_cxx_path = capture_util.get_system_path(type="c++")
-    system_path = list(set(system_c_path).union(set(system_cxx_path)))
+    system_path = get_system_include_path()
 
     def __check_exist(include):
         for dir in system_path:
@@ -1044,6 +1043,23 @@ def check_include_files_analyzer(match_args_line, result, options, reverses):
     return
 
 
+_system_include_path = None
+
+
+def get_system_include_path():
+    """System headers path of C and C++ compiler, both are probed at the same time, once in a process."""
+    global _system_include_path
+    if _system_include_path is None:
+        results = async_exec.run_jobs([capture_util.system_path_command(),
+                                       capture_util.system_path_command(type="c++")])
+        system_path = set()
+        for result in results:
+            status, lines = capture_util.parse_system_path(result.returncode, result.output)
+            system_path.update(lines)
+        _system_include_path = list(system_path)
+    return _system_include_path
+
+
 def check_include_file_analyzer(match_args_line, result, options, reverses):
     check_include_files_analyzer(match_args_line, result, options, reverses)
     pass
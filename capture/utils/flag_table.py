@@ -0,0 +1,123 @@
+# !/bin/env python
+# -*- coding: utf-8 -*_
+"""
+
+    @FileName: flag_table.py
+    @Author: zengzhishi(zengzs1995@gmail.com)
+    @CreatTime: 2018-04-08 10:31:52
+    @LastModif: 2018-04-08 10:31:52
+    @Note: Interning of flags, definitions and includes.
+    Thousands of compile entries share the same flag lists, here every distinct list is kept once as an immutable
+    tuple of interned strings, and referenced by id.
+"""
+
+import sys
+
+
+class FlagTable(object):
+    """Deduplicated flag sets, referenced by id."""
+    def __init__(self):
+        self._sets = []
+        self._ids = {}
+
+    def __len__(self):
+        return len(self._sets)
+
+    @property
+    def flag_sets(self):
+        return self._sets
+
+    def intern(self, flags):
+        """Return the id of flags, the same flags always get the same id."""
+        key = flags if isinstance(flags, tuple) else tuple(flags)
+        set_id = self._ids.get(key)
+        if set_id is None:
+            set_id = len(self._sets)
+            key = tuple(sys.intern(flag) for flag in key)
+            self._ids[key] = set_id
+            self._sets.append(key)
+        return set_id
+
+    def intern_tuple(self, flags):
+        """Return the shared tuple object equal to flags."""
+        return self._sets[self.intern(flags)]
+
+    def get(self, set_id):
+        return self._sets[set_id]
+
+
+class CompileEntry(object):
+    """Compile info of one source file, flags are ids in flag table."""
+    __slots__ = ("source_file", "directory", "compiler_type", "flags_id", "definitions_id", "includes_id")
+
+    def __init__(self, source_file, directory, compiler_type, flags_id, definitions_id, includes_id):
+        self.source_file = source_file
+        self.directory = directory
+        self.compiler_type = compiler_type
+        self.flags_id = flags_id
+        self.definitions_id = definitions_id
+        self.includes_id = includes_id
+
+    @property
+    def target_key(self):
+        """Entries with the same target key can be built as one target."""
+        return self.directory, self.compiler_type, self.flags_id, self.definitions_id, self.includes_id
+
+
+INTERNED_FIELDS = ("flags", "definitions", "includes")
+
+
+def intern_source_infos(source_infos, table):
+    """Replace flags, definitions and includes lists of source_infos by shared tuples."""
+    for info in source_infos:
+        for field in INTERNED_FIELDS:
+            if field in info and info[field] is not None:
+                info[field] = table.intern_tuple(info[field])
+        if info.get("exec_directory"):
+            info["exec_directory"] = sys.intern(info["exec_directory"])
+    return source_infos
+
+
+def group_compile_entries(entries, table):
+    """Group CompileEntry records with the same flag sets into source_infos, one info for each target key."""
+    targets = {}
+    for entry in entries:
+        key = entry.target_key
+        info = targets.get(key)
+        if info is None:
+            info = {
+                "source_files": [],
+                "definitions": table.get(entry.definitions_id),
+                "includes": table.get(entry.includes_id),
+                "flags": table.get(entry.flags_id),
+                "exec_directory": entry.directory,
+                "compiler_type": entry.compiler_type,
+                "custom_flags": [],
+                "custom_definitions": [],
+                "config_from": []
+            }
+            targets[key] = info
+        info["source_files"].append(entry.source_file)
+    return list(targets.values())
+
+
+def compact_source_infos(source_infos):
+    """
+    Serializable form of source_infos with every flag set stored once:
+        {
+            "flag_sets": [[...], ...],
+            "source_infos": [{"flags": id, "definitions": id, "includes": id, ...}, ...]
+        }
+    """
+    table = FlagTable()
+    compact_infos = []
+    for info in source_infos:
+        compact_info = dict(info)
+        for field in INTERNED_FIELDS:
+            if field in compact_info and compact_info[field] is not None:
+                compact_info[field] = table.intern(compact_info[field])
+        compact_infos.append(compact_info)
+    return table.flag_sets, compact_infos
+
+
+# vi:set tw=0 ts=4 sw=4 nowrap fdm=indent
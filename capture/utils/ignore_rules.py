@@ -0,0 +1,217 @@
+# !/bin/env python
+# -*- coding: utf-8 -*_
+"""
+
+    @FileName: ignore_rules.py
+    @Author: zengzhishi(zengzs1995@gmail.com)
+    @CreatTime: 2018-04-10 10:17:08
+    @LastModif: 2018-04-10 10:17:08
+    @Note: Ignore rules for project walk, in .gitignore syntax.
+    Rules of one ignore file are compiled into a combined regex, the last matching rule wins like git. Rules of
+    deeper ignore files are checked before rules of their parent folders.
+
+    Usage:
+        matcher = IgnoreMatcher.from_patterns(root_path, ["build/", "*.pb.cc"])
+        matcher = matcher.child(folder, file_names)        # read .gitignore/.captureignore of folder
+        matcher.ignored(os.path.join(folder, "main.c"), False)
+"""
+
+import os
+import re
+import logging
+
+logger = logging.getLogger("capture")
+
+# Later file has higher priority.
+DEFAULT_IGNORE_FILES = (".gitignore", ".captureignore")
+
+
+def translate(pattern):
+    """Translate gitignore glob (without leading/trailing slash) into regex of relative path."""
+    result = []
+    i = 0
+    n = len(pattern)
+    while i < n:
+        if pattern.startswith("**/", i) and (i == 0 or pattern[i - 1] == "/"):
+            result.append("(?:.*/)?")
+            i += 3
+            continue
+        if pattern.startswith("**", i) and i + 2 == n and (i == 0 or pattern[i - 1] == "/"):
+            result.append(".*")
+            i += 2
+            continue
+        c = pattern[i]
+        i += 1
+        if c == "*":
+            result.append("[^/]*")
+        elif c == "?":
+            result.append("[^/]")
+        elif c == "\\" and i < n:
+            result.append(re.escape(pattern[i]))
+            i += 1
+        elif c == "[":
+            j = i
+            if j < n and pattern[j] in "!^":
+                j += 1
+            if j < n and pattern[j] == "]":
+                j += 1
+            while j < n and pattern[j] != "]":
+                j += 1
+            if j >= n:
+                result.append("\\[")
+            else:
+                stuff = pattern[i:j].replace("\\", "\\\\")
+                if stuff[0] in "!^":
+                    stuff = "^" + stuff[1:]
+                result.append("[%s]" % stuff)
+                i = j + 1
+        else:
+            result.append(re.escape(c))
+    return "".join(result)
+
+
+def escape_glob(path):
+    """Escape a plain path so it can be used as pattern."""
+    return re.sub(r"([*?\[\\!#])", r"\\\1", path)
+
+
+class IgnoreRule(object):
+    __slots__ = ("pattern", "negated", "dir_only", "regex")
+
+    def __init__(self, pattern, negated, dir_only, regex):
+        self.pattern = pattern
+        self.negated = negated
+        self.dir_only = dir_only
+        self.regex = regex
+
+
+def parse_rule(line):
+    """Parse one line of ignore file, return None for blank and comment lines."""
+    line = line.rstrip("\r\n")
+    if not line.endswith("\\ "):
+        line = line.rstrip(" ")
+    if not line or line[0] == "#":
+        return None
+
+    pattern = line
+    negated = False
+    if line[0] == "!":
+        negated = True
+        line = line[1:]
+    elif line[:2] in ("\\!", "\\#"):
+        line = line[1:]
+
+    dir_only = line.endswith("/")
+    line = line.rstrip("/")
+    if not line:
+        return None
+    # Patterns with slash are relative to the folder of ignore file, others match name in any depth.
+    anchored = "/" in line
+    body = translate(line.lstrip("/"))
+    regex = body if anchored else "(?:.*/)?" + body
+    return IgnoreRule(pattern, negated, dir_only, regex)
+
+
+def _combine(rules):
+    """One regex for all rules, the last rule is the first alternative, so it wins."""
+    if not rules:
+        return None
+    alternatives = []
+    for index in range(len(rules) - 1, -1, -1):
+        alternatives.append("(?P<r%d>%s)" % (index, rules[index].regex))
+    return re.compile("(?:%s)\\Z" % "|".join(alternatives), re.DOTALL)
+
+
+class RuleSet(object):
+    """Rules of one ignore file, matched against paths relative to base folder."""
+    def __init__(self, base, rules):
+        self.base = base
+        self.prefix = base.rstrip(os.path.sep) + os.path.sep
+        self._rules = rules
+        self._dir_regex = _combine(rules)
+        self._file_regex = _combine([rule for rule in rules if not rule.dir_only])
+        # Group names in file regex are indexes of filtered list, map them back.
+        self._file_rules = [rule for rule in rules if not rule.dir_only]
+
+    def __len__(self):
+        return len(self._rules)
+
+    def match(self, relative_path, is_dir):
+        """
+        :return:        None if no rule matches, True for ignored, False for re-included by negated rule.
+        """
+        if is_dir:
+            regex, rules = self._dir_regex, self._rules
+        else:
+            regex, rules = self._file_regex, self._file_rules
+        if regex is None:
+            return None
+        m = regex.match(relative_path)
+        if m is None:
+            return None
+        return not rules[int(m.lastgroup[1:])].negated
+
+
+def read_rules(file_path):
+    rules = []
+    try:
+        with open(file_path, "r", errors="replace") as fin:
+            for line in fin:
+                rule = parse_rule(line)
+                if rule is not None:
+                    rules.append(rule)
+    except (IOError, OSError):
+        logger.warning("Reading ignore file %s fail." % file_path)
+    return rules
+
+
+class IgnoreMatcher(object):
+    """Ignore rules which apply to one folder, including rules inherited from parent folders."""
+    def __init__(self, rule_sets=(), ignore_files=DEFAULT_IGNORE_FILES):
+        """
+        :param rule_sets:               RuleSet list, innermost first
+        :param ignore_files:            ignore file names read in every folder
+        """
+        self._rule_sets = tuple(rule_sets)
+        self._ignore_files = tuple(ignore_files)
+
+    @property
+    def ignore_files(self):
+        return self._ignore_files
+
+    @classmethod
+    def from_patterns(cls, root_path, patterns, ignore_files=DEFAULT_IGNORE_FILES):
+        """Matcher with extra patterns relative to root_path, e.g. excludes from capture.cfg."""
+        rules = [rule for rule in map(parse_rule, patterns) if rule is not None]
+        rule_sets = [RuleSet(root_path, rules)] if rules else []
+        return cls(rule_sets, ignore_files)
+
+    def child(self, folder, file_names):
+        """
+        Matcher for folder, ignore files in file_names are read and their rules go first.
+        :param folder:
+        :param file_names:              names of files in folder
+        :return:
+        """
+        names = set(file_names)
+        rule_sets = []
+        for ignore_file in self._ignore_files:
+            if ignore_file in names:
+                rules = read_rules(os.path.join(folder, ignore_file))
+                if rules:
+                    rule_sets.insert(0, RuleSet(folder, rules))
+        if not rule_sets:
+            return self
+        return IgnoreMatcher(rule_sets + list(self._rule_sets), self._ignore_files)
+
+    def ignored(self, path, is_dir):
+        for rule_set in self._rule_sets:
+            if not path.startswith(rule_set.prefix):
+                continue
+            result = rule_set.match(path[len(rule_set.prefix):].replace(os.path.sep, "/"), is_dir)
+            if result is not None:
+                return result
+        return False
+
+
+# vi:set tw=0 ts=4 sw=4 nowrap fdm=indent
@@ -0,0 +1,247 @@
+# !/bin/env python
+# -*- coding: utf-8 -*_
+"""
+
+    @FileName: instrument.py
+    @Author: zengzhishi(zengzs1995@gmail.com)
+    @CreatTime: 2018-04-23 09:41:52
+    @LastModif: 2018-04-23 09:41:52
+    @Note: Per phase timing and resource usage of a capture, dumped as capture_profile.json next to capture.log.
+    Every phase records wall time, cpu time of capture and of its waited children, peak rss, subprocesses started
+    and item counts. Phases opened in another phase are nested, their names are joined by "/".
+    Phases are only saved when the thread has a running Profiler, otherwise they just measure themselves.
+
+    Usage:
+        with Profiler() as profiler:                            # profiler is current profiler of this thread
+            with phase("scan_project") as record:
+                ...
+                count("files", files_count)                     # counted into the innermost phase
+            record.wall
+        profiler.dump(os.path.join(output_path, DEFAULT_PROFILE_FILE))
+
+        @timed()
+        def command_exec(...):
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import resource
+import functools
+import threading
+import contextlib
+
+logger = logging.getLogger("capture")
+
+DEFAULT_PROFILE_FILE = "capture_profile.json"
+PROFILE_VERSION = 1
+
+# ru_maxrss is KB on linux, bytes on macOS.
+_MAXRSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+_local = threading.local()
+
+_subprocess_lock = threading.Lock()
+_subprocess_count = 0
+
+
+def count_subprocess():
+    """Called by every place starting child processes, see spawn.run."""
+    global _subprocess_count
+    with _subprocess_lock:
+        _subprocess_count += 1
+
+
+def subprocess_count():
+    """Child processes started by capture process, threads of concurrent captures are all counted."""
+    return _subprocess_count
+
+
+def current():
+    """Running profiler started by this thread, None if there is no one."""
+    return getattr(_local, "profiler", None)
+
+
+def _children_cpu():
+    times = os.times()
+    return times.children_user + times.children_system
+
+
+def peak_rss(who=resource.RUSAGE_SELF):
+    """Peak rss bytes of this process, or of its largest waited child by RUSAGE_CHILDREN."""
+    return resource.getrusage(who).ru_maxrss * _MAXRSS_UNIT
+
+
+class PhaseRecord(object):
+    def __init__(self, name, path, depth, offset=0.0):
+        """
+        :param name:
+        :param path:                    names of outer phases and this phase, joined by "/"
+        :param depth:                   count of outer phases
+        :param offset:                  start seconds from the start of profiler
+        """
+        self.name = name
+        self.path = path
+        self.depth = depth
+        self.offset = offset
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.children_cpu = 0.0
+        self.peak_rss = 0
+        self.children_peak_rss = 0
+        self.subprocesses = 0
+        self.counts = {}
+        self._start = None
+
+    def start(self):
+        self._start = (time.perf_counter(), time.process_time(), _children_cpu(), subprocess_count())
+
+    def finish(self):
+        wall, cpu, children_cpu, subprocesses = self._start
+        self.wall = time.perf_counter() - wall
+        self.cpu = time.process_time() - cpu
+        self.children_cpu = _children_cpu() - children_cpu
+        self.subprocesses = subprocess_count() - subprocesses
+        # High-water marks of capture process, and of its largest waited child.
+        self.peak_rss = peak_rss(resource.RUSAGE_SELF)
+        self.children_peak_rss = peak_rss(resource.RUSAGE_CHILDREN)
+
+    def count(self, name, n=1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def peak(self, name, value):
+        """Keep the max value of name, e.g. peak rss of worker processes."""
+        if value > self.counts.get(name, 0):
+            self.counts[name] = value
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "path": self.path,
+            "depth": self.depth,
+            "offset": round(self.offset, 6),
+            "wall": round(self.wall, 6),
+            "cpu": round(self.cpu, 6),
+            "children_cpu": round(self.children_cpu, 6),
+            "peak_rss": self.peak_rss,
+            "children_peak_rss": self.children_peak_rss,
+            "subprocesses": self.subprocesses,
+            "counts": dict((name, round(value, 6) if isinstance(value, float) else value)
+                           for name, value in self.counts.items()),
+        }
+
+
+class Profiler(object):
+    """Phases of one capture, only the thread starting it opens phases into it."""
+    def __init__(self):
+        self._records = []
+        self._stack = []
+        self._start_time = None
+        self._total = PhaseRecord("capture", "capture", -1)
+        self._previous = None
+
+    @property
+    def records(self):
+        return list(self._records)
+
+    def start(self):
+        self._previous = current()
+        _local.profiler = self
+        self._start_time = time.perf_counter()
+        self._total.start()
+        return self
+
+    def stop(self):
+        _local.profiler = self._previous
+        self._previous = None
+        self._total.finish()
+
+    def innermost(self):
+        return self._stack[-1] if self._stack else None
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        path = "/".join([record.name for record in self._stack] + [name])
+        record = PhaseRecord(name, path, len(self._stack), time.perf_counter() - self._start_time)
+        # Saved in start order, so outer phases are before their inner ones.
+        self._records.append(record)
+        self._stack.append(record)
+        record.start()
+        try:
+            yield record
+        finally:
+            record.finish()
+            self._stack.pop()
+
+    def report(self):
+        return {
+            "version": PROFILE_VERSION,
+            "pid": os.getpid(),
+            "total": self._total.to_dict(),
+            "phases": [record.to_dict() for record in self._records],
+        }
+
+    def dump(self, path):
+        tmp_path = path + ".tmp"
+        try:
+            with open(tmp_path, "w") as fout:
+                json.dump(self.report(), fout, indent=4)
+            os.replace(tmp_path, path)
+        except (IOError, OSError) as e:
+            logger.warning("Dumping profile %s fail: %s" % (path, e))
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+        return False
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Phase of current profiler, or a record not saved anywhere if there is no profiler."""
+    profiler = current()
+    if profiler is None:
+        record = PhaseRecord(name, name, 0)
+        record.start()
+        try:
+            yield record
+        finally:
+            record.finish()
+        return
+    with profiler.phase(name) as record:
+        yield record
+
+
+def timed(name=None):
+    """Decorator running the function in a phase, default name is the function name."""
+    def decorator(func):
+        phase_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with phase(phase_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, n=1):
+    """Count items into the innermost phase of current profiler."""
+    profiler = current()
+    record = profiler.innermost() if profiler is not None else None
+    if record is not None:
+        record.count(name, n)
+
+
+def peak(name, value):
+    profiler = current()
+    record = profiler.innermost() if profiler is not None else None
+    if record is not None:
+        record.peak(name, value)
+
+
+# vi:set tw=0 ts=4 sw=4 nowrap fdm=indent
@@ -0,0 +1,154 @@
+# !/bin/env python
+# -*- coding: utf-8 -*_
+"""
+
+    @FileName: json_stream.py
+    @Author: zengzhishi(zengzs1995@gmail.com)
+    @CreatTime: 2018-04-03 14:20:05
+    @LastModif: 2018-04-03 14:20:05
+    @Note: Incremental json array writer, entries are written to disk as soon as they are produced.
+"""
+
+import io
+import os
+import gzip
+import json
+import logging
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger("capture")
+
+COMPRESSIONS = ("none", "gzip", "zstd")
+COMPRESSION_SUFFIX = {
+    "none": "",
+    "gzip": ".gz",
+    "zstd": ".zst",
+}
+DEFAULT_INDENT = 4
+
+
+def check_compression(compression):
+    """Return a usable compression name, zstd falls back to gzip without zstandard module."""
+    if compression is None:
+        return "none"
+    if compression not in COMPRESSIONS:
+        raise ValueError("Unknown compression: %s" % compression)
+    if compression == "zstd" and zstandard is None:
+        logger.warning("Module zstandard is not found, use gzip compression instead.")
+        return "gzip"
+    return compression
+
+
+def output_file_path(path, compression=None):
+    return path + COMPRESSION_SUFFIX[check_compression(compression)]
+
+
+def open_text_output(path, compression=None):
+    """Open text file for writing with given compression, path should already contain compression suffix."""
+    compression = check_compression(compression)
+    if compression == "gzip":
+        return gzip.open(path, "wt", encoding="utf8")
+    if compression == "zstd":
+        fout = open(path, "wb")
+        return io.TextIOWrapper(zstandard.ZstdCompressor().stream_writer(fout), encoding="utf8")
+    return open(path, "w")
+
+
+class JsonArrayWriter(object):
+    """
+    Write a json array entry by entry.
+
+    With indent, the output is the same as json.dump(entries, fout, indent=indent).
+    Without indent (compact mode), every entry is written in one line, like:
+        [
+        {"directory": ..., "file": ..., "command": ...},
+        {"directory": ..., "file": ..., "command": ...}
+        ]
+
+    With array_key, the array is wrapped in an object, and fields are written before it:
+        {"field": ...,
+        "array_key": [
+        ...
+        ]}
+
+    With atomic, entries are written into a temporary file, which replaces path on close. Readers of path never see a
+    half written file. Without atomic, the array of a writer stopped by an exception is left unterminated, so a half
+    written file is never taken as a complete array.
+    """
+    def __init__(self, path, indent=DEFAULT_INDENT, compression=None, array_key=None, fields=None, atomic=False):
+        """
+        :param path:                    output file path, with compression suffix.
+        :param indent:                  None for compact mode.
+        :param compression:             none, gzip or zstd
+        :param array_key:               key of the array when it is wrapped in an object.
+        :param fields:                  other fields of the wrapping object.
+        :param atomic:                  write into a temporary file and rename it to path on close.
+        """
+        self._path = path
+        self._tmp_path = path + ".tmp" if atomic else None
+        self._indent = indent
+        self._fout = open_text_output(self._tmp_path or path, compression)
+        self._count = 0
+        self._array_key = array_key
+        if array_key is not None:
+            self._fout.write("{")
+            for key, value in (fields or {}).items():
+                self._fout.write("%s: %s,\n" % (json.dumps(key), json.dumps(value)))
+            self._fout.write("%s: " % json.dumps(array_key))
+        self._fout.write("[")
+
+    @property
+    def count(self):
+        return self._count
+
+    def write(self, entry):
+        if self._indent is None:
+            line = json.dumps(entry)
+        else:
+            prefix = " " * self._indent
+            line = prefix + json.dumps(entry, indent=self._indent).replace("\n", "\n" + prefix)
+        self._fout.write("\n" + line if self._count == 0 else ",\n" + line)
+        self._count += 1
+
+    def write_many(self, entries):
+        for entry in entries:
+            self.write(entry)
+
+    def close(self):
+        if self._fout is None:
+            return
+        self._fout.write("\n]" if self._count else "]")
+        if self._array_key is not None:
+            self._fout.write("}")
+        if self._indent is None:
+            self._fout.write("\n")
+        self._fout.close()
+        self._fout = None
+        if self._tmp_path:
+            os.replace(self._tmp_path, self._path)
+
+    def abort(self):
+        """Stop writing without terminating the array, with atomic the original file is kept."""
+        if self._fout is None:
+            return
+        self._fout.close()
+        self._fout = None
+        if self._tmp_path:
+            os.remove(self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+        return False
+
+
+# vi:set tw=0 ts=4 sw=4 nowrap fdm=indent
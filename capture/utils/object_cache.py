@@ -0,0 +1,239 @@
+# !/bin/env python
+# -*- coding: utf-8 -*_
+"""
+
+    @FileName: object_cache.py
+    @Author: zengzhishi(zengzs1995@gmail.com)
+    @CreatTime: 2018-04-20 10:21:36
+    @LastModif: 2018-04-20 10:21:36
+    @Note: Content addressed cache of compiled .o/.bc files, shared by captures of different output folders.
+    Key of a command is the hash of compiler identity, arguments without output file, and preprocessed source, so
+    identical translation units compiled by identical arguments hit, whatever output folder or branch they are from.
+    With -g, working directory is hashed too, because it is saved in debug info. Commands needing shell or writing
+    dependency files are not cached, see preprocess.CompileUnit.
+    Hit objects are hard linked (reflinked or copied across file systems) into the output folder. The cache is kept
+    under a size limit by removing least recently used objects.
+
+    Usage:
+        cache = ObjectCache.from_settings()
+        entry = cache.prepare(command, directory)         # None if the command can't be cached
+        if entry is not None and not cache.fetch(entry):
+            entry.remove_output()                           # never write through a link into the cache
+            ... compile ...
+            cache.store(entry)
+        cache.evict()
+"""
+
+import os
+import errno
+import fcntl
+import shutil
+import hashlib
+import logging
+import threading
+
+import capture.conf.settings as settings
+import capture.utils.preprocess as preprocess
+
+logger = logging.getLogger("capture")
+
+CACHE_VERSION = b"1"
+# ioctl cloning file data on btrfs/xfs, see linux/fs.h
+_FICLONE = 0x40049409
+# Cache is trimmed to this part of its limit, so eviction is not run for every new object.
+_EVICT_RATIO = 0.9
+
+
+def default_cache_path():
+    return os.path.join(os.path.expanduser("~"), ".cache", "capture", "objects")
+
+
+def link_file(source, target):
+    """Hard link source to target, fall back to reflink and copying. target is replaced atomically."""
+    tmp_path = "%s.tmp.%d.%d" % (target, os.getpid(), threading.get_ident())
+    try:
+        try:
+            os.link(source, tmp_path)
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+                raise
+            with open(source, "rb") as fin, open(tmp_path, "wb") as fout:
+                try:
+                    fcntl.ioctl(fout.fileno(), _FICLONE, fin.fileno())
+                except OSError:
+                    shutil.copyfileobj(fin, fout)
+        os.replace(tmp_path, target)
+    finally:
+        if os.path.lexists(tmp_path):
+            os.unlink(tmp_path)
+
+
+class CacheEntry(object):
+    def __init__(self, key, output, suffix):
+        self.key = key
+        self.output = output
+        self.suffix = suffix
+
+    def remove_output(self):
+        """Old output may be a link of cached object, compilers writing it in place would change the cache."""
+        try:
+            os.unlink(self.output)
+        except OSError:
+            pass
+
+
+class ObjectCache(object):
+    def __init__(self, path=None, max_size=5 * 1024 * 1024 * 1024):
+        """
+        :param path:                    cache folder, default is ~/.cache/capture/objects
+        :param max_size:                max bytes of cached objects
+        """
+        self._path = path or default_cache_path()
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        self._compilers = {}
+        self.hits = 0
+        self.misses = 0
+        self.uncacheable = 0
+        self.stored = 0
+        self.evicted = 0
+
+    @classmethod
+    def from_settings(cls):
+        _settings = settings.get_settings()
+        return cls(_settings.object_cache_path or None, _settings.object_cache_max_size)
+
+    @property
+    def path(self):
+        return self._path
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _compiler_identity(self, compiler):
+        """Path, size and mtime of compiler executable, so an upgraded compiler doesn't hit old objects."""
+        identity = self._compilers.get(compiler)
+        if identity is None:
+            path = shutil.which(compiler) or compiler
+            try:
+                path = os.path.realpath(path)
+                stat = os.stat(path)
+                identity = ("%s:%d:%d" % (path, stat.st_size, stat.st_mtime_ns)).encode("utf8")
+            except OSError:
+                identity = compiler.encode("utf8")
+            self._compilers[compiler] = identity
+        return identity
+
+    def _object_path(self, key, suffix):
+        return os.path.join(self._path, key[:2], key + suffix)
+
+    def prepare(self, command, directory, watcher=None, file=None):
+        """
+        Preprocess source of command and compute its key.
+        :param command:                 command string or argv list, compiling one source by -c and -o
+        :param directory:               working directory of command
+        :param watcher:                 passed to spawn.run for the preprocessor
+        :param file:                    source path of command
+        :return:                        CacheEntry, None if command can't be cached
+        """
+        unit = preprocess.CompileUnit.parse(command, directory, file)
+        data = None
+        if unit is not None:
+            returncode, data = preprocess.preprocess(unit, watcher=watcher)
+            if returncode != 0:
+                data = None
+        return self.entry(unit, data)
+
+    def entry(self, unit, data):
+        """
+        :param unit:                    preprocess.CompileUnit, None for commands can't be split
+        :param data:                    preprocessed source of unit, None if preprocessing fails
+        :return:                        CacheEntry, None if command can't be cached
+        """
+        if unit is None or data is None:
+            self._count("uncacheable")
+            return None
+        m = hashlib.sha256()
+        m.update(CACHE_VERSION)
+        m.update(self._compiler_identity(unit.compiler))
+        for arg in unit.argv:
+            m.update(b"\0" + arg.encode("utf8", "surrogateescape"))
+        if any(arg.startswith("-g") for arg in unit.argv):
+            m.update(b"\0cwd:" + os.path.abspath(unit.directory).encode("utf8", "surrogateescape"))
+        m.update(b"\0" + unit.suffix.encode("utf8"))
+        m.update(data)
+        return CacheEntry(m.hexdigest(), unit.output, unit.suffix)
+
+    def fetch(self, entry):
+        """Link cached object of entry into its output, False if it is not cached."""
+        object_path = self._object_path(entry.key, entry.suffix)
+        try:
+            link_file(object_path, entry.output)
+            # mtime is the last use time for eviction.
+            os.utime(object_path)
+        except OSError:
+            self._count("misses")
+            return False
+        self._count("hits")
+        return True
+
+    def store(self, entry):
+        """Save compiled output of entry into cache."""
+        object_path = self._object_path(entry.key, entry.suffix)
+        try:
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            link_file(entry.output, object_path)
+        except OSError as e:
+            logger.debug("Caching object %s fail: %s" % (entry.output, e))
+            return False
+        self._count("stored")
+        return True
+
+    def evict(self):
+        """Remove least recently used objects when cache is over its size limit."""
+        objects = []
+        total_size = 0
+        for root, _, files in os.walk(self._path):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                objects.append((stat.st_mtime, stat.st_size, path))
+                total_size += stat.st_size
+        if total_size <= self._max_size:
+            return 0
+
+        objects.sort()
+        target_size = self._max_size * _EVICT_RATIO
+        evicted = 0
+        for _, size, path in objects:
+            if total_size <= target_size:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total_size -= size
+            evicted += 1
+        with self._lock:
+            self.evicted += evicted
+        logger.info("Object cache: %d objects evicted, %d bytes left." % (evicted, total_size))
+        return evicted
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "uncacheable": self.uncacheable,
+                "stored": self.stored,
+                "evicted": self.evicted,
+                "hit_rate": self.hits * 100.0 / lookups if lookups else 0.0,
+            }
+
+
+# vi:set tw=0 ts=4 sw=4 nowrap fdm=indent
@@ -29,6 +29,7 @@ if __name__ == "__main__":
 else:
     import capture.utils.m4_macros_analysis as m4_macros_analysis
     import capture.utils.capture_util as capture_util
+    import capture.pool.async_exec as async_exec
 
 logger = logging.getLogger("capture")
 
@@ -329,8 +330,6 @@ class AutoToolsParser(object):
                 else:
                     cppsorted_flags = [""]
 
-                c_compiler_status = False
-                cxx_compiler_status = False
                 sorted_cppsorted_flags = sort_flags_line(cppsorted_flags)
 
                 flags_dict = target.get("flags", dict())
@@ -380,43 +379,43 @@ class AutoToolsParser(object):
                     "flags": final_c_flags_lines[0][2]
                 }
 
+                # Candidates of C and CXX are probed at the same time, the first success in candidate order is kept.
+                probe_types = []
+                probe_jobs = []
                 for flags_type in ("C", "CXX"):
                     flags_lines = final_c_flags_lines if flags_type == "C" else final_cxx_flags_lines
                     case = c_case if flags_type == "C" else cxx_case
-                    if case is None and flags_type == "C":
-                        c_compiler_status = True
-                        continue
-                    if case is None and flags_type == "CXX":
-                        cxx_compiler_status = True
+                    if case is None:
                         continue
                     compiler = c_compiler if flags_type == "C" else cxx_compiler
-                    flags_type_name = "c_flags" if flags_type == "C" else "cxx_flags"
 
+                    jobs = []
                     for (includes, macros, flags) in flags_lines:
                         include_line = " ".join(map("-I{}".format, includes))
                         macros_line = " ".join(map("-D{}".format, macros))
                         flags_line = " ".join(flags)
+                        # Probes only need the returncode, object files are not kept.
                         cmd = "{} -c {} -o {} {} {} {}".format(
-                            compiler, case, os.path.join(self._build_path, case + ".o"),
-                            include_line, macros_line, flags_line
+                            compiler, case, os.devnull, include_line, macros_line, flags_line
                         )
                         logger.debug(cmd)
-                        (returncode, out, err) = capture_util.subproces_calling(cmd, path)
-                        if returncode == 0:
-                            logger.info("Try compile for target: %s success." % target_key)
-                            if flags_type == "C":
-                                save_status = False if c_compiler_status else True
-                                c_compiler_status = True
-                            else:
-                                save_status = False if cxx_compiler_status else True
-                                cxx_compiler_status = True
-
-                            if save_status:
-                                target[flags_type_name] = {
-                                    "definitions": macros,
-                                    "includes": includes,
-                                    "flags": flags,
-                                }
+                        jobs.append(async_exec.ProcessJob(cmd, cwd=path))
+                    probe_types.append(flags_type)
+                    probe_jobs.append(jobs)
+
+                probe_results = async_exec.run_first_success(probe_jobs, capture=False)
+                for flags_type, (index, _) in zip(probe_types, probe_results):
+                    if index is None:
+                        continue
+                    logger.info("Try compile for target: %s success." % target_key)
+                    flags_lines = final_c_flags_lines if flags_type == "C" else final_cxx_flags_lines
+                    includes, macros, flags = flags_lines[index]
+                    flags_type_name = "c_flags" if flags_type == "C" else "cxx_flags"
+                    target[flags_type_name] = {
+                        "definitions": macros,
+                        "includes": includes,
+                        "flags": flags,
+                    }
 
                 if len(target.get("c_flags", dict())) == 0:
                     target["c_flags"] = default_c_flags
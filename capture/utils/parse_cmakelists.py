@@ -25,6 +25,7 @@ if __name__ == "__main__":
     parse_logger.addFileHandler("./capture.log", "capture")
 else:
     import capture.utils.capture_util as capture_util
+    import capture.pool.async_exec as async_exec
     import capture.utils.cmake_command_analyzer as cmake_command_analyzer
 
 # from capture.utils.cmake_command_analyzer import *
@@ -754,51 +755,47 @@ class CMakeParser(object):
                 all_flags.append(target_flags + global_flags)
             all_flags.sort(key=len)
 
-            c_compiler_status = False
-            cxx_compiler_status = False
+            # Candidates of C and CXX are probed at the same time, the first success in candidate order is kept.
+            candidates = []
             for definitions in all_definitions:
                 for flags in all_flags:
-                    definitions = list(filter(lambda x: len(x) != 0, definitions))
-                    flags = list(filter(lambda x: len(x) != 0, flags))
-                    for compiler_type in ("C", "CXX"):
-                        compiler = self.c_compiler if compiler_type == "C" else self.cxx_compiler
-                        case = c_case if compiler_type == "C" else cxx_case
-                        flags_type = "c_flags" if compiler_type == "C" else "cxx_flags"
-
-                        if case is None:
-                            if compiler_type == "C":
-                                c_compiler_status = True
-                            else:
-                                cxx_compiler_status = True
-                            continue
-                        # filter empty fields
-                        definition_line = " ".join(map("-D{}".format, definitions))
-                        flag_line = " ".join(flags)
-                        cmd = "{} -c {} -o {} {} {} {}".format(
-                            compiler, os.path.join(dir_name, case), os.path.join(self._build_path, c_case + ".o"),
-                            global_includes_line, definition_line, flag_line
-                        )
-                        logger.debug(cmd)
-                        (returncode, out, err) = capture_util.subproces_calling(cmd, dir_name)
-                        if returncode == 0:
-                            logger.info("Try compile for target: %s success." % target_key)
-                            if compiler_type == "C":
-                                save_status = False if c_compiler_status else True
-                                c_compiler_status = True
-                            else:
-                                save_status = False if cxx_compiler_status else True
-                                cxx_compiler_status = True
-                            if save_status:
-                                target["directory"] = dir_name
-                                target[flags_type] = {
-                                    "definitions": definitions,
-                                    "includes": global_includes,
-                                    "flags": flags,
-                                }
-                    if c_compiler_status and cxx_compiler_status:
-                        break
-                if c_compiler_status and cxx_compiler_status:
-                    break
+                    # filter empty fields
+                    candidates.append((list(filter(lambda x: len(x) != 0, definitions)),
+                                       list(filter(lambda x: len(x) != 0, flags))))
+            probe_types = []
+            probe_jobs = []
+            for compiler_type in ("C", "CXX"):
+                compiler = self.c_compiler if compiler_type == "C" else self.cxx_compiler
+                case = c_case if compiler_type == "C" else cxx_case
+                if case is None:
+                    continue
+                jobs = []
+                for definitions, flags in candidates:
+                    definition_line = " ".join(map("-D{}".format, definitions))
+                    flag_line = " ".join(flags)
+                    # Probes only need the returncode, object files are not kept.
+                    cmd = "{} -c {} -o {} {} {} {}".format(
+                        compiler, os.path.join(dir_name, case), os.devnull,
+                        global_includes_line, definition_line, flag_line
+                    )
+                    logger.debug(cmd)
+                    jobs.append(async_exec.ProcessJob(cmd, cwd=dir_name))
+                probe_types.append(compiler_type)
+                probe_jobs.append(jobs)
+
+            probe_results = async_exec.run_first_success(probe_jobs, capture=False)
+            for compiler_type, (index, _) in zip(probe_types, probe_results):
+                if index is None:
+                    continue
+                logger.info("Try compile for target: %s success." % target_key)
+                definitions, flags = candidates[index]
+                flags_type = "c_flags" if compiler_type == "C" else "cxx_flags"
+                target["directory"] = dir_name
+                target[flags_type] = {
+                    "definitions": definitions,
+                    "includes": global_includes,
+                    "flags": flags,
+                }
             if len(target.get("c_flags", dict())) == 0:
                 target["c_flags"] = {
                     "definitions": all_definitions[0],
@@ -12,6 +12,8 @@
 import os
 import re
 import capture.utils.capture_util as capture_util
+import capture.pool.executor as executor
+import capture.pool.jobserver as jobserver
 
 import logging
 logger = logging.getLogger("capture")
@@ -195,7 +197,9 @@ def create_command_infos(build_path, output, makefile_name=None,
     else:
         cmd = "make -nkw -f {} {}".format(make_file, make_args)
 
-    (returncode, out, err) = capture_util.subproces_calling(cmd, cwd=build_path)
+    # Recursive makes of big projects run in parallel, sharing outer jobserver or the one capture serves.
+    with jobserver.child_make_environ(executor.get_slots().limit(executor.SLOT_SUBPROCESS)) as (env, pass_fds):
+        (returncode, out, err) = capture_util.subproces_calling(cmd, cwd=build_path, env=env, pass_fds=pass_fds)
     output.write(out.decode("utf8"))
     return output
 
@@ -0,0 +1,190 @@
+# !/bin/env python
+# -*- coding: utf-8 -*_
+"""
+
+    @FileName: preprocess.py
+    @Author: zengzhishi(zengzs1995@gmail.com)
+    @CreatTime: 2018-04-21 09:52:14
+    @LastModif: 2018-04-21 09:52:14
+    @Note: Split compile commands into preprocessing and compiling of the preprocessed source.
+    Preprocessed source doesn't need headers, include paths or macros any more, so it can be hashed (object cache),
+    compiled on other hosts (remote workers), or compiled into both .o and .bc files by one preprocessing.
+
+    Usage:
+        unit = CompileUnit.parse(command, directory, file)      # None for commands not compiling one source
+        returncode, data = preprocess(unit)
+        argv = unit.compile_argv("/tmp/x/source" + unit.preprocessed_suffix, "/tmp/x/out.o")
+        if unit.shares_preprocessing(bitcode_unit):
+            returncode, out, truncated = compile_preprocessed(bitcode_unit, data)
+"""
+
+import os
+import shutil
+import logging
+import tempfile
+
+import capture.utils.spawn as spawn
+
+logger = logging.getLogger("capture")
+
+# Only used by preprocessor, dropped when compiling preprocessed source. Options taking the next argument as value
+# ("-I dir") and options with joined value ("-Idir") are both handled.
+_PREPROCESS_VALUE_OPTIONS = ("-D", "-U", "-I", "-include", "-imacros", "-isystem", "-iquote", "-idirafter",
+                             "-iprefix", "-iwithprefix", "-isysroot", "-x")
+_PREPROCESS_PREFIXES = ("-D", "-U", "-I", "-include", "-imacros", "-isystem", "-iquote", "-idirafter")
+_PREPROCESS_SINGLE_OPTIONS = ("-nostdinc", "-nostdinc++", "-P", "-C", "-undef")
+# Dependency files (-MD, -MF...) are written by preprocessor, commands with them are not split.
+_DEPENDENCY_FLAG_PREFIX = "-M"
+# Code generation options never change preprocessed source, commands only differing in them share preprocessing.
+_CODEGEN_ONLY_OPTIONS = ("-flto", "-flto=thin", "-flto=full", "-emit-llvm")
+
+PREPROCESSED_C_SUFFIX = ".i"
+PREPROCESSED_CXX_SUFFIX = ".ii"
+_CXX_SUFFIXES = (".cc", ".cp", ".cxx", ".cpp", ".c++", ".C", ".CPP", ".ii")
+
+
+class CompileUnit(object):
+    """One compile command, building one source by -c into one output."""
+    def __init__(self, argv, directory, source_index, output):
+        self.argv = argv
+        self.directory = directory or os.path.curdir
+        self.source_index = source_index
+        self.output = output
+
+    @classmethod
+    def parse(cls, command, directory=None, file=None):
+        """
+        :param command:                 command string or argv list
+        :param directory:               working directory of command
+        :param file:                    source path of the command, default is the last argument not being an option
+        :return:                        CompileUnit, None if command needs shell, writes dependency files, or doesn't
+                                            compile one source by -c and -o
+        """
+        argv = list(command) if isinstance(command, (list, tuple)) else spawn.split_command(command)
+        if not argv or "-c" not in argv:
+            return None
+
+        # Output option is removed, callers add their own one.
+        output = None
+        rest = argv[:1]
+        args = iter(argv[1:])
+        for arg in args:
+            if arg == "-o":
+                output = next(args, None)
+            elif arg.startswith("-o"):
+                output = arg[2:]
+            elif arg.startswith(_DEPENDENCY_FLAG_PREFIX):
+                return None
+            else:
+                rest.append(arg)
+        if not output:
+            return None
+
+        source_index = cls._find_source(rest, directory, file)
+        if source_index is None:
+            return None
+        if not os.path.isabs(output):
+            output = os.path.join(directory or os.path.curdir, output)
+        return cls(rest, directory, source_index, output)
+
+    @staticmethod
+    def _find_source(argv, directory, file):
+        found = None
+        if file is not None:
+            file = os.path.normpath(os.path.join(directory or "", file))
+        i = 1
+        while i < len(argv):
+            arg = argv[i]
+            if arg in _PREPROCESS_VALUE_OPTIONS:
+                i += 2
+                continue
+            if not arg.startswith("-"):
+                if file is None or os.path.normpath(os.path.join(directory or "", arg)) == file:
+                    found = i
+            i += 1
+        return found
+
+    @property
+    def compiler(self):
+        return self.argv[0]
+
+    @property
+    def source(self):
+        return self.argv[self.source_index]
+
+    @property
+    def suffix(self):
+        return os.path.splitext(self.output)[1]
+
+    @property
+    def preprocessed_suffix(self):
+        # g++ compiles .c files as C++ too.
+        if "++" in os.path.basename(self.compiler) or os.path.splitext(self.source)[1] in _CXX_SUFFIXES:
+            return PREPROCESSED_CXX_SUFFIX
+        return PREPROCESSED_C_SUFFIX
+
+    def preprocess_argv(self):
+        return [arg for arg in self.argv if arg != "-c"] + ["-E"]
+
+    def shares_preprocessing(self, other):
+        """
+        Whether preprocessed source of this unit can be compiled by other, e.g. the .o and -flto .bc commands of a
+        source by clang. Different compilers predefine different macros (__clang__, __GNUC_MINOR__...), their
+        preprocessed sources are never shared.
+        """
+        if other is None or self.compiler != other.compiler or self.directory != other.directory:
+            return False
+        return self._preprocess_options() == other._preprocess_options()
+
+    def _preprocess_options(self):
+        return [arg for arg in self.preprocess_argv() if arg not in _CODEGEN_ONLY_OPTIONS]
+
+    def compile_argv(self, source, output, compiler=None):
+        """
+        Arguments compiling preprocessed source, options only used by preprocessor are dropped.
+        :param source:                  preprocessed source path, its suffix should be preprocessed_suffix
+        :param output:
+        :param compiler:                default is the compiler of this command
+        """
+        argv = [compiler or self.compiler]
+        i = 1
+        while i < len(self.argv):
+            arg = self.argv[i]
+            if i == self.source_index:
+                argv.append(source)
+            elif arg in _PREPROCESS_VALUE_OPTIONS:
+                i += 1
+            elif not (arg.startswith(_PREPROCESS_PREFIXES) or arg in _PREPROCESS_SINGLE_OPTIONS):
+                argv.append(arg)
+            i += 1
+        argv.extend(["-o", output])
+        return argv
+
+
+def preprocess(unit, watcher=None):
+    """
+    Run preprocessor of unit, warnings are not mixed into the preprocessed source.
+    :return:                        (returncode, preprocessed source bytes)
+    """
+    returncode, data, _ = spawn.run(unit.preprocess_argv(), cwd=unit.directory, watcher=watcher, discard_stderr=True)
+    return returncode, data
+
+
+def compile_preprocessed(unit, data, watcher=None, capture=True, max_output=spawn.DEFAULT_MAX_OUTPUT):
+    """
+    Compile preprocessed source data into output of unit, in working directory of unit. File names in debug info
+    come from line markers of data, not from the temporary source.
+    :return:                        (returncode, output, truncated) of spawn.run
+    """
+    job_path = tempfile.mkdtemp(prefix="capture-pp-")
+    try:
+        source = os.path.join(job_path, "source" + unit.preprocessed_suffix)
+        with open(source, "wb") as fout:
+            fout.write(data)
+        return spawn.run(unit.compile_argv(source, unit.output), cwd=unit.directory, capture=capture,
+                         max_output=max_output, watcher=watcher)
+    finally:
+        shutil.rmtree(job_path, ignore_errors=True)
+
+
+# vi:set tw=0 ts=4 sw=4 nowrap fdm=indent
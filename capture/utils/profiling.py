@@ -0,0 +1,282 @@
+# !/bin/env python
+# -*- coding: utf-8 -*_
+"""
+
+    @FileName: profiling.py
+    @Author: zengzhishi(zengzs1995@gmail.com)
+    @CreatTime: 2018-04-24 10:08:19
+    @LastModif: 2018-04-24 10:08:19
+    @Note: Profiling of a capture run by --profile, results are saved in the output folder:
+        cprofile:   cProfile of the capture thread, threads it starts and ProcessBuilder workers, merged into
+                    capture_cprofile.pstats, with a text summary in capture_cprofile.txt
+        sample:     SIGPROF stack sampler of capture process and ProcessBuilder workers, folded stacks for
+                    flamegraph.pl are saved in capture_stacks.folded
+    Nothing is installed without --profile, ProcessBuilder only checks ProcessBuilder.profile_options once per chunk.
+    Signal handlers can only be set in main thread, stacks are not sampled for captures run by capture server. New
+    threads are profiled by threading.setprofile, which is process wide, so threads of other captures of capture server
+    started at the same time are profiled too.
+
+    Usage:
+        with Session(MODE_ALL, output_path) as session:       # session is current session of this thread
+            ...
+            builder.profile_options = session.worker_options()
+"""
+
+import os
+import sys
+import uuid
+import pstats
+import shutil
+import signal
+import cProfile
+import logging
+import threading
+import collections
+
+logger = logging.getLogger("capture")
+
+MODE_NONE = "none"
+MODE_CPROFILE = "cprofile"
+MODE_SAMPLE = "sample"
+MODE_ALL = "all"
+PROFILE_MODES = (MODE_NONE, MODE_CPROFILE, MODE_SAMPLE, MODE_ALL)
+
+CPROFILE_FILE = "capture_cprofile.pstats"
+CPROFILE_SUMMARY_FILE = "capture_cprofile.txt"
+STACKS_FILE = "capture_stacks.folded"
+# Worker results are saved here, and merged when the session stops.
+WORKER_FOLDER = "capture_profile_workers"
+
+# Cpu seconds between two samples.
+DEFAULT_SAMPLE_INTERVAL = 0.005
+_SUMMARY_LINES = 60
+
+# Options of ProcessBuilder workers, see worker_options.
+WorkerOptions = collections.namedtuple("WorkerOptions", ["cprofile", "sample", "path", "interval"])
+
+_local = threading.local()
+
+
+def current():
+    """Running session started by this thread, None if there is no one."""
+    return getattr(_local, "session", None)
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return "%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+
+def fold_stack(frame, prefix=None):
+    """Frames from outermost to frame joined by ";", the folded stack format of flamegraph.pl."""
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    if prefix:
+        names.append(prefix)
+    return ";".join(reversed(names))
+
+
+class StackSampler(object):
+    """Sample stacks of all threads every interval cpu seconds of the process, by SIGPROF."""
+    def __init__(self, interval=DEFAULT_SAMPLE_INTERVAL, root=None):
+        """
+        :param interval:                cpu seconds between two samples
+        :param root:                    name put before thread names of stacks, e.g. "worker" for worker processes
+        """
+        self._interval = interval
+        self._root = root
+        self._stacks = collections.Counter()
+        self._previous_handler = None
+        self._running = False
+
+    @property
+    def stacks(self):
+        return self._stacks
+
+    def _sample(self, signum, frame):
+        names = dict((thread.ident, thread.name) for thread in threading.enumerate())
+        main_ident = threading.main_thread().ident
+        for ident, thread_frame in sys._current_frames().items():
+            # Handler runs in main thread, its interrupted frame is passed in.
+            if ident == main_ident:
+                thread_frame = frame
+            thread_name = names.get(ident, str(ident))
+            if self._root:
+                thread_name = "%s;%s" % (self._root, thread_name)
+            self._stacks[fold_stack(thread_frame, thread_name)] += 1
+
+    def start(self):
+        if threading.current_thread() is not threading.main_thread():
+            logger.warning("Stacks can only be sampled in main thread, sampling is skipped.")
+            return False
+        self._previous_handler = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self._interval, self._interval)
+        self._running = True
+        return True
+
+    def stop(self):
+        if not self._running:
+            return
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self._previous_handler or signal.SIG_DFL)
+        self._running = False
+
+    def dump(self, path):
+        with open(path, "w") as fout:
+            for stack, count in self._stacks.most_common():
+                fout.write("%s %d\n" % (stack, count))
+
+
+def load_stacks(path, stacks=None):
+    """Add folded stacks of file into stacks Counter."""
+    stacks = stacks if stacks is not None else collections.Counter()
+    with open(path, "r") as fin:
+        for line in fin:
+            stack, _, count = line.rstrip("\n").rpartition(" ")
+            if stack:
+                stacks[stack] += int(count)
+    return stacks
+
+
+def profile_call(options, func, *args):
+    """Run func in a ProcessBuilder worker with profiling of options, results are saved in options.path."""
+    profile = cProfile.Profile() if options.cprofile else None
+    sampler = StackSampler(options.interval, root="worker") if options.sample else None
+    name = "worker-%d-%s" % (os.getpid(), uuid.uuid4().hex[:8])
+    if sampler is not None:
+        sampler.start()
+    try:
+        if profile is not None:
+            return profile.runcall(func, *args)
+        return func(*args)
+    finally:
+        if sampler is not None:
+            sampler.stop()
+            sampler.dump(os.path.join(options.path, name + ".folded"))
+        if profile is not None:
+            profile.dump_stats(os.path.join(options.path, name + ".pstats"))
+
+
+class Session(object):
+    """Profiling of one capture."""
+    def __init__(self, mode, output_path, interval=DEFAULT_SAMPLE_INTERVAL):
+        """
+        :param mode:                    one of PROFILE_MODES
+        :param output_path:             folder results are saved in
+        :param interval:                cpu seconds between two stack samples
+        """
+        if mode not in PROFILE_MODES:
+            raise ValueError("Unknown profile mode: %s" % mode)
+        self._cprofile = mode in (MODE_CPROFILE, MODE_ALL)
+        self._sample = mode in (MODE_SAMPLE, MODE_ALL)
+        self._output_path = output_path
+        self._interval = interval
+        self._worker_path = os.path.join(output_path, WORKER_FOLDER)
+
+        self._profile = None
+        self._thread_profiles = []
+        self._lock = threading.Lock()
+        self._sampler = None
+        self._previous = None
+
+    @property
+    def enabled(self):
+        return self._cprofile or self._sample
+
+    def worker_options(self):
+        """Options of ProcessBuilder workers, None if workers are not profiled."""
+        if not self.enabled:
+            return None
+        return WorkerOptions(self._cprofile, self._sample, self._worker_path, self._interval)
+
+    def _profile_thread(self, frame, event, arg):
+        # Called once by every new thread, it is replaced by cProfile of the thread.
+        sys.setprofile(None)
+        profile = cProfile.Profile()
+        with self._lock:
+            if self._profile is None:
+                return
+            self._thread_profiles.append(profile)
+        profile.enable()
+
+    def start(self):
+        self._previous = current()
+        _local.session = self
+        if not self.enabled:
+            return self
+        shutil.rmtree(self._worker_path, ignore_errors=True)
+        os.makedirs(self._worker_path)
+        if self._cprofile:
+            self._profile = cProfile.Profile()
+            threading.setprofile(self._profile_thread)
+            self._profile.enable()
+        if self._sample:
+            self._sampler = StackSampler(self._interval)
+            if not self._sampler.start():
+                self._sampler = None
+        return self
+
+    def stop(self):
+        _local.session = self._previous
+        self._previous = None
+        if not self.enabled:
+            return
+        if self._profile is not None:
+            self._profile.disable()
+            threading.setprofile(None)
+        if self._sampler is not None:
+            self._sampler.stop()
+        try:
+            self._save()
+        except (IOError, OSError) as e:
+            logger.warning("Saving profile results fail: %s" % e)
+        finally:
+            shutil.rmtree(self._worker_path, ignore_errors=True)
+
+    def _worker_files(self, suffix):
+        try:
+            names = sorted(os.listdir(self._worker_path))
+        except OSError:
+            return []
+        return [os.path.join(self._worker_path, name) for name in names if name.endswith(suffix)]
+
+    def _save(self):
+        if self._profile is not None:
+            with self._lock:
+                profiles = [self._profile] + self._thread_profiles
+                self._profile = None
+            stats = pstats.Stats(profiles[0])
+            for profile in profiles[1:]:
+                stats.add(profile)
+            worker_files = self._worker_files(".pstats")
+            for path in worker_files:
+                stats.add(path)
+            stats.dump_stats(os.path.join(self._output_path, CPROFILE_FILE))
+            with open(os.path.join(self._output_path, CPROFILE_SUMMARY_FILE), "w") as fout:
+                stats.stream = fout
+                stats.sort_stats("cumulative").print_stats(_SUMMARY_LINES)
+            logger.info("cProfile of %d threads and %d worker chunks: %s"
+                        % (len(profiles), len(worker_files), CPROFILE_FILE))
+
+        if self._sample:
+            stacks = self._sampler.stacks if self._sampler is not None else collections.Counter()
+            worker_files = self._worker_files(".folded")
+            for path in worker_files:
+                load_stacks(path, stacks)
+            with open(os.path.join(self._output_path, STACKS_FILE), "w") as fout:
+                for stack, count in stacks.most_common():
+                    fout.write("%s %d\n" % (stack, count))
+            logger.info("Stack samples: %d, with %d worker chunks: %s"
+                        % (sum(stacks.values()), len(worker_files), STACKS_FILE))
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+        return False
+
+
+# vi:set tw=0 ts=4 sw=4 nowrap fdm=indent
@@ -0,0 +1,347 @@
+# !/bin/env python
+# -*- coding: utf-8 -*_
+"""
+
+    @FileName: project_walk.py
+    @Author: zengzhishi(zengzs1995@gmail.com)
+    @CreatTime: 2018-04-09 09:42:17
+    @LastModif: 2018-04-09 09:42:17
+    @Note: Project folders walker shared by all analyzers.
+    Folders are listed by os.scandir, file types come from cached d_type, so no extra stat is needed for each
+    entry. Folders of the same level are listed by a thread pool, and the result keeps the breadth first order.
+
+    With index_path, folder listings are kept in a tree index file. Next walk only lists folders whose mtime changed,
+    and reuses the listings of the others.
+
+    Usage:
+        walk = ProjectWalk(root_path, ["src", "include"], build_suffix_kinds(["c", "cpp"], ["h"]))
+        for record in walk.records:
+            print(record.path, record.kind)
+"""
+
+import os
+import json
+import logging
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+import capture.utils.instrument as instrument
+
+logger = logging.getLogger("capture")
+
+DEFAULT_WALK_THREADS = 8
+DEFAULT_TREE_INDEX_FILE = "capture_tree_index.json"
+TREE_INDEX_VERSION = 1
+
+# Tree indexes kept in memory by long running process (capture server, watch mode): index_path -> (file mtime, index)
+_loaded_indexes = {}
+
+# record kinds
+SOURCE = "source"
+HEADER = "header"
+MAKEFILE_AM = "makefile_am"
+CMAKELISTS = "cmakelists"
+
+CMAKELISTS_NAME = "CMakeLists.txt"
+
+
+class WalkRecord(collections.namedtuple("WalkRecord", ["folder", "name", "kind", "size", "mtime"])):
+    __slots__ = ()
+
+    @property
+    def path(self):
+        # Same as os.path.join, but much cheaper for millions of records.
+        if self.folder.endswith(os.path.sep):
+            return self.folder + self.name
+        return self.folder + os.path.sep + self.name
+
+
+def build_suffix_kinds(source_suffixes, include_suffixes):
+    """Suffix -> record kind lookup, source suffixes win over include suffixes."""
+    suffix_kinds = {"am": MAKEFILE_AM}
+    suffix_kinds.update((suffix, HEADER) for suffix in include_suffixes)
+    suffix_kinds.update((suffix, SOURCE) for suffix in source_suffixes)
+    return suffix_kinds
+
+
+def classify(file_name, suffix_kinds):
+    """Return record kind of file, None for files capture doesn't care."""
+    if file_name == CMAKELISTS_NAME:
+        return CMAKELISTS
+    dot = file_name.rfind(".")
+    if dot < 0:
+        return None
+    return suffix_kinds.get(file_name[dot + 1:])
+
+
+class FolderListing(object):
+    """Typed files and sub folders of one folder, before ignore rules are applied."""
+    __slots__ = ("mtime", "sub_folder_names", "files", "ignore_file_names")
+
+    def __init__(self, mtime, sub_folder_names, files, ignore_file_names):
+        """
+        :param mtime:                   folder mtime in ns when it was listed
+        :param sub_folder_names:
+        :param files:                   [(name, size, mtime, kind), ...]
+        :param ignore_file_names:       names of ignore files in folder
+        """
+        self.mtime = mtime
+        self.sub_folder_names = sub_folder_names
+        self.files = files
+        self.ignore_file_names = ignore_file_names
+
+    def dump(self):
+        return [self.mtime, self.sub_folder_names, self.files, self.ignore_file_names]
+
+    @classmethod
+    def load(cls, data):
+        return cls(data[0], data[1], [tuple(file_info) for file_info in data[2]], data[3])
+
+
+def list_folder(folder, suffix_kinds, ignore_files=(), cached=None):
+    """
+    List one folder, cached listing is reused when the folder is not modified.
+    :param folder:
+    :param suffix_kinds:                suffix -> kind lookup
+    :param ignore_files:                names of ignore files
+    :param cached:                      FolderListing of last walk
+    :return:
+        listing:                        FolderListing
+        relisted:                       False if cached listing is reused
+    """
+    # Take mtime before listing, so changes during listing will be found next time.
+    mtime = os.stat(folder).st_mtime_ns
+    if cached is not None and cached.mtime == mtime:
+        return cached, False
+
+    sub_folder_names = []
+    files = []
+    ignore_file_names = []
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                sub_folder_names.append(entry.name)
+                continue
+            if entry.name in ignore_files:
+                ignore_file_names.append(entry.name)
+            kind = classify(entry.name, suffix_kinds)
+            if kind is not None:
+                try:
+                    stat = entry.stat()
+                    files.append((entry.name, stat.st_size, stat.st_mtime_ns, kind))
+                except OSError:
+                    # Dangling symbolic link.
+                    files.append((entry.name, 0, 0, kind))
+    return FolderListing(mtime, sub_folder_names, files, ignore_file_names), True
+
+
+def scan_folder(folder, suffix_kinds, ignore=None, cached=None):
+    """
+    List one folder and apply ignore rules.
+    :param folder:
+    :param suffix_kinds:                suffix -> kind lookup
+    :param ignore:                      ignore_rules.IgnoreMatcher of parent folder, None for no ignore rules
+    :param cached:                      FolderListing of last walk
+    :return:
+        sub_folder_names:
+        records:                        WalkRecord of typed files in folder
+        ignore:                         IgnoreMatcher for sub folders
+        listing:                        FolderListing
+        relisted:                       False if cached listing is reused
+    """
+    listing, relisted = list_folder(folder, suffix_kinds, ignore.ignore_files if ignore is not None else (), cached)
+    sub_folder_names = listing.sub_folder_names
+    if ignore is not None:
+        ignore = ignore.child(folder, listing.ignore_file_names)
+        sub_folder_names = [name for name in sub_folder_names
+                            if not ignore.ignored(os.path.join(folder, name), True)]
+    records = []
+    for name, size, mtime, kind in listing.files:
+        if ignore is None or not ignore.ignored(os.path.join(folder, name), False):
+            records.append(WalkRecord(folder, name, kind, size, mtime))
+    return sub_folder_names, records, ignore, listing, relisted
+
+
+class TreeIndex(object):
+    """
+    Folder listings of last walk, saved as:
+        {"version": 1, "root": root_path, "suffix_kinds": {...}, "ignore_files": [...],
+         "folders": {relative_folder: [mtime, sub_folder_names, files, ignore_file_names], ...}}
+    """
+    def __init__(self, root_path, suffix_kinds, ignore_files=(), folders=None):
+        self._root_path = root_path
+        self._suffix_kinds = suffix_kinds
+        self._ignore_files = list(ignore_files)
+        self._folders = folders if folders is not None else {}
+
+    def __len__(self):
+        return len(self._folders)
+
+    def _key(self, folder):
+        return folder[len(self._root_path) + 1:] if folder != self._root_path else ""
+
+    def get(self, folder):
+        data = self._folders.get(self._key(folder))
+        if data is None:
+            return None
+        if not isinstance(data, FolderListing):
+            data = FolderListing.load(data)
+        return data
+
+    def set(self, folder, listing):
+        self._folders[self._key(folder)] = listing
+
+    def _same_settings(self, root_path, suffix_kinds, ignore_files):
+        return self._root_path == root_path and self._suffix_kinds == suffix_kinds \
+            and self._ignore_files == list(ignore_files)
+
+    @classmethod
+    def load(cls, index_path, root_path, suffix_kinds, ignore_files=()):
+        """Load index, an empty index is returned if the file is missing or built with other settings."""
+        index = cls(root_path, suffix_kinds, ignore_files)
+        if not index_path or not os.path.exists(index_path):
+            return index
+        # Index saved by this process and not changed by others.
+        loaded = _loaded_indexes.get(index_path)
+        if loaded is not None and loaded[0] == os.stat(index_path).st_mtime_ns \
+                and loaded[1]._same_settings(root_path, suffix_kinds, ignore_files):
+            return loaded[1]
+        try:
+            with open(index_path, "r") as fin:
+                data = json.load(fin)
+        except (IOError, OSError, ValueError):
+            logger.warning("Loading tree index %s fail, walk whole project." % index_path)
+            return index
+        if data.get("version") != TREE_INDEX_VERSION or data.get("root") != root_path \
+                or data.get("suffix_kinds") != suffix_kinds or data.get("ignore_files") != list(ignore_files):
+            logger.info("Tree index %s is out of date, walk whole project." % index_path)
+            return index
+        index._folders = data.get("folders", {})
+        _loaded_indexes[index_path] = (os.stat(index_path).st_mtime_ns, index)
+        return index
+
+    def save(self, index_path):
+        data = {
+            "version": TREE_INDEX_VERSION,
+            "root": self._root_path,
+            "suffix_kinds": self._suffix_kinds,
+            "ignore_files": self._ignore_files,
+            "folders": dict((key, listing.dump() if isinstance(listing, FolderListing) else listing)
+                            for key, listing in self._folders.items()),
+        }
+        tmp_path = index_path + ".tmp"
+        try:
+            with open(tmp_path, "w") as fout:
+                # json.dumps uses the C encoder, much faster than json.dump for big index.
+                fout.write(json.dumps(data, separators=(",", ":")))
+            os.replace(tmp_path, index_path)
+            _loaded_indexes[index_path] = (os.stat(index_path).st_mtime_ns, self)
+        except (IOError, OSError):
+            logger.warning("Dumping tree index %s fail." % index_path)
+
+
+class ProjectWalk(object):
+    """
+    Result of walking project once.
+
+    In top level folder, only folders in prefers are entered; in deeper levels, all folders but hidden ones are entered.
+    The walk is done on first access.
+    """
+    def __init__(self, root_path, prefers, suffix_kinds, threads=DEFAULT_WALK_THREADS, ignore=None,
+                 index_path=None):
+        """
+        :param root_path:               project path
+        :param prefers:                 top level folders will be scan.
+        :param suffix_kinds:            suffix -> kind lookup, see build_suffix_kinds
+        :param threads:                 threads count for listing folders
+        :param ignore:                  ignore_rules.IgnoreMatcher of root_path, ignored files and folders are skipped
+        :param index_path:              tree index file path, None for walking without tree index
+        """
+        self._root_path = root_path
+        self._prefers = tuple(prefers)
+        self._suffix_kinds = suffix_kinds
+        self._threads = max(1, threads)
+        self._ignore = ignore
+        self._index_path = index_path
+        self._folder_records = None
+
+    @property
+    def root_path(self):
+        return self._root_path
+
+    @property
+    def prefers(self):
+        return self._prefers
+
+    def _walk(self):
+        prefer_paths = set(os.path.join(self._root_path, name) for name in self._prefers)
+        ignore_files = self._ignore.ignore_files if self._ignore is not None else ()
+        old_index = TreeIndex.load(self._index_path, self._root_path, self._suffix_kinds, ignore_files)
+        new_index = TreeIndex(self._root_path, self._suffix_kinds, ignore_files)
+        relisted_count = 0
+
+        def _scan(item):
+            return scan_folder(item[0], self._suffix_kinds, item[1], old_index.get(item[0]))
+
+        folder_records = []
+        # [(folder, ignore matcher of parent folder), ...]
+        level = [(self._root_path, self._ignore)]
+        top_level = True
+        thread_name_prefix = threading.current_thread().name + "-walk"
+        with ThreadPoolExecutor(max_workers=self._threads, thread_name_prefix=thread_name_prefix) as executor:
+            while level:
+                next_level = []
+                for (folder, _), (sub_folder_names, records, ignore, listing, relisted) in \
+                        zip(level, executor.map(_scan, level)):
+                    if relisted:
+                        logger.info("\tscan path: %s" % folder)
+                        relisted_count += 1
+                    folder_records.append((folder, records))
+                    new_index.set(folder, listing)
+                    for name in sub_folder_names:
+                        folder_path = os.path.join(folder, name)
+                        if top_level:
+                            if folder_path in prefer_paths:
+                                next_level.append((folder_path, ignore))
+                        elif name[0] != '.':                # Exclude hidden folders
+                            next_level.append((folder_path, ignore))
+                level = next_level
+                top_level = False
+
+        if self._index_path:
+            logger.info("Tree index: %d folders, %d listed again." % (len(folder_records), relisted_count))
+            if relisted_count or len(new_index) != len(old_index):
+                new_index.save(self._index_path)
+        return folder_records
+
+    @property
+    def folder_records(self):
+        """[(folder, [WalkRecord, ...]), ...] in breadth first order."""
+        if self._folder_records is None:
+            with instrument.phase("walk"):
+                self._folder_records = self._walk()
+                instrument.count("folders", len(self._folder_records))
+                instrument.count("files", sum(len(records) for _, records in self._folder_records))
+        return self._folder_records
+
+    @property
+    def folders(self):
+        return [folder for folder, _ in self.folder_records]
+
+    @property
+    def records(self):
+        for _, records in self.folder_records:
+            for record in records:
+                yield record
+
+    def files(self, kind):
+        """Paths of all files of the kind."""
+        return [record.path for record in self.records if record.kind == kind]
+
+
+# vi:set tw=0 ts=4 sw=4 nowrap fdm=indent
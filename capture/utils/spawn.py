@@ -0,0 +1,185 @@
+# !/bin/env python
+# -*- coding: utf-8 -*_
+"""
+
+    @FileName: spawn.py
+    @Author: zengzhishi(zengzs1995@gmail.com)
+    @CreatTime: 2018-04-17 09:48:06
+    @LastModif: 2018-04-17 09:48:06
+    @Note: Run child processes without /bin/sh.
+    Command strings are split into argv when they use no shell features, and run directly: by posix_spawn when the
+    working directory is not changed, otherwise by subprocess (vfork based on Linux). Only commands with pipes,
+    redirections, backticks, variables, globs or shell builtins still run by shell.
+    Output is read with a size cap, or sent to /dev/null when the caller doesn't need it.
+    With a watcher (see watchdog.WatchHandle), the child runs in its own process group, which is watched until it exits.
+
+    Usage:
+        returncode, output, truncated = run("gcc -c a.c -o a.o", cwd="/project", capture=False)
+"""
+
+import os
+import re
+import shlex
+import logging
+import subprocess
+
+import capture.utils.instrument as instrument
+
+logger = logging.getLogger("capture")
+
+# Output kept for logging of one compile command.
+DEFAULT_MAX_OUTPUT = 1024 * 1024
+
+_READ_SIZE = 64 * 1024
+SHELL_PATH = "/bin/sh"
+
+# Characters having meaning to shell besides quoting: pipes, redirections, command substitution, variables, globs,
+# command lists, subshells, comments.
+_SHELL_CHARS_REGEX = re.compile(r"[`$|&;<>()*?\[\]{}~#!\n]")
+_ASSIGNMENT_REGEX = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*=")
+SHELL_BUILTINS = frozenset(["cd", "export", "source", ".", "eval", "exec", "set", "unset", "alias", "ulimit",
+                            "umask", "if", "for", "while", "case", "test", "[", "{", "!", "true", "false"])
+
+
+def split_command(command):
+    """
+    Split command string into argv, None if it needs shell.
+        gcc -DNAME="a b" -c a.c         =>      ['gcc', '-DNAME=a b', '-c', 'a.c']
+        echo | gcc -E -                 =>      None
+    """
+    if _SHELL_CHARS_REGEX.search(command):
+        return None
+    try:
+        argv = shlex.split(command)
+    except ValueError:
+        return None
+    if not argv or _ASSIGNMENT_REGEX.match(argv[0]) or argv[0] in SHELL_BUILTINS:
+        return None
+    return argv
+
+
+def _read_capped(fd, max_output):
+    """Read fd until EOF, keep at most max_output bytes, None for no limit."""
+    chunks = []
+    size = 0
+    truncated = False
+    while True:
+        try:
+            data = os.read(fd, _READ_SIZE)
+        except InterruptedError:
+            continue
+        if not data:
+            break
+        if max_output is None:
+            chunks.append(data)
+            continue
+        left = max_output - size
+        if len(data) > left:
+            truncated = True
+            data = data[:left]
+        if data:
+            chunks.append(data)
+            size += len(data)
+    return b"".join(chunks), truncated
+
+
+def _posix_spawn(argv, env, stdout_fd, setsid=False, discard_stderr=False):
+    devnull = os.open(os.devnull, os.O_RDWR | os.O_CLOEXEC)
+    try:
+        out_fd = stdout_fd if stdout_fd is not None else devnull
+        file_actions = [
+            (os.POSIX_SPAWN_DUP2, devnull, 0),
+            (os.POSIX_SPAWN_DUP2, out_fd, 1),
+            (os.POSIX_SPAWN_DUP2, devnull if discard_stderr else out_fd, 2),
+        ]
+        return os.posix_spawnp(argv[0], argv, env if env is not None else os.environ, file_actions=file_actions,
+                               setsid=setsid)
+    finally:
+        os.close(devnull)
+
+
+def wait_exited(pid):
+    """Wait until pid exits without reaping it, so its pid is not reused yet."""
+    while True:
+        try:
+            os.waitid(os.P_PID, pid, os.WEXITED | os.WNOWAIT)
+            return
+        except InterruptedError:
+            continue
+        except ChildProcessError:
+            return
+
+
+def run(command, cwd=None, env=None, capture=True, max_output=None, pass_fds=(), watcher=None,
+        discard_stderr=False):
+    """
+    Run command, stderr is merged into stdout.
+    :param command:                 argv list, or command string which is run by shell only when needed
+    :param cwd:
+    :param env:                     None for environ of capture
+    :param capture:                 read output, or send it to /dev/null
+    :param max_output:              max bytes of output kept, None for no limit
+    :param pass_fds:                fds inherited by child process
+    :param watcher:                 object with watch(gpid) and unwatch(gpid), child runs in a new process group
+    :param discard_stderr:          send stderr to /dev/null instead of merging it
+    :return:
+        returncode:                 -1 if command can't be started
+        output:                     bytes, None if not captured
+        truncated:                  output is longer than max_output
+    """
+    if isinstance(command, (list, tuple)):
+        argv = list(command)
+    else:
+        argv = split_command(command)
+        if argv is None:
+            argv = [SHELL_PATH, "-c", command]
+
+    read_fd = write_fd = None
+    if capture:
+        read_fd, write_fd = os.pipe()
+    try:
+        if hasattr(os, "posix_spawnp") and not cwd and not pass_fds:
+            try:
+                pid = _posix_spawn(argv, env, write_fd, setsid=watcher is not None, discard_stderr=discard_stderr)
+            except OSError as e:
+                logger.warning("Subprocess command:[%s] execute fail: %s" % (command, e))
+                return -1, None, False
+            process = None
+        else:
+            try:
+                process = subprocess.Popen(argv, cwd=cwd or None, env=env, stdin=subprocess.DEVNULL,
+                                           stdout=write_fd if capture else subprocess.DEVNULL,
+                                           stderr=subprocess.DEVNULL if discard_stderr else subprocess.STDOUT,
+                                           pass_fds=pass_fds,
+                                           start_new_session=watcher is not None)
+            except (OSError, ValueError) as e:
+                logger.warning("Subprocess command:[%s] execute fail: %s" % (command, e))
+                return -1, None, False
+            pid = process.pid
+        instrument.count_subprocess()
+        if watcher is not None:
+            watcher.watch(pid)
+
+        output, truncated = None, False
+        if capture:
+            # Close our write end, so EOF comes when the child exits.
+            os.close(write_fd)
+            write_fd = None
+            output, truncated = _read_capped(read_fd, max_output)
+
+        if watcher is not None:
+            wait_exited(pid)
+            watcher.unwatch(pid)
+        if process is not None:
+            returncode = process.wait()
+        else:
+            _, status = os.waitpid(pid, 0)
+            returncode = os.waitstatus_to_exitcode(status)
+        return returncode, output, truncated
+    finally:
+        for fd in (read_fd, write_fd):
+            if fd is not None:
+                os.close(fd)
+
+
+# vi:set tw=0 ts=4 sw=4 nowrap fdm=indent
@@ -0,0 +1,301 @@
+# !/bin/env python
+# -*- coding: utf-8 -*_
+"""
+
+    @FileName: watch.py
+    @Author: zengzhishi(zengzs1995@gmail.com)
+    @CreatTime: 2018-04-11 10:26:44
+    @LastModif: 2018-04-11 10:26:44
+    @Note: Watch mode, keeps compile_commands.json fresh while the project is edited.
+    Project folders are watched by inotify (through ctypes, Linux only). When building files (CMakeLists.txt,
+    Makefile.am, Makefile...) change, the project is captured again from judging building type. When only sources are
+    added or removed, the project is scanned again by the analyzer of present building type, and unchanged folders are
+    not listed thanks to tree index. Entries are compared by source file, only entries of changed sources are updated:
+    sharded compile databases rewrite the shards holding them, unsharded ones are rewritten atomically.
+    Analyzers always parse the whole project, a building file can't be parsed alone (CMake parent scopes, global
+    configure.ac, make -n of the whole tree).
+"""
+
+import os
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+
+import capture.compile_db as compile_db
+import capture.source_detective as source_detective
+import capture.utils.project_walk as project_walk
+
+logger = logging.getLogger("capture")
+
+# inotify event masks, see <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF \
+    | IN_ONLYDIR
+ENTRY_CHANGED_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+
+_EVENT_HEADER = struct.Struct("iIII")
+_READ_SIZE = 64 * 1024
+
+DEFAULT_DEBOUNCE = 0.1
+MAX_DEBOUNCE = 2.0
+
+# Changing these files may change the building result, the whole project is captured again.
+BUILD_FILE_NAMES = frozenset(["CMakeLists.txt", "Makefile", "makefile", "GNUmakefile", "Makefile.in", "Makefile.am",
+                              "configure", "configure.ac", "configure.in", "SConstruct", "SConscript"])
+BUILD_FILE_SUFFIXES = frozenset(["cmake", "am", "mk", "m4"])
+
+# change kinds
+CHANGE_BUILD = "build"
+CHANGE_SOURCES = "sources"
+
+
+class WatchError(Exception):
+    def __init__(self, message=None):
+        if message:
+            self.args = (message,)
+        else:
+            self.args = ("Watch Error happen!",)
+
+
+class Inotify(object):
+    """Minimal inotify binding through ctypes."""
+    def __init__(self, mask=WATCH_MASK):
+        libc_name = ctypes.util.find_library("c") or "libc.so.6"
+        try:
+            self._libc = ctypes.CDLL(libc_name, use_errno=True)
+            self._libc.inotify_init1
+        except (OSError, AttributeError):
+            raise WatchError("inotify is not supported on this platform.")
+        self._libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise WatchError("inotify_init1 fail: %s" % os.strerror(ctypes.get_errno()))
+        self._mask = mask
+        self._paths = {}                # wd -> path
+        self._wds = {}                  # path -> wd
+
+    def fileno(self):
+        return self._fd
+
+    def __contains__(self, path):
+        return path in self._wds
+
+    def __len__(self):
+        return len(self._wds)
+
+    def add_watch(self, path):
+        if path in self._wds:
+            return self._wds[path]
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), self._mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                logger.warning("inotify watches are used up, raise fs.inotify.max_user_watches.")
+            else:
+                logger.warning("Watching %s fail: %s" % (path, os.strerror(err)))
+            return None
+        self._paths[wd] = path
+        self._wds[path] = wd
+        return wd
+
+    def rm_watch(self, path):
+        wd = self._wds.pop(path, None)
+        if wd is not None:
+            self._paths.pop(wd, None)
+            self._libc.inotify_rm_watch(self._fd, wd)
+
+    def read_events(self, timeout=None):
+        """
+        Wait for events at most timeout seconds, and return [(folder, name, mask), ...].
+        Folder is None for queue overflow event.
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+        events = []
+        while True:
+            try:
+                data = os.read(self._fd, _READ_SIZE)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    events.append((None, "", mask))
+                    continue
+                folder = self._paths.get(wd)
+                if mask & IN_IGNORED:
+                    # Watch is removed by kernel, folder is deleted.
+                    self._paths.pop(wd, None)
+                    if folder is not None:
+                        self._wds.pop(folder, None)
+                    continue
+                if folder is not None:
+                    events.append((folder, name, mask))
+        return events
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def classify_change(name, mask):
+    """Return CHANGE_BUILD, CHANGE_SOURCES or None for changes don't affect compile database."""
+    if mask & IN_Q_OVERFLOW or mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+        return CHANGE_BUILD
+    if mask & IN_ISDIR:
+        return CHANGE_SOURCES if mask & ENTRY_CHANGED_MASK else None
+    dot = name.rfind(".")
+    if name in BUILD_FILE_NAMES or (dot >= 0 and name[dot + 1:] in BUILD_FILE_SUFFIXES):
+        return CHANGE_BUILD
+    if mask & ENTRY_CHANGED_MASK \
+            and project_walk.classify(name, source_detective.SUFFIX_KINDS) == project_walk.SOURCE:
+        return CHANGE_SOURCES
+    return None
+
+
+def group_entries(entries):
+    """Group compile entries by their source paths, {source path: [entries]} in order of entries."""
+    grouped = {}
+    for entry in entries:
+        grouped.setdefault(compile_db.entry_source_path(entry), []).append(entry)
+    return grouped
+
+
+def diff_entries(old, new):
+    """Changes from old to new grouped entries, {source path: entries}, empty entries for removed source."""
+    changes = {}
+    for source_path, entries in new.items():
+        if old.get(source_path) != entries:
+            changes[source_path] = entries
+    for source_path in old:
+        if source_path not in new:
+            changes[source_path] = []
+    return changes
+
+
+class CaptureWatcher(object):
+    """
+    Keep capture state in memory, and update compile databases on project changes.
+
+    Usage:
+        watcher = CaptureWatcher(create_builder, generate_bitcode=False)
+        watcher.run()
+    """
+    def __init__(self, builder_factory, generate_bitcode=False, debounce=DEFAULT_DEBOUNCE):
+        """
+        :param builder_factory:         callable return a new CaptureBuilder, building type is already judged.
+        :param generate_bitcode:
+        :param debounce:                seconds without new events before updating
+        """
+        self._builder_factory = builder_factory
+        self._generate_bitcode = generate_bitcode
+        self._debounce = debounce
+        self._builder = None
+        self._entries = {}              # db_name -> {source path: entries} written last time
+        self._inotify = None
+
+    def capture(self, rebuild=False):
+        """
+        Scan project and rewrite changed compile databases.
+        :param rebuild:                 judge building type and run analyzer from scratch.
+        :return:                        names of rewritten compile databases.
+        """
+        if rebuild or self._builder is None:
+            self._builder = self._builder_factory()
+        else:
+            self._builder.reset_project_walk()
+
+        source_infos, _, _ = self._builder.scan_project()
+        result, bc_result = self._builder.build_commands(self._builder.select_prebuild_infos(source_infos),
+                                                         self._generate_bitcode)
+        changed = []
+        for db_name, entries in (("compile_commands", result), ("compile_commands_bc", bc_result)):
+            grouped = group_entries(entries)
+            if db_name not in self._entries:
+                self._builder.dump_commands(db_name, entries)
+            else:
+                changes = diff_entries(self._entries[db_name], grouped)
+                if not changes:
+                    continue
+                logger.info("Watch update %s: %d sources changed." % (db_name, len(changes)))
+                self._builder.patch_commands(db_name, changes, entries)
+            self._entries[db_name] = grouped
+            changed.append(db_name)
+        logger.info("Watch update: %d entries, rewritten: %s" % (len(result), ", ".join(changed) or "none"))
+        return changed
+
+    def _sync_watches(self):
+        folders = self._builder.project_folders()
+        if self._builder.root_path not in folders:
+            folders.append(self._builder.root_path)
+        for folder in folders:
+            self._inotify.add_watch(folder)
+
+    def _wait_changes(self):
+        """Block until some changes happen, and return the most important change kind."""
+        kinds = set()
+        events = self._inotify.read_events()
+        waited = 0.0
+        while events:
+            for folder, name, mask in events:
+                kind = classify_change(name, mask)
+                if kind is not None:
+                    logger.debug("Watch event: %s %s 0x%x" % (folder, name, mask))
+                    kinds.add(kind)
+            if waited >= MAX_DEBOUNCE:
+                break
+            events = self._inotify.read_events(self._debounce)
+            waited += self._debounce
+        if CHANGE_BUILD in kinds:
+            return CHANGE_BUILD
+        if CHANGE_SOURCES in kinds:
+            return CHANGE_SOURCES
+        return None
+
+    def run(self):
+        self._inotify = Inotify()
+        try:
+            self.capture(rebuild=True)
+            self._sync_watches()
+            logger.info("Watching %d folders of %s" % (len(self._inotify), self._builder.root_path))
+            while True:
+                kind = self._wait_changes()
+                if kind == CHANGE_BUILD:
+                    logger.info("Building files changed, capture project again.")
+                    self.capture(rebuild=True)
+                elif kind == CHANGE_SOURCES:
+                    # Building type is kept, only its analyzer runs again, e.g. make -n for wildcard sources.
+                    self.capture()
+                else:
+                    continue
+                self._sync_watches()
+        except KeyboardInterrupt:
+            logger.info("Watch mode stopped.")
+        finally:
+            self._inotify.close()
+
+
+# vi:set tw=0 ts=4 sw=4 nowrap fdm=indent
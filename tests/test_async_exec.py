@@ -0,0 +1,142 @@
+# !/bin/env python
+# -*- coding: utf-8 -*_
+"""
+
+    @FileName: test_async_exec.py
+    @Author: zengzhishi(zengzs1995@gmail.com)
+    @CreatTime: 2018-04-18 15:32:08
+    @LastModif: 2018-04-18 15:32:08
+    @Note:
+"""
+import os
+import sys
+import time
+import asyncio
+import threading
+
+import pytest
+
+import capture.pool.async_exec as async_exec
+import capture.pool.jobserver as jobserver
+
+
+def _python(code):
+    return [sys.executable, "-c", code]
+
+
+def test_run_jobs_in_order_and_concurrent():
+    jobs = [_python("import time; time.sleep(0.5); print(%d)" % i) for i in range(4)]
+    start_time = time.time()
+    results = async_exec.run_jobs(jobs, limit=4)
+    assert time.time() - start_time < 1.5
+    assert [result.output.strip() for result in results] == [b"0", b"1", b"2", b"3"]
+    assert all(result.returncode == 0 and not result.timed_out for result in results)
+
+    done = []
+    async_exec.run_jobs(jobs[:2], limit=1, on_result=lambda index, result: done.append(index))
+    assert sorted(done) == [0, 1]
+
+
+def test_shell_timeout_and_start_failure(tmpdir):
+    results = async_exec.run_jobs([
+        async_exec.ProcessJob("pwd | tr a-z A-Z", cwd=str(tmpdir)),
+        async_exec.ProcessJob(_python("import time; time.sleep(30)"), timeout=0.5),
+        ["/no/such/compiler", "-c", "a.c"],
+    ], limit=3)
+    assert results[0].output.strip() == os.path.realpath(str(tmpdir)).upper().encode("utf8")
+    assert results[1].timed_out and results[1].returncode != 0 and results[1].elapsed < 10
+    assert results[2].returncode == -1
+
+
+def test_first_success_in_job_order():
+    slow_success = _python("import time; time.sleep(0.3)")
+    fail = _python("import sys; sys.exit(1)")
+    never_needed = _python("import time; time.sleep(30)")
+    start_time = time.time()
+    results = async_exec.run_first_success([[fail, slow_success, "true", never_needed], [fail, fail], []], limit=8)
+    assert time.time() - start_time < 10
+    assert results[0][0] == 1 and results[0][1].returncode == 0
+    assert results[1] == (None, None)
+    assert results[2] == (None, None)
+
+
+class _ZombieCheckingHandle(object):
+    """Watch handle recording whether a job is unwatched before it is reaped."""
+    killed = None
+
+    def __init__(self):
+        self.unwatched = []
+
+    def handle(self):
+        return self
+
+    def watch(self, gpid):
+        pass
+
+    def unwatch(self, gpid):
+        # waitid with WNOWAIT finds an exited child only if it is not reaped yet.
+        info = os.waitid(os.P_PID, gpid, os.WEXITED | os.WNOHANG | os.WNOWAIT)
+        self.unwatched.append(info is not None and info.si_pid == gpid)
+
+
+@pytest.mark.parametrize("pidfd", [True, False])
+def test_unwatch_before_reaping(monkeypatch, pidfd):
+    if not pidfd:
+        monkeypatch.delattr(os, "pidfd_open", raising=False)
+    watcher = _ZombieCheckingHandle()
+    results = async_exec.run_jobs([_python("print(1)"), _python("import time; time.sleep(30)")],
+                                  limit=2, timeout=0.5, watchdog_instance=watcher)
+    assert results[0].returncode == 0 and results[0].output.strip() == b"1"
+    assert results[1].timed_out
+    assert watcher.unwatched == [True, True]
+
+
+@pytest.mark.parametrize("token_comes_late", [False, True])
+def test_cancelled_job_keeps_jobserver_tokens(token_comes_late):
+    read_fd, write_fd = os.pipe()
+    try:
+        client = jobserver.JobserverClient(read_fd, write_fd)
+        # Implicit token is taken by another job, the pipe is empty.
+        assert client.acquire() == jobserver.IMPLICIT_TOKEN
+
+        async def _cancel_waiting_job():
+            task = asyncio.ensure_future(async_exec.AsyncRunner(limit=2, jobserver_client=client).run("true"))
+            await asyncio.sleep(0.3)
+            if token_comes_late:
+                # Read by the acquiring thread, after the job doesn't want it any more.
+                os.write(write_fd, b"a")
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+        start_time = time.time()
+        asyncio.run(_cancel_waiting_job())
+        assert time.time() - start_time < 5
+        if not token_comes_late:
+            os.write(write_fd, b"a")
+        os.set_blocking(read_fd, False)
+        assert os.read(read_fd, 10) == b"a"
+        client.close()
+    finally:
+        os.close(read_fd)
+        os.close(write_fd)
+
+
+def test_executor_threads_named_after_caller(monkeypatch):
+    # Processes are waited in default executor threads without pidfd.
+    monkeypatch.delattr(os, "pidfd_open", raising=False)
+    thread_names = []
+    wait_exited = async_exec.spawn.wait_exited
+
+    def _wait_exited(pid):
+        thread_names.append(threading.current_thread().name)
+        return wait_exited(pid)
+    monkeypatch.setattr(async_exec.spawn, "wait_exited", _wait_exited)
+
+    results = []
+    thread = threading.Thread(target=lambda: results.extend(async_exec.run_jobs([_python("print(1)")])),
+                              name="capture-request-7")
+    thread.start()
+    thread.join(30)
+    assert results[0].returncode == 0
+    assert thread_names and all(name.startswith("capture-request-7-") for name in thread_names)
@@ -0,0 +1,146 @@
+# !/bin/env python
+# -*- coding: utf-8 -*_
+"""
+
+    @FileName: test_compile_db.py
+    @Author: zengzhishi(zengzs1995@gmail.com)
+    @CreatTime: 2018-04-04 15:40:18
+    @LastModif: 2018-04-04 15:40:18
+    @Note:
+"""
+import os
+import gzip
+import json
+
+import pytest
+
+import capture.compile_db as compile_db
+
+
+def _entries(root):
+    entries = []
+    for folder in ("src", "lib", "src"):
+        for i in range(3):
+            source = os.path.join(root, folder, "f%d.c" % i)
+            entries.append({"directory": root, "file": source, "command": "gcc -c %s" % source})
+    return entries
+
+
+def test_directory_shards_lookup(tmp_path):
+    root = str(tmp_path / "project")
+    entries = _entries(root)
+    with compile_db.ShardedWriter(str(tmp_path), root, shard_by="directory", shard_size=4) as writer:
+        writer.write_many(entries)
+
+    index = compile_db.CompileDBIndex(compile_db.index_file_path(str(tmp_path)))
+    # src is split into two shards by shard_size
+    assert len(index.shard_paths) == 3
+    assert index.lookup(os.path.join(root, "lib", "f1.c")) == [entries[4]]
+    assert index.lookup(os.path.join(root, "src", "f0.c")) == [entries[0], entries[6]]
+    assert index.lookup(os.path.join(root, "missing.c")) == []
+    assert len(list(index.lookup_directory(os.path.join(root, "src")))) == 6
+    index.close()
+
+
+def test_open_shards_are_capped(tmp_path):
+    root = str(tmp_path / "project")
+    entries = []
+    for i in range(3):
+        for folder in range(10):
+            source = os.path.join(root, "d%d" % folder, "f%d.c" % i)
+            entries.append({"directory": root, "file": source, "command": "gcc -c %s" % source})
+
+    def _open_fds():
+        return len(os.listdir("/proc/self/fd"))
+
+    base_fds = _open_fds()
+    with compile_db.ShardedWriter(str(tmp_path), root, shard_by="directory", max_open_shards=3) as writer:
+        for entry in entries:
+            writer.write(entry)
+            assert _open_fds() <= base_fds + 3
+
+    index = compile_db.CompileDBIndex(compile_db.index_file_path(str(tmp_path)))
+    assert len(index.shard_paths) == 10
+    for shard_path in index.shard_paths:
+        with open(shard_path) as fin:
+            assert len(json.load(fin)) == 3
+    for entry in entries:
+        assert index.lookup(entry["file"]) == [entry]
+    index.close()
+
+
+def test_merge_shards(tmp_path):
+    root = str(tmp_path / "project")
+    entries = _entries(root)
+    with compile_db.ShardedWriter(str(tmp_path), root, shard_by="count", shard_size=2) as writer:
+        writer.write_many(entries)
+
+    output_path = str(tmp_path / "compile_commands.json")
+    assert compile_db.merge_shards(compile_db.index_file_path(str(tmp_path)), output_path) == len(entries)
+    with open(output_path) as fin:
+        assert json.load(fin) == entries
+
+
+def test_merge_shards_with_indent_and_compression(tmp_path):
+    root = str(tmp_path / "project")
+    entries = _entries(root)
+    with compile_db.ShardedWriter(str(tmp_path), root, shard_by="count", shard_size=2) as writer:
+        writer.write_many(entries)
+
+    output_path = str(tmp_path / "compile_commands.json.gz")
+    assert compile_db.merge_shards(compile_db.index_file_path(str(tmp_path)), output_path,
+                                   indent=4, compression="gzip") == len(entries)
+    with gzip.open(output_path, "rt") as fin:
+        text = fin.read()
+    assert text == json.dumps(entries, indent=4)
+
+
+def test_interrupted_shards_have_no_index(tmp_path):
+    root = str(tmp_path / "project")
+    with compile_db.ShardedWriter(str(tmp_path), root, shard_by="count", shard_size=2) as writer:
+        writer.write_many(_entries(root))
+    assert os.path.exists(compile_db.index_file_path(str(tmp_path)))
+
+    with pytest.raises(RuntimeError):
+        with compile_db.ShardedWriter(str(tmp_path), root, shard_by="count", shard_size=2) as writer:
+            writer.write_many(_entries(root)[:3])
+            raise RuntimeError()
+    assert not os.path.exists(compile_db.index_file_path(str(tmp_path)))
+
+
+def test_patch_shards_rewrites_only_changed_shards(tmp_path):
+    root = str(tmp_path / "project")
+    entries = _entries(root)
+    with compile_db.ShardedWriter(str(tmp_path), root, shard_by="directory", shard_size=4) as writer:
+        writer.write_many(entries)
+    index_path = compile_db.index_file_path(str(tmp_path))
+    with compile_db.CompileDBIndex(index_path) as index:
+        shard_paths = index.shard_paths
+    lib_shard = [path for path in shard_paths if path.endswith("-lib.json")][0]
+    with open(lib_shard, "rb") as fin:
+        lib_data = fin.read()
+
+    changed_source = os.path.join(root, "src", "f1.c")
+    changed_entries = [{"directory": root, "file": changed_source, "command": "gcc -DX -c %s" % changed_source}]
+    removed_source = os.path.join(root, "src", "f2.c")
+    new_source = os.path.join(root, "new", "f0.c")
+    new_entries = [{"directory": root, "file": new_source, "command": "gcc -c %s" % new_source}]
+    rewritten = compile_db.patch_shards(index_path, {changed_source: changed_entries, removed_source: [],
+                                                     new_source: new_entries}, root, shard_by="directory")
+
+    with compile_db.CompileDBIndex(index_path) as index:
+        assert len(index.shard_paths) == 4
+        assert index.lookup(changed_source) == changed_entries
+        assert index.lookup(removed_source) == []
+        assert index.lookup(new_source) == new_entries
+        assert index.lookup(os.path.join(root, "lib", "f0.c")) == [entries[3]]
+        assert index.lookup(os.path.join(root, "src", "f0.c")) == [entries[0], entries[6]]
+    # src shards and the new shard are rewritten, lib shard is untouched.
+    assert len(rewritten) == 3
+    with open(lib_shard, "rb") as fin:
+        assert fin.read() == lib_data
+    output_path = str(tmp_path / "compile_commands.json")
+    # Both entries of f2.c are removed, two entries of f1.c are replaced by one.
+    assert compile_db.merge_shards(index_path, output_path) == len(entries) - 2
+    with open(output_path) as fin:
+        assert sorted(entry["file"] for entry in json.load(fin)).count(changed_source) == 1
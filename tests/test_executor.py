@@ -0,0 +1,121 @@
+# !/bin/env python
+# -*- coding: utf-8 -*_
+"""
+
+    @FileName: test_executor.py
+    @Author: zengzhishi(zengzs1995@gmail.com)
+    @CreatTime: 2018-04-14 16:02:19
+    @LastModif: 2018-04-14 16:02:19
+    @Note:
+"""
+import time
+import signal
+import threading
+
+import pytest
+
+import capture.pool.executor as executor
+import capture.pool.watchdog as watchdog
+import capture.utils.spawn as spawn
+
+
+def test_executor_runs_all_tasks_with_slot_limit():
+    slots = executor.Slots(cpu=1, subprocess=2)
+    lock = threading.Lock()
+    running = [0, 0]
+    results = []
+
+    def _task(item):
+        with lock:
+            running[0] += 1
+            running[1] = max(running[1], running[0])
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+        if item == 3:
+            raise ValueError("bad item")
+        return item * 2
+
+    # More threads than slots, and a queue smaller than the tasks count.
+    with executor.Executor(_task, name="test", slot=executor.SLOT_SUBPROCESS, workers=4, queue_size=2,
+                           slots=slots, callback=results.append) as pool:
+        pool.map(range(10))
+
+    assert running[1] <= 2
+    assert sorted(result.value for result in results if result.error is None) == [0, 2, 4, 8, 10, 12, 14, 16, 18]
+    stats = pool.stats()
+    assert stats["completed"] == 10
+    assert stats["failed"] == 1
+    assert stats["max_time"] > 0
+
+
+def test_executor_cancel_and_submit_after_shutdown():
+    started = threading.Event()
+    release = threading.Event()
+
+    def _task(item):
+        started.set()
+        release.wait()
+
+    pool = executor.Executor(_task, name="test", workers=1, queue_size=0, slots=executor.Slots())
+    pool.map(range(5))
+    started.wait()
+    threading.Timer(0.05, release.set).start()
+    pool.shutdown(cancel=True)
+
+    stats = pool.stats()
+    assert stats["completed"] == 1
+    assert stats["cancelled"] == 4
+    try:
+        pool.submit(1)
+        assert False
+    except executor.ExecutorError:
+        pass
+
+
+def test_interrupt_kills_watched_commands():
+    watchdog_instance = watchdog.Watchdog(memory_percent=0)
+    results = []
+    started = threading.Semaphore(0)
+
+    class _Handle(object):
+        def __init__(self):
+            self._handle = watchdog_instance.handle()
+
+        def watch(self, gpid):
+            self._handle.watch(gpid)
+            started.release()
+
+        def unwatch(self, gpid):
+            self._handle.unwatch(gpid)
+
+    def _task(item):
+        results.append(spawn.run(["sleep", "30"], capture=False, watcher=_Handle())[0])
+
+    pool = executor.Executor(_task, name="test", slot=None, workers=2, queue_size=0,
+                             on_cancel=watchdog_instance.terminate_all)
+    start_time = time.time()
+    with pytest.raises(KeyboardInterrupt):
+        with pool:
+            pool.map(range(4))
+            started.acquire()
+            started.acquire()
+            raise KeyboardInterrupt()
+    # Running sleeps are killed before workers are waited, waiting ones are dropped.
+    assert results == [-signal.SIGKILL] * 2
+    assert pool.stats()["cancelled"] == 2
+    assert time.time() - start_time < 30
+
+
+def _square(chunk):
+    return [x * x for x in chunk]
+
+
+def test_process_executor_bounded_inflight():
+    chunks = [list(range(i, i + 5)) for i in range(0, 50, 5)]
+    with executor.ProcessExecutor("test", workers=2, max_inflight=2) as process_executor:
+        results = []
+        for batch in process_executor.imap_unordered(_square, chunks):
+            results.extend(batch)
+    assert sorted(results) == [x * x for x in range(50)]
+    assert process_executor.stats()["completed"] == len(chunks)
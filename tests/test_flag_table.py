@@ -0,0 +1,41 @@
+# !/bin/env python
+# -*- coding: utf-8 -*_
+"""
+
+    @FileName: test_flag_table.py
+    @Author: zengzhishi(zengzs1995@gmail.com)
+    @CreatTime: 2018-04-08 15:12:40
+    @LastModif: 2018-04-08 15:12:40
+    @Note:
+"""
+import capture.utils.flag_table as flag_table
+
+
+def test_same_flags_stored_once():
+    table = flag_table.FlagTable()
+    first = table.intern_tuple(["-g", "-O2"])
+    second = table.intern_tuple(iter(["-g", "-O2"]))
+    assert first is second
+    assert table.intern(("-g",)) != table.intern(["-g", "-O2"])
+    assert len(table) == 2
+
+
+def test_group_compile_entries():
+    table = flag_table.FlagTable()
+    flags_id, definitions_id, includes_id = table.intern(["-g"]), table.intern(["A=1"]), table.intern(["/p"])
+    entries = [flag_table.CompileEntry("/p/%d.c" % i, "/p", "C", flags_id, definitions_id, includes_id)
+               for i in range(3)]
+    entries.append(flag_table.CompileEntry("/p/x.cc", "/p", "CXX", flags_id, definitions_id, includes_id))
+
+    infos = flag_table.group_compile_entries(entries, table)
+    assert [info["source_files"] for info in infos] == [["/p/0.c", "/p/1.c", "/p/2.c"], ["/p/x.cc"]]
+    assert infos[0]["flags"] is infos[1]["flags"]
+
+
+def test_compact_source_infos():
+    infos = [{"flags": ["-g"], "definitions": ["A"], "includes": []},
+             {"flags": ["-g"], "definitions": [], "includes": []}]
+    flag_sets, compact_infos = flag_table.compact_source_infos(infos)
+    assert flag_sets == [("-g",), ("A",), ()]
+    assert compact_infos == [{"flags": 0, "definitions": 1, "includes": 2},
+                             {"flags": 0, "definitions": 2, "includes": 2}]
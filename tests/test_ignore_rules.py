@@ -0,0 +1,60 @@
+# !/bin/env python
+# -*- coding: utf-8 -*_
+"""
+
+    @FileName: test_ignore_rules.py
+    @Author: zengzhishi(zengzs1995@gmail.com)
+    @CreatTime: 2018-04-10 15:40:26
+    @LastModif: 2018-04-10 15:40:26
+    @Note:
+"""
+import os
+
+import capture.utils.ignore_rules as ignore_rules
+import capture.utils.project_walk as project_walk
+
+
+def _match(patterns, path, is_dir=False):
+    return ignore_rules.IgnoreMatcher.from_patterns("/p", patterns).ignored("/p/" + path, is_dir)
+
+
+def test_patterns():
+    assert _match(["*.o"], "src/a.o")
+    assert not _match(["*.o"], "src/a.c")
+    assert _match(["/build/"], "build", True)
+    assert not _match(["/build/"], "build", False)
+    assert not _match(["/build/"], "src/build", True)
+    assert _match(["build/"], "src/build", True)
+    assert _match(["src/*.pb.cc"], "src/a.pb.cc")
+    assert not _match(["src/*.pb.cc"], "lib/src/a.pb.cc")
+    assert _match(["**/gen/*.c"], "a/b/gen/x.c")
+    assert _match(["third_party/**"], "third_party/x/y.c")
+    assert _match(["a?[0-9].c"], "ab1.c")
+    assert not _match(["a?[!0-9].c"], "ab1.c")
+
+
+def test_last_rule_wins():
+    assert not _match(["*.c", "!keep.c"], "keep.c")
+    assert _match(["!keep.c", "*.c"], "keep.c")
+    assert not _match(["# *.c", "", "\\#x.c"], "a.c")
+    assert _match(["\\#x.c"], "#x.c")
+
+
+def test_hierarchical_ignore_files(tmpdir):
+    root = str(tmpdir)
+    files = ["a.c", "gen.c", "src/b.c", "src/gen.c", "src/keep/gen.c", "out/c.c", "vendor/d.c"]
+    for name in files:
+        path = os.path.join(root, name)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        open(path, "w").close()
+    with open(os.path.join(root, ".gitignore"), "w") as fout:
+        fout.write("gen.c\n/out/\n")
+    with open(os.path.join(root, "src", "keep", ".captureignore"), "w") as fout:
+        fout.write("!gen.c\n")
+
+    matcher = ignore_rules.IgnoreMatcher.from_patterns(root, ["vendor/"])
+    walk = project_walk.ProjectWalk(root, ["src", "out", "vendor"], project_walk.build_suffix_kinds(["c"], []),
+                                    ignore=matcher)
+    sources = sorted(os.path.relpath(path, root) for path in walk.files(project_walk.SOURCE))
+    assert sources == ["a.c", "src/b.c", "src/keep/gen.c"]
@@ -0,0 +1,58 @@
+# !/bin/env python
+# -*- coding: utf-8 -*_
+"""
+
+    @FileName: test_instrument.py
+    @Author: zengzhishi(zengzs1995@gmail.com)
+    @CreatTime: 2018-04-23 14:05:31
+    @LastModif: 2018-04-23 14:05:31
+    @Note:
+"""
+import os
+import sys
+import json
+import time
+
+import capture.utils.instrument as instrument
+import capture.utils.spawn as spawn
+
+
+@instrument.timed()
+def _parse(items):
+    instrument.count("items", len(items))
+    return len(items)
+
+
+def test_nested_phases_and_report(tmpdir):
+    with instrument.Profiler() as profiler:
+        assert instrument.current() is profiler
+        with instrument.phase("scan_project") as record:
+            time.sleep(0.05)
+            assert _parse([1, 2, 3]) == 3
+            instrument.count("files", 2)
+            instrument.count("files", 3)
+            spawn.run([sys.executable, "-c", "sum(range(1000000))"], capture=False)
+    assert instrument.current() is None
+    assert record.wall >= 0.05
+
+    path = os.path.join(str(tmpdir), instrument.DEFAULT_PROFILE_FILE)
+    profiler.dump(path)
+    with open(path) as fin:
+        report = json.load(fin)
+    assert report["version"] == instrument.PROFILE_VERSION
+    scan, parse = report["phases"]
+    assert (scan["path"], scan["depth"], scan["counts"]) == ("scan_project", 0, {"files": 5})
+    assert (parse["path"], parse["depth"], parse["counts"]) == ("scan_project/_parse", 1, {"items": 3})
+    assert scan["subprocesses"] == 1 and parse["subprocesses"] == 0
+    assert scan["children_cpu"] > 0
+    assert scan["peak_rss"] > 0 and scan["children_peak_rss"] > 0
+    assert report["total"]["wall"] >= scan["wall"]
+
+
+def test_phase_without_profiler():
+    with instrument.phase("alone") as record:
+        instrument.count("items")
+        time.sleep(0.01)
+    assert record.wall >= 0.01
+    assert record.counts == {}
+    assert _parse([1]) == 1
@@ -0,0 +1,109 @@
+# !/bin/env python
+# -*- coding: utf-8 -*_
+"""
+
+    @FileName: test_jobserver.py
+    @Author: zengzhishi(zengzs1995@gmail.com)
+    @CreatTime: 2018-04-15 15:12:40
+    @LastModif: 2018-04-15 15:12:40
+    @Note:
+"""
+import os
+import sys
+import time
+import threading
+import subprocess
+
+import pytest
+
+import capture.pool.jobserver as jobserver
+import capture.utils.capture_util as capture_util
+
+PROJECT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+needs_make = pytest.mark.skipif(not jobserver.make_supports_jobserver(), reason="GNU make 4.2+ is required")
+
+
+def test_parse_makeflags():
+    assert jobserver.parse_makeflags("") is None
+    assert jobserver.parse_makeflags("k -j4 --jobserver-auth=3,4") == (jobserver.JOBSERVER_FDS, (3, 4))
+    assert jobserver.parse_makeflags(" -j --jobserver-fds=5,6") == (jobserver.JOBSERVER_FDS, (5, 6))
+    assert jobserver.parse_makeflags("-j8 --jobserver-auth=fifo:/tmp/GMfifo1") == \
+        (jobserver.JOBSERVER_FIFO, "/tmp/GMfifo1")
+    assert jobserver.parse_makeflags("k -- --jobserver-auth=3,4") is None
+
+
+def test_update_makeflags():
+    assert jobserver.update_makeflags("kw -j2 --jobserver-auth=3,4 -- CC=gcc", ["-j8"], drop=("-j", "--jobserver")) \
+        == "-kw -j8 %s -- CC=gcc" % jobserver.OUTPUT_SYNC_FLAG
+
+
+def test_client_tokens():
+    read_fd, write_fd = os.pipe()
+    try:
+        os.write(write_fd, b"ab")
+        client = jobserver.JobserverClient(read_fd, write_fd)
+        tokens = [client.acquire() for _ in range(3)]
+        assert tokens[0] == jobserver.IMPLICIT_TOKEN
+        assert sorted(tokens[1:]) == [b"a", b"b"]
+        for token in tokens:
+            client.release(token)
+        # Implicit token is never written back.
+        assert os.read(read_fd, 10) in (b"ab", b"ba")
+        client.close()
+    finally:
+        os.close(read_fd)
+        os.close(write_fd)
+
+
+def test_acquire_does_not_block_on_stolen_token(monkeypatch):
+    read_fd, write_fd = os.pipe()
+    client = jobserver.JobserverClient(read_fd, write_fd)
+    try:
+        assert client.acquire() == jobserver.IMPLICIT_TOKEN
+        # Pipe is seen readable, but another client reads the token before us.
+        monkeypatch.setattr(jobserver.select, "select", lambda rlist, wlist, xlist, timeout: (rlist, [], []))
+        cancel = threading.Event()
+        result = []
+        thread = threading.Thread(target=lambda: result.append(client.acquire(cancel)))
+        thread.daemon = True
+        thread.start()
+        time.sleep(0.2)
+        cancel.set()
+        thread.join(5.0)
+        assert not thread.is_alive() and result == [None]
+        # Pipe shared with make keeps its flags.
+        assert os.get_blocking(read_fd)
+        assert client.fds == (read_fd, write_fd)
+    finally:
+        client.close()
+        os.close(read_fd)
+        os.close(write_fd)
+
+
+@needs_make
+def test_client_from_outer_make(tmpdir):
+    script = "import capture.pool.jobserver as j; print(j.get_client() is not None)"
+    with open(os.path.join(str(tmpdir), "Makefile"), "w") as fout:
+        fout.write("all:\n\t+@%s -c '%s'\n" % (sys.executable, script))
+    output = subprocess.check_output(["make", "-s", "-j3"], cwd=str(tmpdir),
+                                     env=dict(os.environ, PYTHONPATH=PROJECT_PATH, MAKEFLAGS=""))
+    assert output.decode("utf8").strip() == "True"
+
+
+@needs_make
+def test_child_make_uses_capture_jobserver(tmpdir):
+    root = str(tmpdir)
+    os.makedirs(os.path.join(root, "sub"))
+    with open(os.path.join(root, "Makefile"), "w") as fout:
+        fout.write("all:\n\t$(MAKE) -C sub\n")
+    with open(os.path.join(root, "sub", "Makefile"), "w") as fout:
+        fout.write("all: a.o b.o\n%.o:\n\tgcc -c $*.c -o $@\n")
+
+    with jobserver.child_make_environ(4) as (env, pass_fds):
+        assert "--jobserver-auth=" in env["MAKEFLAGS"]
+        returncode, out, _ = capture_util.subproces_calling("make -nkw", cwd=root, env=env, pass_fds=pass_fds)
+    out = out.decode("utf8")
+    assert returncode == 0
+    assert "gcc -c a.c -o a.o" in out and "gcc -c b.c -o b.o" in out
+    assert "jobserver unavailable" not in out
@@ -0,0 +1,76 @@
+# !/bin/env python
+# -*- coding: utf-8 -*_
+"""
+
+    @FileName: test_json_stream.py
+    @Author: zengzhishi(zengzs1995@gmail.com)
+    @CreatTime: 2018-04-03 16:02:11
+    @LastModif: 2018-04-03 16:02:11
+    @Note:
+"""
+import os
+import gzip
+import json
+
+import pytest
+
+import capture.utils.json_stream as json_stream
+
+ENTRIES = [
+    {"directory": "/p", "file": "/p/a.c", "arguments": ["gcc", "-DNAME=a b", "-c", "/p/a.c"]},
+    {"directory": "/p", "file": "/p/b.c", "command": "gcc -c /p/b.c"},
+]
+
+
+def test_indent_output_same_as_json_dump(tmp_path):
+    path = str(tmp_path / "compile_commands.json")
+    with json_stream.JsonArrayWriter(path) as writer:
+        writer.write_many(ENTRIES)
+
+    with open(path) as fin:
+        assert fin.read() == json.dumps(ENTRIES, indent=4)
+
+
+def test_compact_gzip_output(tmp_path):
+    path = json_stream.output_file_path(str(tmp_path / "compile_commands.json"), "gzip")
+    with json_stream.JsonArrayWriter(path, indent=None, compression="gzip") as writer:
+        writer.write_many(ENTRIES)
+
+    assert path.endswith(".json.gz")
+    with gzip.open(path, "rt") as fin:
+        assert json.load(fin) == ENTRIES
+
+
+def test_empty_array(tmp_path):
+    path = str(tmp_path / "empty.json")
+    json_stream.JsonArrayWriter(path).close()
+    with open(path) as fin:
+        assert json.load(fin) == []
+
+
+def test_atomic_output(tmp_path):
+    path = str(tmp_path / "compile_commands.json")
+    with json_stream.JsonArrayWriter(path, atomic=True) as writer:
+        writer.write_many(ENTRIES)
+        assert not os.path.exists(path)
+
+    try:
+        with json_stream.JsonArrayWriter(path, atomic=True) as writer:
+            writer.write(ENTRIES[0])
+            raise RuntimeError()
+    except RuntimeError:
+        pass
+    assert not os.path.exists(path + ".tmp")
+    with open(path) as fin:
+        assert json.load(fin) == ENTRIES
+
+
+def test_interrupted_output_is_not_complete(tmp_path):
+    path = str(tmp_path / "compile_commands.json")
+    with pytest.raises(RuntimeError):
+        with json_stream.JsonArrayWriter(path) as writer:
+            writer.write_many(ENTRIES)
+            raise RuntimeError()
+    with open(path) as fin:
+        with pytest.raises(ValueError):
+            json.load(fin)
@@ -0,0 +1,74 @@
+# !/bin/env python
+# -*- coding: utf-8 -*_
+"""
+
+    @FileName: test_object_cache.py
+    @Author: zengzhishi(zengzs1995@gmail.com)
+    @CreatTime: 2018-04-20 15:44:10
+    @LastModif: 2018-04-20 15:44:10
+    @Note:
+"""
+import os
+import shutil
+
+import pytest
+
+import capture.utils.object_cache as object_cache
+import capture.utils.spawn as spawn
+
+pytestmark = pytest.mark.skipif(shutil.which("gcc") is None, reason="gcc is needed")
+
+
+def _compile(cache, source, output):
+    command = ["gcc", "-O1", "-c", source, "-o", output]
+    entry = cache.prepare(command, os.path.dirname(source))
+    assert entry is not None
+    if cache.fetch(entry):
+        return True
+    entry.remove_output()
+    assert spawn.run(command)[0] == 0
+    assert cache.store(entry)
+    return False
+
+
+def test_hit_across_output_folders(tmpdir):
+    project = tmpdir.mkdir("project")
+    project.join("a.h").write("#define VALUE 1\n")
+    project.join("a.c").write("#include \"a.h\"\nint a(void) { return VALUE; }\n")
+    source = str(project.join("a.c"))
+    cache = object_cache.ObjectCache(str(tmpdir.join("cache")))
+
+    first = str(tmpdir.mkdir("out1").join("x.o"))
+    second = str(tmpdir.mkdir("out2").join("y.o"))
+    assert not _compile(cache, source, first)
+    assert _compile(cache, source, second)
+    assert os.path.samefile(first, second)
+
+    # Header change is seen in preprocessed source.
+    project.join("a.h").write("#define VALUE 2\n")
+    assert not _compile(cache, source, second)
+    assert not os.path.samefile(first, second)
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["stored"]) == (1, 2, 2)
+    assert round(stats["hit_rate"]) == 33
+
+
+def test_uncacheable_commands(tmpdir):
+    cache = object_cache.ObjectCache(str(tmpdir))
+    assert cache.prepare("gcc -c a.c -o a.o 2> log", str(tmpdir)) is None
+    assert cache.prepare(["gcc", "-MD", "-c", "a.c", "-o", "a.o"], str(tmpdir)) is None
+    assert cache.prepare(["gcc", "-c", "missing.c", "-o", "a.o"], str(tmpdir)) is None
+    assert cache.stats()["uncacheable"] == 3
+
+
+def test_evict_least_recently_used(tmpdir):
+    cache = object_cache.ObjectCache(str(tmpdir), max_size=2500)
+    for i in range(4):
+        path = tmpdir.mkdir("%02d" % i).join("%02d.o" % i)
+        path.write(b"x" * 1000, mode="wb")
+        os.utime(str(path), (1000 + i, 1000 + i))
+    assert cache.evict() == 2
+    assert sorted(os.listdir(str(tmpdir))) == ["00", "01", "02", "03"]
+    assert not os.path.exists(str(tmpdir.join("00", "00.o")))
+    assert os.path.exists(str(tmpdir.join("03", "03.o")))
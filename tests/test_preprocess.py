@@ -0,0 +1,54 @@
+# !/bin/env python
+# -*- coding: utf-8 -*_
+"""
+
+    @FileName: test_preprocess.py
+    @Author: zengzhishi(zengzs1995@gmail.com)
+    @CreatTime: 2018-04-22 10:17:40
+    @LastModif: 2018-04-22 10:17:40
+    @Note:
+"""
+import os
+import shutil
+
+import pytest
+
+import capture.utils.preprocess as preprocess
+
+
+def test_parse_and_compile_argv():
+    unit = preprocess.CompileUnit.parse("g++ -DA=1 -I inc -Wall -c src/a.c -o a.o", "/p", "/p/src/a.c")
+    assert unit.source == "src/a.c"
+    assert unit.output == "/p/a.o"
+    assert unit.preprocessed_suffix == preprocess.PREPROCESSED_CXX_SUFFIX
+    assert unit.preprocess_argv() == ["g++", "-DA=1", "-I", "inc", "-Wall", "src/a.c", "-E"]
+    assert unit.compile_argv("/t/s.ii", "/t/a.o") == ["g++", "-Wall", "-c", "/t/s.ii", "-o", "/t/a.o"]
+
+    assert preprocess.CompileUnit.parse("gcc -MD -c a.c -o a.o", "/p") is None
+    assert preprocess.CompileUnit.parse("gcc a.c -o a", "/p") is None
+    assert preprocess.CompileUnit.parse("gcc -c a.c -o a.o | tee log", "/p") is None
+
+
+def test_shares_preprocessing():
+    unit = preprocess.CompileUnit.parse("clang -DA -c a.c -o a.o", "/p", "a.c")
+    assert unit.shares_preprocessing(preprocess.CompileUnit.parse("clang -DA -c a.c -flto -o a.bc", "/p", "a.c"))
+    assert not unit.shares_preprocessing(preprocess.CompileUnit.parse("gcc -DA -c a.c -flto -o a.bc", "/p", "a.c"))
+    assert not unit.shares_preprocessing(preprocess.CompileUnit.parse("clang -DB -c a.c -flto -o a.bc", "/p", "a.c"))
+    assert not unit.shares_preprocessing(None)
+
+
+@pytest.mark.skipif(shutil.which("gcc") is None, reason="gcc is needed")
+def test_compile_preprocessed(tmpdir):
+    tmpdir.join("a.h").write("#define VALUE 3\n")
+    tmpdir.join("a.c").write("#include \"a.h\"\nint a(void) { return VALUE; }\n")
+    unit = preprocess.CompileUnit.parse("gcc -I. -c a.c -o a.o", str(tmpdir), "a.c")
+    bitcode_unit = preprocess.CompileUnit.parse("gcc -I. -c a.c -flto -o a.bc", str(tmpdir), "a.c")
+    returncode, data = preprocess.preprocess(unit)
+    assert returncode == 0 and b"return 3;" in data
+
+    # Headers are not needed any more.
+    tmpdir.join("a.h").remove()
+    for compile_unit in (unit, bitcode_unit):
+        returncode, _, _ = preprocess.compile_preprocessed(compile_unit, data)
+        assert returncode == 0
+        assert os.path.getsize(compile_unit.output) > 0
@@ -0,0 +1,59 @@
+# !/bin/env python
+# -*- coding: utf-8 -*_
+"""
+
+    @FileName: test_profiling.py
+    @Author: zengzhishi(zengzs1995@gmail.com)
+    @CreatTime: 2018-04-24 15:22:06
+    @LastModif: 2018-04-24 15:22:06
+    @Note:
+"""
+import os
+import pstats
+import threading
+
+import capture.building_process as building_process
+import capture.utils.profiling as profiling
+
+
+def _burn(n):
+    return sum(i * i for i in range(n))
+
+
+class BurnBuilder(building_process.ProcessBuilder):
+    def mission(self, jobs):
+        return [_burn(job) for job in jobs]
+
+
+def test_session_disabled(tmpdir):
+    with profiling.Session(profiling.MODE_NONE, str(tmpdir)) as session:
+        assert profiling.current() is session
+        assert session.worker_options() is None
+    assert profiling.current() is None
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_session_profiles_threads_and_workers(tmpdir):
+    output_path = str(tmpdir)
+    expected = _burn(300000)
+    with profiling.Session(profiling.MODE_ALL, output_path, interval=0.001):
+        thread = threading.Thread(target=_burn, args=(300000,), name="burn-thread")
+        thread.start()
+        thread.join()
+        builder = BurnBuilder(chunk_size=1)
+        builder.distribute_jobs([300000, 300000])
+        assert builder.run(worker_num=2) == [expected] * 2
+        assert builder.profile_options is not None
+        _burn(300000)
+
+    assert sorted(os.listdir(output_path)) == [profiling.CPROFILE_FILE, profiling.CPROFILE_SUMMARY_FILE,
+                                               profiling.STACKS_FILE]
+    stats = pstats.Stats(os.path.join(output_path, profiling.CPROFILE_FILE))
+    burn_calls = [value[1] for key, value in stats.stats.items() if key[2] == "_burn"]
+    # Main thread, burn-thread and two worker chunks.
+    assert burn_calls == [4]
+
+    stacks = profiling.load_stacks(os.path.join(output_path, profiling.STACKS_FILE))
+    assert sum(stacks.values()) > 0
+    assert any(stack.startswith("MainThread;") and "_burn" in stack for stack in stacks)
+    assert any(stack.startswith("worker;") and "mission" in stack for stack in stacks)
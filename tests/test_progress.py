@@ -0,0 +1,112 @@
+# !/bin/env python
+# -*- coding: utf-8 -*_
+"""
+
+    @FileName: test_progress.py
+    @Author: zengzhishi(zengzs1995@gmail.com)
+    @CreatTime: 2018-04-02 16:05:41
+    @LastModif: 2018-04-02 16:05:41
+    @Note:
+"""
+import os
+import json
+
+import pytest
+
+import capture.pool.progress as progress
+
+
+class _Clock(object):
+    """Stand-in of time module, the monitor only sees time.time()."""
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = _Clock(100.0)
+    monkeypatch.setattr(progress, "time", fake)
+    return fake
+
+
+def _load(path):
+    with open(path) as fin:
+        return json.load(fin)
+
+
+def test_report_metrics(tmpdir, clock):
+    status_path = str(tmpdir.join(progress.DEFAULT_STATUS_FILE))
+    monitor = progress.ProgressMonitor("command_exec", 10, status_path=status_path, report_interval=1.0)
+
+    clock.now = 102.0
+    monitor.report(2, worker="w0", latency=1.0)
+    monitor.report(2, worker="w1", latency=3.0)
+    clock.now = 104.0
+    monitor.report(1, worker="w0", latency=0.5)
+    monitor.report(1)
+
+    snapshot = monitor.snapshot()
+    assert monitor.completed == 6
+    assert snapshot["completed"] == 6 and snapshot["total"] == 10
+    assert snapshot["percent"] == pytest.approx(60.0)
+    assert snapshot["elapsed"] == pytest.approx(4.0)
+    assert snapshot["items_per_sec"] == pytest.approx(1.5)
+    assert snapshot["eta"] == pytest.approx(4 / 1.5)
+    assert snapshot["workers"] == {
+        "w0": {"count": 3, "avg_latency": pytest.approx(0.5), "max_latency": pytest.approx(0.5)},
+        "w1": {"count": 2, "avg_latency": pytest.approx(1.5), "max_latency": pytest.approx(1.5)},
+    }
+    assert not snapshot["finished"]
+
+
+def test_status_file_is_throttled_and_atomic(tmpdir, clock):
+    status_path = str(tmpdir.join(progress.DEFAULT_STATUS_FILE))
+    monitor = progress.ProgressMonitor("command_prebuild", 4, status_path=status_path, report_interval=1.0)
+
+    clock.now = 101.0
+    monitor.report(1, worker="w0", latency=1.0)
+    assert _load(status_path)["completed"] == 1
+    # Reports inside the interval are not written.
+    clock.now = 101.5
+    monitor.report(1, worker="w0", latency=0.5)
+    assert _load(status_path)["completed"] == 1
+    clock.now = 102.5
+    monitor.report(1, worker="w0", latency=1.0)
+    assert _load(status_path)["completed"] == 3
+    # The last item is always written.
+    monitor.report(1, worker="w0", latency=0.1)
+    status = _load(status_path)
+    assert status["completed"] == 4 and status["eta"] == 0.0
+
+    snapshot = monitor.finish()
+    status = _load(status_path)
+    assert status == json.loads(json.dumps(snapshot))
+    assert status["finished"] and status["phase"] == "command_prebuild" and status["percent"] == 100.0
+    assert os.listdir(str(tmpdir)) == [progress.DEFAULT_STATUS_FILE]
+
+
+def test_eta_unknown_without_completions(clock):
+    monitor = progress.ProgressMonitor("command_exec", 3)
+    clock.now = 105.0
+    snapshot = monitor.snapshot()
+    assert snapshot["items_per_sec"] == 0.0 and snapshot["eta"] is None and snapshot["workers"] == {}
+    assert progress.ProgressMonitor("empty", 0).finish()["percent"] == 100.0
+
+
+def test_dump_status_keeps_old_file_on_failure(tmpdir, monkeypatch):
+    status_path = str(tmpdir.join(progress.DEFAULT_STATUS_FILE))
+    progress.dump_status(status_path, {"completed": 1})
+
+    def _broken_dump(snapshot, fout, **kwargs):
+        fout.write("{\"completed\": ")
+        raise OSError("disk full")
+    monkeypatch.setattr(progress.json, "dump", _broken_dump)
+    progress.dump_status(status_path, {"completed": 2})
+    assert _load(status_path) == {"completed": 1}
+    assert os.listdir(str(tmpdir)) == [progress.DEFAULT_STATUS_FILE]
+
+    # Missing folder is only logged.
+    progress.dump_status(str(tmpdir.join("missing", progress.DEFAULT_STATUS_FILE)), {"completed": 3})
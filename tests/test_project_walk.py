@@ -0,0 +1,69 @@
+# !/bin/env python
+# -*- coding: utf-8 -*_
+"""
+
+    @FileName: test_project_walk.py
+    @Author: zengzhishi(zengzs1995@gmail.com)
+    @CreatTime: 2018-04-09 14:05:31
+    @LastModif: 2018-04-09 14:05:31
+    @Note:
+"""
+import os
+
+import capture.utils.project_walk as project_walk
+
+SUFFIX_KINDS = project_walk.build_suffix_kinds(["c", "cpp"], ["h"])
+
+
+def _touch(path):
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    open(path, "w").close()
+
+
+def test_classify():
+    assert project_walk.classify("a.c", SUFFIX_KINDS) == project_walk.SOURCE
+    assert project_walk.classify("a.tar.h", SUFFIX_KINDS) == project_walk.HEADER
+    assert project_walk.classify("Makefile.am", SUFFIX_KINDS) == project_walk.MAKEFILE_AM
+    assert project_walk.classify("CMakeLists.txt", SUFFIX_KINDS) == project_walk.CMAKELISTS
+    assert project_walk.classify("Makefile", SUFFIX_KINDS) is None
+
+
+def test_walk_prefers_and_hidden(tmpdir):
+    root = str(tmpdir)
+    for name in ["main.c", "src/a.c", "src/a.h", "src/sub/b.cpp", "src/.git/x.c", "other/c.c",
+                 "src/Makefile.am", "CMakeLists.txt", "README"]:
+        _touch(os.path.join(root, name))
+
+    walk = project_walk.ProjectWalk(root, ["src"], SUFFIX_KINDS, threads=2)
+    assert walk.folders == [root, os.path.join(root, "src"), os.path.join(root, "src", "sub")]
+    assert sorted(walk.files(project_walk.SOURCE)) == sorted([
+        os.path.join(root, "main.c"), os.path.join(root, "src", "a.c"), os.path.join(root, "src", "sub", "b.cpp")])
+    assert walk.files(project_walk.HEADER) == [os.path.join(root, "src", "a.h")]
+    assert walk.files(project_walk.MAKEFILE_AM) == [os.path.join(root, "src", "Makefile.am")]
+    assert walk.files(project_walk.CMAKELISTS) == [os.path.join(root, "CMakeLists.txt")]
+
+
+def test_walk_with_tree_index(tmpdir):
+    root = os.path.join(str(tmpdir), "project")
+    index_path = os.path.join(str(tmpdir), "tree_index.json")
+    for name in ["a.c", "src/b.c", "src/sub/c.h"]:
+        _touch(os.path.join(root, name))
+
+    def _walk():
+        walk = project_walk.ProjectWalk(root, ["src"], SUFFIX_KINDS, index_path=index_path)
+        return walk.folders, sorted(walk.files(project_walk.SOURCE)), walk.files(project_walk.HEADER)
+
+    first = _walk()
+    assert os.path.exists(index_path)
+    assert _walk() == first
+
+    # New file changes folder mtime, only that folder is listed again.
+    _touch(os.path.join(root, "src", "sub", "d.c"))
+    os.utime(os.path.join(root, "src", "sub"), ns=(1, 1))
+    index = project_walk.TreeIndex.load(index_path, root, SUFFIX_KINDS)
+    assert index.get(os.path.join(root, "src")) is not None
+    folders, sources, headers = _walk()
+    assert folders == first[0]
+    assert sources == sorted(first[1] + [os.path.join(root, "src", "sub", "d.c")])
+    assert headers == first[2]
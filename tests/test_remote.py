@@ -0,0 +1,184 @@
+# !/bin/env python
+# -*- coding: utf-8 -*_
+"""
+
+    @FileName: test_remote.py
+    @Author: zengzhishi(zengzs1995@gmail.com)
+    @CreatTime: 2018-04-21 16:38:27
+    @LastModif: 2018-04-21 16:38:27
+    @Note:
+"""
+import os
+import sys
+import time
+import shutil
+import socket
+import threading
+import contextlib
+
+import pytest
+
+import capture.remote as remote
+import capture.utils.preprocess as preprocess
+
+# Stand-in compiler, compiling takes a fixed time on any host.
+FAKE_COMPILER = """#!%s
+import sys, time
+time.sleep(0.3)
+with open(sys.argv[sys.argv.index("-o") + 1], "wb") as fout:
+    fout.write(open(sys.argv[sys.argv.index("-c") + 1], "rb").read().upper())
+""" % sys.executable
+TOKEN = "test-token"
+
+
+@contextlib.contextmanager
+def _workers(slots_list, allowed_compilers=None):
+    servers = [remote.WorkerServer(("127.0.0.1", 0), TOKEN, slots, allowed_compilers) for slots in slots_list]
+    threads = [threading.Thread(target=server.serve_forever) for server in servers]
+    for thread in threads:
+        thread.start()
+    try:
+        yield ["127.0.0.1:%d" % server.server_address[1] for server in servers]
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+        for thread in threads:
+            thread.join()
+
+
+def test_frame_roundtrip():
+    left, right = socket.socketpair()
+    with left, right:
+        remote.send_frame(left, {"type": "x", "n": 1}, b"abc" * 1000)
+        remote.send_frame(left, {"type": "y"})
+        assert remote.recv_frame(right) == ({"type": "x", "n": 1}, b"abc" * 1000)
+        assert remote.recv_frame(right) == ({"type": "y"}, b"")
+
+
+def test_capacity_aware_acquire():
+    with _workers([1, 3]) as addresses:
+        pool = remote.RemotePool.connect(addresses + ["127.0.0.1:1"], connect_timeout=1, token=TOKEN)
+        try:
+            assert pool.capacity == 4
+            nodes = [pool.acquire(block=False) for _ in range(4)]
+            assert [node.slots for node in nodes] == [3, 1, 3, 3]
+            assert pool.acquire(block=False) is None
+            for node in nodes:
+                pool.release(node)
+        finally:
+            pool.close()
+
+
+@pytest.mark.skipif(shutil.which("gcc") is None, reason="gcc is needed")
+def test_compile_on_worker(tmpdir):
+    tmpdir.join("a.h").write("#define VALUE 3\n")
+    tmpdir.join("a.c").write("#include \"a.h\"\nint a(void) { return VALUE; }\n")
+    tmpdir.join("bad.c").write("int a(void) { return }\n")
+    with _workers([2]) as addresses:
+        pool = remote.RemotePool.connect(addresses, token=TOKEN)
+        try:
+            unit = preprocess.CompileUnit.parse("gcc -g -I. -c a.c -o a.o", str(tmpdir), str(tmpdir.join("a.c")))
+            returncode, data = preprocess.preprocess(unit)
+            assert returncode == 0
+            assert pool.compile(unit, data) == (0, "")
+            with open(str(tmpdir.join("a.o")), "rb") as fin:
+                assert fin.read(4) == b"\x7fELF"
+
+            unit = preprocess.CompileUnit.parse("gcc -c bad.c -o bad.o", str(tmpdir), str(tmpdir.join("bad.c")))
+            returncode, output = pool.compile(unit, preprocess.preprocess(unit)[1])
+            assert returncode != 0 and "error" in output
+
+            # Compilers not allowed on worker are compiled locally by caller.
+            unit = preprocess.CompileUnit.parse("/bin/sh -c a.c -o a.o", str(tmpdir), str(tmpdir.join("a.c")))
+            assert pool.compile(unit, b"") is None
+            assert pool.stats() == {addresses[0]: 2}
+        finally:
+            pool.close()
+
+
+def test_wrong_token_is_refused():
+    with _workers([2]) as addresses:
+        pool = remote.RemotePool.connect(addresses, connect_timeout=1, token="wrong")
+        try:
+            assert pool.nodes == [] and pool.capacity == 0
+        finally:
+            pool.close()
+
+        # Compiling is refused before hello.
+        sock = socket.create_connection(remote.parse_address(addresses[0]), timeout=5)
+        with sock:
+            header, _ = remote.recv_frame(sock)
+            assert header["type"] == "challenge"
+            remote.send_frame(sock, {"type": "compile", "argv": ["gcc", "-c", remote.SOURCE_PLACEHOLDER, "-o",
+                                                                 remote.OUTPUT_PLACEHOLDER]}, b"int a;")
+            assert remote.recv_frame(sock)[0]["type"] == "error"
+
+
+def test_check_argv():
+    source, output = remote.SOURCE_PLACEHOLDER, remote.OUTPUT_PLACEHOLDER
+    assert remote.check_argv(["-O2", "-g", "-fPIC", "-Wall", "-Wno-error=format", "-std=c++11", "-march=native",
+                              "--param", "inline-unit-growth=20", "-fdebug-prefix-map=/src=.", "-c", source,
+                              "-o", output]) is None
+    for refused in (["@args.rsp"], ["-fplugin=./evil.so"], ["-fplugin", "evil"], ["-B/tmp/evil"], ["-wrapper", "sh"],
+                    ["-specs=/tmp/evil.specs"], ["--sysroot=/"], ["-Wl,-z,now"], ["-Wa,-I/etc"], ["-Xclang", "-load"],
+                    ["-mllvm", "-load=x.so"], ["-fprofile-use=../x"], ["/etc/passwd"], ["-isysroot/"]):
+        assert remote.check_argv(refused + ["-c", source, "-o", output]) is not None, refused
+    assert remote.check_argv(["-c", source, "-o", "/tmp/out.o"]) is not None
+    assert remote.check_argv(["-c", source, source, "-o", output]) is not None
+
+
+def test_refused_options_on_worker(tmpdir):
+    with _workers([1]) as addresses:
+        pool = remote.RemotePool.connect(addresses, token=TOKEN)
+        try:
+            # Coordinator compiles them locally, the worker is not blamed.
+            unit = preprocess.CompileUnit.parse("gcc -fplugin=./evil.so -c a.c -o a.o", str(tmpdir),
+                                                str(tmpdir.join("a.c")))
+            assert pool.compile(unit, b"int a;") is None
+            assert pool.nodes[0].failures == 0
+
+            # Worker refuses them from a coordinator not checking them.
+            node = pool.acquire()
+            sock = pool._open(node)
+            with sock:
+                remote.send_frame(sock, {"type": "compile", "argv": ["gcc", "@/etc/passwd", "-c",
+                                                                     remote.SOURCE_PLACEHOLDER, "-o",
+                                                                     remote.OUTPUT_PLACEHOLDER]}, b"int a;")
+                header, payload = remote.recv_frame(sock)
+            pool.release(node)
+            assert header["returncode"] == -1 and "not allowed" in header["output"] and payload == b""
+        finally:
+            pool.close()
+
+
+def _run_jobs(pool, units, data):
+    threads = [threading.Thread(target=pool.compile, args=(unit, data), kwargs={"block": True}) for unit in units]
+    start_time = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.time() - start_time
+
+
+def test_throughput_scales_with_workers(tmpdir):
+    compiler = str(tmpdir.join("fakecc"))
+    with open(compiler, "w") as fout:
+        fout.write(FAKE_COMPILER)
+    os.chmod(compiler, 0o755)
+    units = [preprocess.CompileUnit.parse([compiler, "-c", "a.c", "-o", "a%d.o" % i], str(tmpdir))
+             for i in range(8)]
+
+    elapsed = {}
+    for count in (1, 4):
+        with _workers([1] * count, allowed_compilers=["fakecc"]) as addresses:
+            pool = remote.RemotePool.connect(addresses, token=TOKEN)
+            try:
+                elapsed[count] = _run_jobs(pool, units, b"int a;")
+                assert sum(pool.stats().values()) == 8
+            finally:
+                pool.close()
+    with open(str(tmpdir.join("a7.o")), "rb") as fin:
+        assert fin.read() == b"INT A;"
+    assert elapsed[4] < elapsed[1] * 0.5
@@ -0,0 +1,75 @@
+# !/bin/env python
+# -*- coding: utf-8 -*_
+"""
+
+    @FileName: test_scheduler.py
+    @Author: zengzhishi(zengzs1995@gmail.com)
+    @CreatTime: 2018-04-16 14:47:25
+    @LastModif: 2018-04-16 14:47:25
+    @Note:
+"""
+import os
+import heapq
+
+import capture.pool.scheduler as scheduler
+
+
+def _command(file, kind=scheduler.KIND_OBJECT):
+    return {"directory": "/", "file": file, "command": "gcc -c %s -o /out/x.%s" % (file, kind)}
+
+
+def _makespan(durations, workers):
+    """Finish time of greedy dispatch in given order."""
+    finish_times = [0.0] * workers
+    for duration in durations:
+        heapq.heappush(finish_times, heapq.heappop(finish_times) + duration)
+    return max(finish_times)
+
+
+def test_command_kind():
+    assert scheduler.command_kind(_command("a.c")) == scheduler.KIND_OBJECT
+    assert scheduler.command_kind(_command("a.c", scheduler.KIND_BITCODE)) == scheduler.KIND_BITCODE
+    assert scheduler.command_kind({"file": "a.c", "arguments": ["clang", "-c", "a.c", "-o", "a.bc"]}) == \
+        scheduler.KIND_BITCODE
+
+
+def test_longest_first_with_timing_table(tmpdir):
+    path = os.path.join(str(tmpdir), scheduler.DEFAULT_TIMING_FILE)
+    table = scheduler.TimingTable.load(path)
+    durations = {"/a.c": 1.0, "/b.c": 30.0, "/c.c": 2.0}
+    for file, seconds in durations.items():
+        table.record(scheduler.timing_key(_command(file)), seconds)
+    table.save()
+
+    table = scheduler.TimingTable.load(path)
+    commands = [_command(file) for file in ["/a.c"] * 8 + ["/c.c"] * 4 + ["/b.c"]]
+    ordered = scheduler.order_commands(commands, table, co_schedule=False)
+    assert [command["file"] for command in ordered][:2] == ["/b.c", "/c.c"]
+
+    fifo = _makespan([durations[command["file"]] for command in commands], 4)
+    ljf = _makespan([durations[command["file"]] for command in ordered], 4)
+    assert ljf < fifo
+
+
+def test_source_weight_and_co_schedule(tmpdir):
+    small = os.path.join(str(tmpdir), "small.c")
+    big = os.path.join(str(tmpdir), "big.cpp")
+    with open(small, "w") as fout:
+        fout.write("int a;\n")
+    with open(big, "w") as fout:
+        fout.write("#include <vector>\n  # include \"a.h\"\n" + "int b;\n" * 100)
+    assert scheduler.source_weight(big) == os.path.getsize(big) * 3
+
+    commands = [_command(small), _command(small, scheduler.KIND_BITCODE), _command(big),
+                _command(big, scheduler.KIND_BITCODE)]
+    ordered = scheduler.order_commands(commands, scheduler.TimingTable())
+    assert [command["file"] for command in ordered] == [big, big, small, small]
+
+
+def test_group_pairs():
+    commands = [_command("/b.c", scheduler.KIND_BITCODE), _command("/a.c"), _command("/b.c"),
+                _command("/c.c"), _command("/c.c"), _command("/a.c", scheduler.KIND_BITCODE)]
+    tasks = scheduler.group_pairs(commands)
+    assert [[(command["file"], scheduler.command_kind(command)) for command in task] for task in tasks] == [
+        [("/b.c", "o"), ("/b.c", "bc")], [("/a.c", "o"), ("/a.c", "bc")], [("/c.c", "o")], [("/c.c", "o")]]
+
@@ -0,0 +1,40 @@
+# !/bin/env python
+# -*- coding: utf-8 -*_
+"""
+
+    @FileName: test_server.py
+    @Author: zengzhishi(zengzs1995@gmail.com)
+    @CreatTime: 2018-04-12 15:21:50
+    @LastModif: 2018-04-12 15:21:50
+    @Note:
+"""
+import io
+import os
+import logging
+import threading
+
+import capture.server as server
+
+logger = logging.getLogger("capture")
+
+
+def _fake_capture(args, process_pool=None):
+    logger.info("capture %s" % args["project_root_path"])
+    if args.get("fail"):
+        raise RuntimeError("fail")
+
+
+def test_request_roundtrip(tmpdir):
+    socket_path = os.path.join(str(tmpdir), "capture.sock")
+    capture_server = server.CaptureServer(socket_path, _fake_capture, None)
+    thread = threading.Thread(target=capture_server.serve_forever)
+    thread.start()
+    try:
+        output = io.StringIO()
+        assert server.request(socket_path, {"project_root_path": "/p"}, output) == 0
+        assert "capture /p" in output.getvalue()
+        assert server.request(socket_path, {"project_root_path": "/p", "fail": True}, io.StringIO()) == 1
+    finally:
+        capture_server.shutdown()
+        capture_server.server_close()
+        thread.join()
@@ -0,0 +1,47 @@
+# !/bin/env python
+# -*- coding: utf-8 -*_
+"""
+
+    @FileName: test_spawn.py
+    @Author: zengzhishi(zengzs1995@gmail.com)
+    @CreatTime: 2018-04-17 14:20:51
+    @LastModif: 2018-04-17 14:20:51
+    @Note:
+"""
+import os
+import sys
+
+import capture.utils.spawn as spawn
+
+
+def test_split_command():
+    assert spawn.split_command('gcc -DNAME="\\"a b\\"" -c a.c') == ["gcc", '-DNAME="a b"', "-c", "a.c"]
+    assert spawn.split_command("gcc -DV='1.0' -I/inc -c a.c") == ["gcc", "-DV=1.0", "-I/inc", "-c", "a.c"]
+    for command in ["echo | gcc -E -", "gcc `pkg-config --cflags x` a.c", "gcc $CFLAGS a.c", "gcc *.c",
+                    "cd src && make", "CC=gcc make", "make > log 2>&1", "gcc 'unbalanced"]:
+        assert spawn.split_command(command) is None, command
+
+
+def test_run_direct_and_shell(tmpdir):
+    returncode, output, truncated = spawn.run([sys.executable, "-c", "import sys; print(1); sys.exit(3)"])
+    assert (returncode, output.strip(), truncated) == (3, b"1", False)
+
+    # Working directory is changed by subprocess, stderr is merged.
+    returncode, output, _ = spawn.run("%s -c 'import os, sys; sys.stderr.write(os.getcwd())'" % sys.executable,
+                                      cwd=str(tmpdir))
+    assert returncode == 0 and output.decode("utf8") == os.path.realpath(str(tmpdir))
+
+    returncode, output, _ = spawn.run("echo abc | tr a-c x-z")
+    assert output.strip() == b"xyz"
+
+    returncode, output, _ = spawn.run("echo abc", capture=False)
+    assert returncode == 0 and output is None
+
+    assert spawn.run(["/no/such/compiler", "-c", "a.c"])[0] == -1
+
+
+def test_run_output_cap():
+    returncode, output, truncated = spawn.run([sys.executable, "-c", "print('x' * 100000)"], max_output=1000)
+    assert returncode == 0
+    assert output == b"x" * 1000
+    assert truncated
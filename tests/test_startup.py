@@ -0,0 +1,51 @@
+# !/bin/env python
+# -*- coding: utf-8 -*_
+"""
+
+    @FileName: test_startup.py
+    @Author: zengzhishi(zengzs1995@gmail.com)
+    @CreatTime: 2018-04-13 14:36:08
+    @LastModif: 2018-04-13 14:36:08
+    @Note:
+"""
+import os
+import sys
+import json
+import subprocess
+
+import capture.utils.capture_util as capture_util
+import capture.conf.settings as settings
+
+PROJECT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_lazy_module():
+    sys.modules.pop("colorsys", None)
+    colorsys = capture_util.lazy_module("colorsys")
+    assert "colorsys" in sys.modules
+    assert colorsys.rgb_to_hsv(0, 0, 0) == (0, 0, 0)
+    assert capture_util.lazy_module("colorsys") is colorsys
+
+    try:
+        capture_util.lazy_module("no_such_capture_module")
+        assert False
+    except ImportError:
+        pass
+
+
+def test_settings_shared():
+    assert settings.get_settings() is settings.get_settings()
+    assert "c" in settings.get_settings().source_file_suffix
+
+
+def test_heavy_modules_not_imported():
+    # Loaded lazy modules keep the _LazyModule type until they are used.
+    script = "import sys, json, build_capture\n" \
+             "print(json.dumps([name for name, module in sys.modules.items()\n" \
+             "                  if name.split('.')[0] in ('redis', 'psutil', 'ply')\n" \
+             "                  or name.startswith('capture.utils.parse_')\n" \
+             "                  if type(module).__name__ != '_LazyModule']))\n"
+    # Config is found from package folder, not current directory.
+    output = subprocess.check_output([sys.executable, "-c", script], cwd=os.path.join(PROJECT_PATH, "tests"),
+                                     env=dict(os.environ, PYTHONPATH=PROJECT_PATH))
+    assert json.loads(output.decode("utf8")) == []
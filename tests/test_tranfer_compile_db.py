@@ -0,0 +1,66 @@
+# !/bin/env python
+# -*- coding: utf-8 -*_
+"""
+
+    @FileName: test_tranfer_compile_db.py
+    @Author: zengzhishi(zengzs1995@gmail.com)
+    @CreatTime: 2018-04-09 10:20:31
+    @LastModif: 2018-04-09 10:20:31
+    @Note: Benchmark of compile_db transfer with synthetic 100k entries database.
+"""
+import os
+import time
+
+import build_capture
+
+ENTRIES_COUNT = 100000
+LEFT_COUNT = 5000
+ROOT_PATH = "/synthetic/project"
+# Time of 10x entries over time of 1x entries, it is 10-20 for linear time (caches and gc of more objects), and
+# over 100 for quadratic time.
+MAX_SCALING_RATIO = 50
+
+
+def _synthetic_compile_db(entries_count, left_count):
+    """Compile_db entries in 100 folders, and walked sources not built by any entry."""
+    files_s = []
+    compile_db = []
+    for i in range(entries_count):
+        folder = os.path.join(ROOT_PATH, "module%d" % (i % 100))
+        source_file = os.path.join(folder, "file%d.c" % i)
+        files_s.append(source_file)
+        compile_db.append({
+            "directory": folder,
+            "file": "file%d.c" % i,
+            "arguments": ["-g", "-DMODULE=%d" % (i % 100), "-I" + folder, "-I" + ROOT_PATH],
+            "compiler": "C",
+        })
+    for i in range(left_count):
+        files_s.append(os.path.join(ROOT_PATH, "tools", "tool%d.cc" % i))
+    sub_paths = [ROOT_PATH] + [os.path.join(ROOT_PATH, "module%d" % i) for i in range(100)]
+    return sub_paths, files_s, compile_db
+
+
+def _tranfer(synthetic_compile_db):
+    sub_paths, files_s, compile_db = synthetic_compile_db
+    builder = build_capture.CaptureBuilder(ROOT_PATH, "/synthetic/output", build_type="make")
+    start_time = time.perf_counter()
+    result = builder._tranfer_compile_db(sub_paths, list(files_s), [], compile_db)
+    return result, time.perf_counter() - start_time
+
+
+def test_tranfer_compile_db_benchmark():
+    (source_infos, include_files, files_count), elapsed = _tranfer(_synthetic_compile_db(ENTRIES_COUNT, LEFT_COUNT))
+
+    assert files_count == ENTRIES_COUNT + LEFT_COUNT
+    # One target for each module flag set, plus the two default c/cxx targets.
+    assert len(source_infos) == 100 + 2
+    assert sum(len(info["source_files"]) for info in source_infos[:-2]) == ENTRIES_COUNT
+    assert source_infos[-2]["source_files"] == []
+    assert len(source_infos[-1]["source_files"]) == LEFT_COUNT
+
+    # Linear time, list.remove based implementation took minutes here. Compared with a 10x smaller database on the
+    # same machine, the best of a few runs hides scheduling noise of the small one.
+    small_db = _synthetic_compile_db(ENTRIES_COUNT // 10, LEFT_COUNT // 10)
+    small_elapsed = min(_tranfer(small_db)[1] for _ in range(3))
+    assert elapsed / small_elapsed < MAX_SCALING_RATIO
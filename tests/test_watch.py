@@ -0,0 +1,81 @@
+# !/bin/env python
+# -*- coding: utf-8 -*_
+"""
+
+    @FileName: test_watch.py
+    @Author: zengzhishi(zengzs1995@gmail.com)
+    @CreatTime: 2018-04-11 16:02:19
+    @LastModif: 2018-04-11 16:02:19
+    @Note:
+"""
+import os
+
+import capture.watch as watch
+
+
+def test_classify_change():
+    assert watch.classify_change("CMakeLists.txt", watch.IN_CLOSE_WRITE) == watch.CHANGE_BUILD
+    assert watch.classify_change("Makefile.am", watch.IN_MOVED_TO) == watch.CHANGE_BUILD
+    assert watch.classify_change("main.c", watch.IN_CREATE) == watch.CHANGE_SOURCES
+    assert watch.classify_change("main.c", watch.IN_CLOSE_WRITE) is None
+    assert watch.classify_change("main.h", watch.IN_CREATE) is None
+    assert watch.classify_change("src", watch.IN_CREATE | watch.IN_ISDIR) == watch.CHANGE_SOURCES
+    assert watch.classify_change("", watch.IN_Q_OVERFLOW) == watch.CHANGE_BUILD
+
+
+def test_inotify_events(tmpdir):
+    inotify = watch.Inotify()
+    try:
+        inotify.add_watch(str(tmpdir))
+        open(os.path.join(str(tmpdir), "a.c"), "w").close()
+        events = inotify.read_events(1.0)
+        assert (str(tmpdir), "a.c", watch.IN_CREATE) in events
+    finally:
+        inotify.close()
+
+
+class _Builder(object):
+    """Builder producing entries of its sources, and recording how compile databases are written."""
+    def __init__(self, sources):
+        self.sources = sources
+        self.dumps = []
+        self.patches = []
+
+    def reset_project_walk(self):
+        pass
+
+    def scan_project(self):
+        return list(self.sources.items()), [], len(self.sources)
+
+    def select_prebuild_infos(self, source_infos):
+        return source_infos
+
+    def build_commands(self, source_infos, generate_bitcode):
+        entries = [{"directory": "/project", "file": source, "command": "gcc %s -c %s" % (flags, source)}
+                   for source, flags in source_infos]
+        return entries, []
+
+    def dump_commands(self, db_name, compile_commands):
+        self.dumps.append(db_name)
+
+    def patch_commands(self, db_name, changes, compile_commands):
+        self.patches.append((db_name, changes, len(compile_commands)))
+
+
+def test_watcher_patches_changed_sources():
+    builder = _Builder({"/project/a.c": "", "/project/b.c": "", "/project/src/c.c": ""})
+    watcher = watch.CaptureWatcher(lambda: builder)
+    assert watcher.capture(rebuild=True) == ["compile_commands", "compile_commands_bc"]
+    assert builder.dumps == ["compile_commands", "compile_commands_bc"]
+
+    assert watcher.capture() == []
+    assert builder.patches == []
+
+    builder.sources["/project/b.c"] = "-DB"
+    del builder.sources["/project/src/c.c"]
+    builder.sources["/project/src/d.c"] = ""
+    assert watcher.capture(rebuild=True) == ["compile_commands"]
+    db_name, changes, count = builder.patches[0]
+    assert db_name == "compile_commands" and count == 3
+    assert sorted(changes) == ["/project/b.c", "/project/src/c.c", "/project/src/d.c"]
+    assert changes["/project/src/c.c"] == [] and changes["/project/b.c"][0]["command"] == "gcc -DB -c /project/b.c"
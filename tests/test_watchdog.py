@@ -0,0 +1,73 @@
+# !/bin/env python
+# -*- coding: utf-8 -*_
+"""
+
+    @FileName: test_watchdog.py
+    @Author: zengzhishi(zengzs1995@gmail.com)
+    @CreatTime: 2018-04-19 14:05:42
+    @LastModif: 2018-04-19 14:05:42
+    @Note:
+"""
+import sys
+import time
+import threading
+
+import capture.pool.async_exec as async_exec
+import capture.pool.watchdog as watchdog
+import capture.utils.spawn as spawn
+
+MB = 1024 * 1024
+
+
+def _hog(mb, seconds=30):
+    return [sys.executable, "-c", "import time; data = b'x' * %d; time.sleep(%d)" % (mb * MB, seconds)]
+
+
+def test_rss_limit_kill_with_spawn():
+    with watchdog.Watchdog(interval=0.1, memory_percent=0, max_rss=40 * MB) as dog:
+        assert watchdog.current() is dog
+        handle = dog.handle()
+        start_time = time.time()
+        returncode, _, _ = spawn.run(_hog(100), capture=False, watcher=handle)
+        assert time.time() - start_time < 10
+        assert returncode != 0 and handle.killed == watchdog.KILL_RSS_LIMIT
+
+        # Small commands are not killed.
+        handle = dog.handle()
+        assert spawn.run([sys.executable, "-c", "pass"], watcher=handle)[0] == 0
+        assert handle.killed is None
+    assert watchdog.current() is None
+    assert dog.stats()["kills"][watchdog.KILL_RSS_LIMIT] == 1
+
+
+def test_timeout_kill_with_async_runner():
+    with watchdog.Watchdog(interval=0.1, memory_percent=0, timeout=0.5):
+        results = async_exec.run_jobs([_hog(1), [sys.executable, "-c", "pass"]], limit=2)
+    assert results[0].killed == watchdog.KILL_TIMEOUT and results[0].returncode != 0
+    assert results[1].killed is None and results[1].returncode == 0
+
+
+def test_memory_pressure_kills_largest(monkeypatch):
+    monkeypatch.setattr(watchdog, "memory_used_percent", lambda: 99.0)
+    dog = watchdog.Watchdog(interval=60, memory_percent=94)
+    handles = [dog.handle(), dog.handle()]
+    results = [None, None]
+
+    def _run(i, mb):
+        results[i] = spawn.run(_hog(mb, 5), capture=False, watcher=handles[i])[0]
+
+    threads = [threading.Thread(target=_run, args=(0, 10)), threading.Thread(target=_run, args=(1, 80))]
+    for thread in threads:
+        thread.start()
+    time.sleep(1.5)
+    dog.check()
+    for thread in threads:
+        thread.join()
+    assert handles[1].killed == watchdog.KILL_MEMORY_PRESSURE and results[1] != 0
+    assert handles[0].killed is None and results[0] == 0
+    assert dog.stats()["killed"] == 1
+
+
+def test_sample_group_rss():
+    assert watchdog.sample_group_rss([]) == {}
+    assert 0 < watchdog.memory_used_percent() < 100